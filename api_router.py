@@ -3,13 +3,92 @@ FastAPI ルーターモジュール
 OCR APIのエンドポイントを定義
 """
 
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import JSONResponse
-from typing import Optional
+import time
 
-from image_loader import load_image_from_file, SUPPORTED_EXTENSIONS
-from deepseek_ocr_engine import ocr_engine
+# モジュール読み込みの開始時刻（起動から準備完了までの時間の計測用）
+IMPORT_STARTED = time.perf_counter()
 
+import asyncio
+import glob
+import json
+import os
+import zipfile
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
+from fastapi.exception_handlers import http_exception_handler
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from typing import AsyncIterator, Awaitable, Dict, List, Optional, Tuple, TypeVar, Union
+
+from image_loader import is_pdf, is_archive, open_archive, SUPPORTED_EXTENSIONS
+from deepseek_ocr_engine import (
+    ocr_engine, IncrementalTextExtractor, RemoteEngine, MAX_IN_FLIGHT,
+    DEFAULT_PRIORITY, ENGINE_SOCKET, check_priority, deadline_after
+)
+from worker_pool import worker_pool
+from result_cache import result_cache
+from feature_cache import feature_cache
+from job_queue import job_queue, recover_jobs, JobProgress, JOB_STORE, STATUS_SUCCEEDED, STATUS_FAILED
+from grounding import GroundingParser, parse_grounding
+from generation_monitor import token_budget
+from page_screen import CropMode, parse_crop_mode, is_blank, content_density, resolve_crop_mode
+from roi import parse_rois, offset_regions
+from ocr_pipeline import (
+    ocr_file, ocr_prompts, load_and_preprocess, skip_blank, build_result, cached_result, store_result,
+    result_cache_key, require_engine
+)
+from uploads import UploadLimitMiddleware, open_upload, memory_budget
+from metrics import (
+    REGISTRY, STAGE_SECONDS, IN_FLIGHT_REQUESTS, QUEUED_REQUESTS, HEALTHY_REPLICAS, QUEUED_JOBS, RUNNING_JOBS,
+    MEMORY_RESERVED_BYTES, STARTUP_SECONDS, FEATURE_CACHE_BYTES, record_error
+)
+
+# モジュール読み込みの所要時間
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+
+
+# クライアント切断を確認する間隔（秒）
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# バッチ内で同時に処理するファイル数の上限
+BATCH_CONCURRENCY = int(os.environ.get('OCR_BATCH_CONCURRENCY', str(MAX_IN_FLIGHT)))
+
+# ウォームアップに使う入力ファイルのディレクトリ
+WARMUP_DIR = os.environ.get(
+    'OCR_WARMUP_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testdata', 'inputs')
+)
+
+# ウォームアップに使う入力ファイル（WARMUP_DIRからの相対パスまたはglobパターン、カンマ区切り。空の場合は無効）
+WARMUP_INPUTS = [
+    pattern.strip()
+    for pattern in os.environ.get('OCR_WARMUP_INPUTS', 'IMG_8288.jpg,receipt_000112.pdf').split(',')
+    if pattern.strip()
+]
+
+# 起動状態（starting: エンジン初期化中, warming_up: ウォームアップ中, ready: 準備完了, failed: 初期化失敗）
+STARTUP_STARTING = 'starting'
+STARTUP_WARMING_UP = 'warming_up'
+STARTUP_READY = 'ready'
+STARTUP_FAILED = 'failed'
+
+# レスポンス形式（text: テキストと生出力, regions: グラウンディングの領域を追加）
+OUTPUT_FORMATS = ('text', 'regions')
+
+# prompts に名前で指定できるプロンプト
+PROMPT_PROFILES = {
+    'free_ocr': '<image>\n<Free OCR.',
+    'markdown': '<image>\n<|grounding|>Convert the document to markdown.',
+    'ocr': '<image>\n<|grounding|>OCR this image.',
+    'figure': '<image>\nParse the figure.',
+    'describe': '<image>\nDescribe this image in detail.'
+}
+
+# 1リクエストで指定できるプロンプト数の上限
+MAX_PROMPTS = int(os.environ.get('OCR_MAX_PROMPTS', '8'))
+
+# HTTPワーカープロセス数（2以上の場合はエンジンを engine_server.py の別プロセスで実行し、各ワーカーが共有する）
+FRONTEND_WORKERS = int(os.environ.get('OCR_FRONTEND_WORKERS', '1'))
+
+T = TypeVar("T")
 
 # FastAPIアプリケーション初期化
 app = FastAPI(
@@ -18,13 +97,129 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# リクエストボディのサイズ制限（上限を超えるアップロードはバッファリング前に413）
+app.add_middleware(UploadLimitMiddleware)
+
+# 推論中・待機中の件数は出力時に取得
+IN_FLIGHT_REQUESTS.set_function(ocr_engine.in_flight_count)
+QUEUED_REQUESTS.set_function(ocr_engine.queued_count)
+HEALTHY_REPLICAS.set_function(ocr_engine.healthy_count)
+QUEUED_JOBS.set_function(lambda: job_queue.stats()["queued_jobs"])
+RUNNING_JOBS.set_function(lambda: job_queue.stats()["running_jobs"])
+MEMORY_RESERVED_BYTES.set_function(memory_budget.reserved_bytes)
+FEATURE_CACHE_BYTES.set_function(feature_cache.bytes_used)
+
+
+@app.exception_handler(HTTPException)
+async def count_http_exception(request: Request, exc: HTTPException):
+    """
+    HTTPエラーをメトリクスに記録してから標準のエラーレスポンスを返す
+    """
+    record_error(exc)
+    return await http_exception_handler(request, exc)
+
+
+# 起動状態とフェーズごとの所要時間（秒）
+startup_state: Dict[str, object] = {
+    "status": STARTUP_STARTING,
+    "error": None,
+    "timings": {"import": round(IMPORT_SECONDS, 3)}
+}
+_startup_task: Optional[asyncio.Task] = None
+
+
+def _record_startup_phase(phase: str, seconds: float):
+    startup_state["timings"][phase] = round(seconds, 3)
+    STARTUP_SECONDS.set(seconds, phase=phase)
+
 
 @app.on_event("startup")
 async def startup_event():
     """
-    アプリケーション起動時にOCRエンジンを初期化
+    アプリケーション起動時にワーカープールを起動し、OCRエンジンの初期化をバックグラウンドで開始
+
+    初期化中もliveness（/health/live）には応答し、準備完了まではreadiness（/health/ready）が503を返す。
+    """
+    global _startup_task
+    STARTUP_SECONDS.set(IMPORT_SECONDS, phase="import")
+    worker_pool.start()
+    _startup_task = asyncio.create_task(_start_engine())
+
+
+async def _start_engine():
+    """
+    OCRエンジンの初期化、ウォームアップ、ジョブキューの起動を順に行い、準備完了にする
+    """
+    try:
+        started = time.perf_counter()
+        await ocr_engine.initialize()
+        _record_startup_phase("engine_init", time.perf_counter() - started)
+
+        startup_state["status"] = STARTUP_WARMING_UP
+        started = time.perf_counter()
+        # エンジンサーバーを共有する場合は、最初に要求した1つのワーカーのみがウォームアップする
+        if not isinstance(ocr_engine, RemoteEngine) or await ocr_engine.claim_warm_up():
+            await _warm_up()
+        else:
+            print("ウォームアップは他のワーカーが実行します")
+        _record_startup_phase("warmup", time.perf_counter() - started)
+
+        # 複数のHTTPワーカーの場合、実行中のまま残ったジョブは親プロセスでキュー待ちに戻している
+        await job_queue.start(_run_job, recover=FRONTEND_WORKERS <= 1)
+    except Exception as e:
+        startup_state["status"] = STARTUP_FAILED
+        startup_state["error"] = f"{type(e).__name__}: {e}"
+        print(f"OCRエンジンの起動に失敗しました: {startup_state['error']}")
+        return
+
+    _record_startup_phase("total", time.perf_counter() - IMPORT_STARTED)
+    startup_state["status"] = STARTUP_READY
+    timings = startup_state["timings"]
+    print(
+        f"準備完了: 起動から{timings['total']:.1f}秒 "
+        f"(モジュール読み込み {timings['import']:.1f}秒, エンジン初期化 {timings['engine_init']:.1f}秒, "
+        f"ウォームアップ {timings['warmup']:.1f}秒)"
+    )
+
+
+def _warmup_files() -> List[str]:
+    """
+    ウォームアップに使う入力ファイルの一覧（見つからないパターンは読み飛ばす）
+    """
+    paths: List[str] = []
+    for pattern in WARMUP_INPUTS:
+        matches = sorted(glob.glob(os.path.join(WARMUP_DIR, pattern)))
+        if not matches:
+            print(f"ウォームアップ用のファイルが見つかりません: {pattern}")
+        paths.extend(path for path in matches if path.lower().endswith(SUPPORTED_EXTENSIONS))
+    return paths
+
+
+async def _warm_up():
+    """
+    代表的な入力をデコードから推論・テキスト抽出まで通し、初回リクエストのコンパイル等のコストを先に払う
+
+    結果キャッシュは使わず、各ファイルをレプリカ数だけ並行に投入して全レプリカを温める。
+    ウォームアップの失敗は記録のみ行い、起動は継続する。
     """
-    await ocr_engine.initialize()
+    for path in _warmup_files():
+        filename = os.path.basename(path)
+        with open(path, 'rb') as f:
+            file_content = f.read()
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(
+                ocr_file(file_content, filename, True, '<image>\n<Free OCR.', use_cache=False)
+                for _ in ocr_engine.replicas
+            ),
+            return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        elapsed = time.perf_counter() - started
+        if errors:
+            print(f"ウォームアップに失敗しました: {filename}: {errors[0]}")
+        else:
+            print(f"ウォームアップ完了: {filename} ({elapsed:.1f}秒)")
 
 
 @app.on_event("shutdown")
@@ -32,7 +227,12 @@ async def shutdown_event():
     """
     アプリケーション終了時のクリーンアップ
     """
+    if _startup_task is not None and not _startup_task.done():
+        _startup_task.cancel()
+        await asyncio.gather(_startup_task, return_exceptions=True)
+    await job_queue.stop()
     ocr_engine.shutdown()
+    worker_pool.shutdown()
 
 
 @app.get("/")
@@ -46,7 +246,17 @@ async def root():
         "supported_formats": SUPPORTED_EXTENSIONS,
         "endpoints": {
             "/ocr": "POST - 画像/PDFファイルからテキストを抽出",
-            "/health": "GET - ヘルスチェック"
+            "/ocr/stream": "POST - OCR結果を生成途中から逐次返す（SSE/NDJSON）",
+            "/ocr/batch": "POST - 複数ファイル/ZIPファイルからまとめてテキストを抽出",
+            "/health": "GET - ヘルスチェック",
+            "/health/live": "GET - liveness（プロセスが動作しているか）",
+            "/health/ready": "GET - readiness（リクエストを受け付けられるか）",
+            "/metrics": "GET - Prometheus形式のメトリクス",
+            "/metrics/engine": "GET - エンジンサーバーのメトリクス（エンジンを別プロセスで実行している場合）",
+            "/cache/stats": "GET - 結果キャッシュの統計情報",
+            "/jobs": "POST - OCRジョブを投入（ジョブIDを即時に返す）",
+            "/jobs/{job_id}": "GET - ジョブの状態と進捗",
+            "/jobs/{job_id}/result": "GET - ジョブの結果"
         }
     }
 
@@ -58,18 +268,211 @@ async def health_check():
     """
     return {
         "status": "healthy",
+        "startup": startup_state,
         "engine_initialized": ocr_engine.is_initialized(),
+        "in_flight_requests": ocr_engine.in_flight_count(),
+        "queued_requests": ocr_engine.queued_count(),
+        "healthy_replicas": ocr_engine.healthy_count(),
+        "replicas": ocr_engine.stats(),
+        **job_queue.stats(),
+        **memory_budget.stats(),
         "supported_formats": SUPPORTED_EXTENSIONS
     }
 
 
+@app.get("/health/live")
+async def liveness():
+    """
+    livenessエンドポイント（エンジンの初期化に失敗した場合のみ503）
+    """
+    if startup_state["status"] == STARTUP_FAILED:
+        return JSONResponse(
+            status_code=503,
+            content={"status": STARTUP_FAILED, "error": startup_state["error"]}
+        )
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
+async def readiness():
+    """
+    readinessエンドポイント（初期化とウォームアップが完了し、推論可能なレプリカがある場合のみ200）
+    """
+    ready = startup_state["status"] == STARTUP_READY and ocr_engine.is_initialized()
+    content = {
+        "status": STARTUP_READY if ready else startup_state["status"],
+        "healthy_replicas": ocr_engine.healthy_count(),
+        "startup_seconds": startup_state["timings"]
+    }
+    return JSONResponse(status_code=200 if ready else 503, content=content)
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus形式のメトリクスエンドポイント
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/metrics/engine")
+async def engine_metrics():
+    """
+    エンジンサーバーのメトリクスエンドポイント（エンジンを別プロセスで実行している場合のみ）
+
+    生成トークン数・打ち切りなどエンジン側で記録するメトリクスは、HTTPワーカーの /metrics には含まれない。
+    """
+    if not isinstance(ocr_engine, RemoteEngine):
+        raise HTTPException(
+            status_code=404,
+            detail="OCRエンジンはこのプロセス内で実行されています（/metrics を参照してください）"
+        )
+    try:
+        text = await ocr_engine.render_metrics()
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=503, detail=f"エンジンサーバーに接続できません: {e}")
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """
+    結果キャッシュの統計情報エンドポイント（features に画像特徴量キャッシュの統計情報）
+    """
+    return {**result_cache.stats(), "features": feature_cache.stats()}
+
+
+async def _cancel_on_disconnect(request: Request, awaitable: Awaitable[T]) -> T:
+    """
+    クライアントが切断した場合に処理をキャンセルしながら結果を待つ
+
+    キャンセルはエンジンまで伝播し、推論中のリクエストは中断される。
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                print("クライアントが切断したため処理を中断します")
+                task.cancel()
+                raise HTTPException(
+                    status_code=499,
+                    detail="クライアントが切断しました"
+                )
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+async def _read_upload(file: UploadFile) -> bytes:
+    """
+    アップロードファイルの内容を読み込み、読み込み時間を記録する
+    """
+    with STAGE_SECONDS.time(stage="upload_read"):
+        return await file.read()
+
+
+def _parse_prompts(prompts: str) -> List[Tuple[Optional[str], str]]:
+    """
+    prompts パラメータ（JSON配列）をプロンプトのリストに変換
+
+    各要素はプロンプト文字列、またはPROMPT_PROFILESの名前。
+
+    Returns:
+        List[Tuple[Optional[str], str]]: 指定順の（プロファイル名（名前で指定した場合）, プロンプト）
+
+    Raises:
+        HTTPException: 形式が不正、または上限を超えた場合（400）
+    """
+    try:
+        items = json.loads(prompts)
+    except ValueError:
+        items = None
+    if not isinstance(items, list) or not items or not all(isinstance(item, str) and item for item in items):
+        raise HTTPException(
+            status_code=400,
+            detail=f"promptsはプロンプトまたはプロファイル名（{', '.join(PROMPT_PROFILES)}）のJSON配列で指定してください"
+        )
+    if len(items) > MAX_PROMPTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"promptsに指定できるプロンプトは{MAX_PROMPTS}個までです（指定: {len(items)}個）"
+        )
+    return [(item, PROMPT_PROFILES[item]) if item in PROMPT_PROFILES else (None, item) for item in items]
+
+
+def _check_output_format(output_format: str):
+    if output_format not in OUTPUT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"サポートされていないレスポンス形式: {output_format} (text または regions)"
+        )
+
+
+def _with_regions(result: dict, output_format: str) -> dict:
+    """
+    output_formatがregionsの場合、生出力から解析した領域を結果に追加する
+    （複数ページモードではページごと、ROIモードでは領域ごと、複数プロンプトモードではプロンプトごと）
+
+    キャッシュから返す結果にも追加できるよう、領域は保存せずレスポンスの作成時に解析する。
+    """
+    if output_format != 'regions' or not result.get("success"):
+        return result
+    if "results" in result:
+        return {**result, "results": [_with_regions(item, output_format) for item in result["results"]]}
+    if "rois" in result:
+        # 切り出した画像内の座標を元の画像の座標に変換する
+        return {
+            **result,
+            "rois": [
+                {
+                    **roi,
+                    "regions": offset_regions(
+                        parse_grounding(
+                            roi["raw_output"],
+                            (roi["box"][2] - roi["box"][0], roi["box"][3] - roi["box"][1])
+                        ),
+                        roi["box"]
+                    )
+                }
+                for roi in result["rois"]
+            ]
+        }
+    if "pages" in result:
+        return {
+            **result,
+            "pages": [
+                {**page, "regions": parse_grounding(page["raw_output"], page.get("image_size"))}
+                for page in result["pages"]
+            ]
+        }
+    return {**result, "regions": parse_grounding(result["raw_output"], result.get("image_size"))}
+
+
 @app.post("/ocr")
 async def ocr_extract(
+    request: Request,
     file: UploadFile = File(..., description="画像またはPDFファイル"),
-    crop_mode: bool = Form(default=True, description="クロップモードを有効にするか"),
+    crop_mode: str = Form(default="true", description="クロップモード（true / false、または内容の密度から選択する auto）"),
     prompt: str = Form(
         default='<image>\n<Free OCR.',
         description="OCRプロンプト"
+    ),
+    all_pages: bool = Form(default=False, description="PDFの全ページを処理するか"),
+    first_page: Optional[int] = Form(default=None, description="PDFの処理開始ページ（1始まり）"),
+    last_page: Optional[int] = Form(default=None, description="PDFの処理終了ページ"),
+    output_format: str = Form(default="text", description="レスポンス形式（text または regions）"),
+    priority_class: str = Form(default=DEFAULT_PRIORITY, description="優先度クラス（interactive / normal / bulk）"),
+    timeout: Optional[float] = Form(default=None, description="タイムアウト（秒、超過時は504）"),
+    rois: Optional[str] = Form(
+        default=None,
+        description="処理する領域のJSON配列（[x1, y1, x2, y2] または {\"box\": [...], \"page\": n, \"id\": ...}）"
+    ),
+    prompts: Optional[str] = Form(
+        default=None,
+        description="複数のプロンプトまたはプロファイル名のJSON配列（指定時はpromptの代わりに使用）"
     )
 ):
     """
@@ -77,72 +480,596 @@ async def ocr_extract(
 
     Parameters:
     - file: 画像またはPDFファイル (PNG, JPG, JPEG, WEBP, BMP, TIFF, PDF)
-    - crop_mode: クロップモードを有効にするか (デフォルト: True)
+    - crop_mode: クロップモード。`true` / `false`、またはページ（領域）ごとに内容の密度から選択する `auto`
+      (デフォルト: true)
     - prompt: OCRプロンプト (デフォルト: '<image>\n<Free OCR.')
+    - all_pages: PDFの全ページを処理するか (デフォルト: False、1ページ目のみ)
+    - first_page: PDFの処理開始ページ（指定時は複数ページモード）
+    - last_page: PDFの処理終了ページ（指定時は複数ページモード）
+    - output_format: `text`、またはグラウンディングの領域を追加する `regions` (デフォルト: text)
+    - priority_class: 推論枠の優先度クラス `interactive` / `normal` / `bulk` (デフォルト: normal)
+    - timeout: タイムアウト秒数。推論枠の待機中・生成中に超過した場合は中断して504 (デフォルト: なし)
+    - rois: 処理する領域（元の画像のピクセル座標）のJSON配列。指定時は各領域を切り出して
+      個別に並行処理する（ROIモード、複数ページモードとは併用不可）
+    - prompts: プロンプトまたはプロファイル名（free_ocr, markdown, ocr, figure, describe）のJSON配列。
+      指定時は画像（PDFは1ページ目）を1回だけ読み込み・前処理し、各プロンプトの推論を並行に実行する
+      （複数プロンプトモード、複数ページモード・ROIモードとは併用不可）
 
     Returns:
     - success: 成功フラグ
-    - extracted_text: 抽出されたテキスト
+    - extracted_text: 抽出されたテキスト（複数ページモードではページ順に連結）
     - raw_output: モデルの生出力
+    - num_tokens: 生成トークン数（複数ページモードでは全ページの合計）
+    - truncated: 生成を打ち切った理由（repetition / low_entropy / stalled / max_tokens）、打ち切っていない場合はnull
+      （複数ページモード・ROIモードではページ・領域ごとにも返し、トップレベルは最初に打ち切った理由）
     - filename: 処理したファイル名
-    - crop_mode: 使用したクロップモード
+    - crop_mode: 使用したクロップモード（複数ページモード・ROIモードでは指定値で、ページ・領域ごとに使用した値も返す）
+    - skipped_blank: 白紙と判定して推論を省略した場合True（空の結果を返す。複数ページモード・ROIモードでは
+      ページ・領域ごとにも返し、トップレベルはすべてのページ・領域を省略した場合のみTrue）
+    - content_density: 内容の密度の推定値（0〜1、白紙の判定が無効な場合はnull。複数ページモード・ROIモードでは
+      ページ・領域ごとのみ）
+    - image_size: 元の画像サイズ [幅, 高さ]（PDFは300 DPIでのサイズ）
+    - pages: ページごとの結果（複数ページモードのみ）
+    - rois: 指定順の領域ごとの index, id, page, box（画像の範囲に切り詰めた座標）, image_size,
+      extracted_text, raw_output, num_tokens（ROIモードのみ）
+    - results: 指定順のプロンプトごとの profile, prompt と単一プロンプトの場合と同じ結果
+      （複数プロンプトモードのみ。このモードではトップレベルは success, filename, crop_mode, results のみ）
+    - regions: 領域ごとの type（text / table / image / title）, label, text,
+      boxes（ピクセル座標）, normalized_boxes（0〜999）（output_format=regionsの場合のみ）
+    - timings: 処理ステージごとの所要時間（ミリ秒）
+    - cached: キャッシュされた結果を返した場合True
     """
+    _check_output_format(output_format)
+    check_priority(priority_class)
+    crop_mode = parse_crop_mode(crop_mode)
+    deadline = deadline_after(timeout)
     try:
-        # エンジンの初期化チェック
-        if not ocr_engine.is_initialized():
-            raise HTTPException(
-                status_code=503,
-                detail="OCRエンジンが初期化されていません。しばらく待ってから再度お試しください。"
+        page_range = None
+        if is_pdf(file.filename) and (all_pages or first_page is not None or last_page is not None):
+            page_range = (1 if first_page is None else first_page, last_page)
+
+        roi_list = None
+        if rois is not None:
+            if page_range is not None:
+                raise HTTPException(
+                    status_code=400,
+                    detail="roisは複数ページモード（all_pages, first_page, last_page）と併用できません。ページは各領域のpageで指定してください"
+                )
+            roi_list = parse_rois(rois, is_pdf(file.filename))
+
+        if prompts is not None:
+            if page_range is not None or roi_list is not None:
+                raise HTTPException(
+                    status_code=400,
+                    detail="promptsは複数ページモード（all_pages, first_page, last_page）・roisと併用できません"
+                )
+            prompt_list = _parse_prompts(prompts)
+            with open_upload(file.file) as file_content:
+                results = await _cancel_on_disconnect(
+                    request, ocr_prompts(
+                        file_content, file.filename, crop_mode, prompt_list,
+                        priority=priority_class, deadline=deadline
+                    )
+                )
+            return JSONResponse(content=_with_regions({
+                "success": True,
+                "filename": file.filename,
+                "crop_mode": crop_mode,
+                "results": results
+            }, output_format))
+
+        # アップロードファイルをコピーせずに参照してOCR実行（クライアント切断時は推論を中断）
+        with open_upload(file.file) as file_content:
+            result = await _cancel_on_disconnect(
+                request, ocr_file(
+                    file_content, file.filename, crop_mode, prompt, page_range,
+                    priority=priority_class, deadline=deadline, rois=roi_list
+                )
             )
+        return JSONResponse(content=_with_regions(result, output_format))
 
-        # ファイル内容を読み込み
-        file_content = await file.read()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"OCR処理中にエラーが発生しました: {str(e)}"
+        )
 
-        # 画像を読み込み（RGB形式）
-        image = load_image_from_file(file_content, file.filename)
 
-        # 画像の前処理
-        if '<image>' in prompt:
-            image_features = ocr_engine.preprocess_image(
-                image=image,
-                crop_mode=crop_mode
+async def _ocr_batch_source(
+    item: Tuple[str, Union[UploadFile, zipfile.ZipFile]],
+    crop_mode: CropMode,
+    prompt: str,
+    priority: str,
+    deadline: Optional[float]
+) -> dict:
+    """
+    バッチの1要素（アップロードファイルまたはZIP内のファイル）を読み込んでOCRする
+
+    アップロードファイルはコピーせずに参照し、ZIP内のファイルは展開して読み込む。
+    """
+    filename, source = item
+    if isinstance(source, zipfile.ZipFile):
+        file_content = await asyncio.to_thread(source.read, filename)
+        return await ocr_file(file_content, filename, crop_mode, prompt, priority=priority, deadline=deadline)
+    with open_upload(source.file) as file_content:
+        return await ocr_file(file_content, filename, crop_mode, prompt, priority=priority, deadline=deadline)
+
+
+async def _ocr_batch_item(
+    index: int,
+    item: Tuple[str, Union[UploadFile, zipfile.ZipFile]],
+    crop_mode: CropMode,
+    prompt: str,
+    output_format: str,
+    priority: str,
+    deadline: Optional[float],
+    slots: asyncio.Semaphore
+) -> dict:
+    """
+    バッチの1要素をOCRする
+
+    エラーは要素ごとに結果へ格納し、バッチ全体は失敗させない。
+    """
+    filename = item[0]
+    async with slots:
+        try:
+            result = _with_regions(
+                await _ocr_batch_source(item, crop_mode, prompt, priority, deadline), output_format
             )
+        except HTTPException as e:
+            record_error(e)
+            result = {
+                "success": False,
+                "filename": filename,
+                "status_code": e.status_code,
+                "error": e.detail
+            }
+        except Exception as e:
+            record_error(e)
+            result = {
+                "success": False,
+                "filename": filename,
+                "status_code": 500,
+                "error": f"OCR処理中にエラーが発生しました: {str(e)}"
+            }
+    return {"index": index, **result}
+
+
+@app.post("/ocr/batch")
+async def ocr_batch(
+    request: Request,
+    files: List[UploadFile] = File(..., description="画像/PDFファイル、またはそれらを含むZIPファイル"),
+    crop_mode: str = Form(default="true", description="クロップモード（true / false、または内容の密度から選択する auto）"),
+    prompt: str = Form(
+        default='<image>\n<Free OCR.',
+        description="OCRプロンプト"
+    ),
+    stream: bool = Form(default=False, description="完了した要素から順にNDJSONで返すか"),
+    output_format: str = Form(default="text", description="レスポンス形式（text または regions）"),
+    priority_class: str = Form(default="bulk", description="優先度クラス（interactive / normal / bulk）"),
+    timeout: Optional[float] = Form(default=None, description="バッチ全体のタイムアウト（秒、超過した要素は504）")
+):
+    """
+    複数の画像/PDFファイルからまとめてテキストを抽出するエンドポイント
+
+    各ファイルはエンジンへ並行に投入され、vLLM内でバッチ処理される。
+    1ファイルの失敗はそのファイルの結果にのみ記録される。
+
+    Parameters:
+    - files: 画像/PDFファイル（複数可）、またはそれらを含むZIPファイル
+    - crop_mode: クロップモード。`true` / `false`、またはページ（領域）ごとに内容の密度から選択する `auto`
+      (デフォルト: true)
+    - prompt: OCRプロンプト (デフォルト: '<image>\n<Free OCR.')
+    - stream: Trueの場合、完了した要素から順にNDJSONで返す (デフォルト: False)
+    - output_format: `text` または `regions`（/ocr と同じ、デフォルト: text）
+    - priority_class: 優先度クラス（/ocr と同じ、デフォルト: bulk）
+    - timeout: バッチ全体のタイムアウト秒数。超過した要素はstatus_code 504で失敗 (デフォルト: なし)
+
+    Returns:
+    - success: 成功フラグ
+    - total / succeeded / failed: 要素数と成功・失敗数
+    - results: 入力順の要素ごとの結果（index, success, /ocr と同じ項目またはerror）
+    """
+    _check_output_format(output_format)
+    check_priority(priority_class)
+    crop_mode = parse_crop_mode(crop_mode)
+    deadline = deadline_after(timeout)
+    require_engine()
+
+    # ZIPファイルは中のファイルに展開
+    items: List[Tuple[str, Union[UploadFile, zipfile.ZipFile]]] = []
+    archives: List[zipfile.ZipFile] = []
+    for upload in files:
+        if is_archive(upload.filename):
+            archive, member_names = open_archive(upload.file, upload.filename)
+            archives.append(archive)
+            items.extend((name, archive) for name in member_names)
         else:
-            image_features = None
+            items.append((upload.filename, upload))
 
-        # OCR推論実行
-        raw_output = await ocr_engine.generate(
-            image_features=image_features,
-            prompt=prompt
-        )
+    if not items:
+        for archive in archives:
+            archive.close()
+        raise HTTPException(status_code=400, detail="処理対象のファイルがありません")
 
-        # テキスト抽出
-        extracted_text = ocr_engine.extract_text(raw_output)
+    # 待ち行列が溢れないよう、バッチ内の同時実行数を制限
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+    tasks = [
+        asyncio.create_task(_ocr_batch_item(
+            index, item, crop_mode, prompt, output_format, priority_class, deadline, slots
+        ))
+        for index, item in enumerate(items)
+    ]
 
-        return JSONResponse(content={
+    def close_batch():
+        for task in tasks:
+            task.cancel()
+        for archive in archives:
+            archive.close()
+
+    def summary(results: List[dict]) -> dict:
+        succeeded = sum(1 for result in results if result["success"])
+        return {
             "success": True,
-            "extracted_text": extracted_text,
-            "raw_output": raw_output,
-            "filename": file.filename,
-            "crop_mode": crop_mode
-        })
+            "total": len(results),
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded
+        }
+
+    if stream:
+        async def result_stream() -> AsyncIterator[str]:
+            results = []
+            try:
+                for next_result in asyncio.as_completed(tasks):
+                    result = await next_result
+                    results.append(result)
+                    yield json.dumps({"event": "result", **result}, ensure_ascii=False) + "\n"
+                yield json.dumps({"event": "done", **summary(results)}, ensure_ascii=False) + "\n"
+            finally:
+                close_batch()
+
+        return StreamingResponse(
+            result_stream(),
+            media_type="application/x-ndjson",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    try:
+        results = await _cancel_on_disconnect(request, asyncio.gather(*tasks))
+    finally:
+        close_batch()
+
+    return JSONResponse(content={**summary(results), "results": results})
+
+
+async def _run_job(job: dict, file_content: bytes, progress: JobProgress) -> dict:
+    """
+    ジョブキューから呼び出されるOCR処理
+    """
+    params = job["params"]
+    page_range = tuple(params["page_range"]) if params.get("page_range") else None
+    try:
+        return await ocr_file(
+            file_content,
+            job["filename"],
+            params["crop_mode"],
+            params["prompt"],
+            page_range,
+            progress,
+            priority=params.get("priority_class", "bulk")
+        )
+    except Exception as e:
+        record_error(e)
+        raise
+
+
+def _job_status(job: dict) -> dict:
+    """
+    ジョブ状態のレスポンスを作成する（結果本体は含めない）
+    """
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "priority": job["priority"],
+        "filename": job["filename"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "progress": job["progress"],
+        "error": job["error"]
+    }
+
+
+async def _get_job(job_id: str) -> dict:
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"ジョブが見つかりません: {job_id}"
+        )
+    return job
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(
+    file: UploadFile = File(..., description="画像またはPDFファイル"),
+    crop_mode: str = Form(default="true", description="クロップモード（true / false、または内容の密度から選択する auto）"),
+    prompt: str = Form(
+        default='<image>\n<Free OCR.',
+        description="OCRプロンプト"
+    ),
+    all_pages: bool = Form(default=False, description="PDFの全ページを処理するか"),
+    first_page: Optional[int] = Form(default=None, description="PDFの処理開始ページ（1始まり）"),
+    last_page: Optional[int] = Form(default=None, description="PDFの処理終了ページ"),
+    priority: int = Form(default=0, description="優先度（小さいほど優先）"),
+    output_format: str = Form(default="text", description="結果の形式（text または regions）"),
+    priority_class: str = Form(default="bulk", description="推論枠の優先度クラス（interactive / normal / bulk）")
+):
+    """
+    OCRジョブを投入し、ジョブIDを即時に返すエンドポイント
+
+    Parameters:
+    - file / crop_mode / prompt / all_pages / first_page / last_page / output_format: /ocr と同じ
+    - priority: ジョブキュー内の優先度（小さいほど優先、デフォルト: 0）
+    - priority_class: エンジンの推論枠の優先度クラス（/ocr と同じ、デフォルト: bulk）
+
+    Returns:
+    - job_id: ジョブID
+    - status: ジョブの状態（queued）
+    """
+    if not file.filename.lower().endswith(SUPPORTED_EXTENSIONS):
+        raise HTTPException(
+            status_code=400,
+            detail=f"サポートされていないファイル形式: {file.filename}. 対応形式: {SUPPORTED_EXTENSIONS}"
+        )
+    _check_output_format(output_format)
+    check_priority(priority_class)
+    crop_mode = parse_crop_mode(crop_mode)
+
+    page_range = None
+    if is_pdf(file.filename) and (all_pages or first_page is not None or last_page is not None):
+        page_range = [1 if first_page is None else first_page, last_page]
+
+    file_content = await _read_upload(file)
+    job = await job_queue.submit(
+        file_content,
+        file.filename,
+        {
+            "crop_mode": crop_mode,
+            "prompt": prompt,
+            "page_range": page_range,
+            "output_format": output_format,
+            "priority_class": priority_class
+        },
+        priority
+    )
+    return _job_status(job)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    ジョブの状態と進捗を返すエンドポイント
+
+    Returns:
+    - status: queued / running / succeeded / failed
+    - progress: tokens_generated（生成トークン数）, pages_done, pages_total
+    """
+    return _job_status(await _get_job(job_id))
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """
+    ジョブの結果を返すエンドポイント
+
+    完了前は409、失敗したジョブはジョブのエラー内容を返す。
+    成功した場合は /ocr と同じ形式の結果を返す。
+    """
+    job = await _get_job(job_id)
+    if job["status"] == STATUS_SUCCEEDED:
+        return JSONResponse(content=_with_regions(job["result"], job["params"].get("output_format", "text")))
+    if job["status"] == STATUS_FAILED:
+        raise HTTPException(
+            status_code=job["status_code"] or 500,
+            detail=job["error"]
+        )
+    raise HTTPException(
+        status_code=409,
+        detail=f"ジョブはまだ完了していません（状態: {job['status']}）"
+    )
+
+
+def _format_event(stream_format: str, event: str, data: dict) -> str:
+    """
+    ストリーミングイベントをSSEまたはNDJSON形式に変換する
+    """
+    if stream_format == "ndjson":
+        return json.dumps({"event": event, **data}, ensure_ascii=False) + "\n"
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/ocr/stream")
+async def ocr_stream(
+    request: Request,
+    file: UploadFile = File(..., description="画像またはPDFファイル"),
+    crop_mode: str = Form(default="true", description="クロップモード（true / false、または内容の密度から選択する auto）"),
+    prompt: str = Form(
+        default='<image>\n<Free OCR.',
+        description="OCRプロンプト"
+    ),
+    stream_format: str = Form(default="sse", description="ストリーム形式（sse または ndjson）"),
+    output_format: str = Form(default="text", description="レスポンス形式（text または regions）"),
+    priority_class: str = Form(default=DEFAULT_PRIORITY, description="優先度クラス（interactive / normal / bulk）"),
+    timeout: Optional[float] = Form(default=None, description="タイムアウト（秒）")
+):
+    """
+    画像/PDFファイルからテキストを抽出し、生成途中の出力を逐次返すエンドポイント
+
+    Parameters:
+    - file: 画像またはPDFファイル（PDFは1ページ目のみ）
+    - crop_mode: クロップモード。`true` / `false`、またはページ（領域）ごとに内容の密度から選択する `auto`
+      (デフォルト: true)
+    - prompt: OCRプロンプト (デフォルト: '<image>\n<Free OCR.')
+    - stream_format: `sse`（Server-Sent Events）または `ndjson`
+    - output_format: `regions` の場合、確定した領域を region イベントでも返す (デフォルト: text)
+    - priority_class / timeout: /ocr と同じ（ストリーム開始後の期限切れは error イベント）
+
+    Events:
+    - delta: 生成された差分テキスト（delta, num_tokens）
+    - line: 確定した `<|ref|>text<|/ref|>` のテキスト行（text）
+    - region: 確定したグラウンディングの領域（/ocr の regions の要素。output_format=regionsの場合のみ）
+    - done: 最終結果（/ocr と同じ項目。キャッシュヒット時・白紙と判定した場合はこのイベントのみ）
+    - error: ストリーム開始後に発生したエラー（detail）
+    """
+    if stream_format not in ("sse", "ndjson"):
+        raise HTTPException(
+            status_code=400,
+            detail=f"サポートされていないストリーム形式: {stream_format} (sse または ndjson)"
+        )
+    _check_output_format(output_format)
+    check_priority(priority_class)
+    crop_mode = parse_crop_mode(crop_mode)
+    deadline = deadline_after(timeout)
+
+    media_type = "application/x-ndjson" if stream_format == "ndjson" else "text/event-stream"
+    stream_headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+    try:
+        # アップロードファイルはコピーせずに参照し、前処理が終わるまで使用する
+        with open_upload(file.file) as file_content:
+            # キャッシュヒット時は最終結果のみを返す
+            cache_key = result_cache_key(file_content, crop_mode, prompt, priority=priority_class)
+            cached = cached_result(cache_key, file.filename)
+            if cached is not None:
+                event = _format_event(stream_format, "done", _with_regions(cached, output_format))
+                return StreamingResponse(iter([event]), media_type=media_type, headers=stream_headers)
+
+            # エンジンの初期化チェック
+            require_engine()
+
+            timings: Dict[str, float] = {}
+            image_features, image_size, screen = await load_and_preprocess(
+                file_content, file.filename, crop_mode, prompt, timings
+            )
+        used_crop_mode = resolve_crop_mode(crop_mode, screen)
+
+        # 白紙の画像は推論せずに空の最終結果のみを返す
+        if is_blank(screen):
+            result = store_result(cache_key, build_result(
+                file.filename, await skip_blank(), image_size, used_crop_mode, screen, timings
+            ))
+            event = _format_event(stream_format, "done", _with_regions(result, output_format))
+            return StreamingResponse(iter([event]), media_type=media_type, headers=stream_headers)
+
+        # 最初の出力までをレスポンス開始前に待つことで、混雑(429)などをHTTPステータスで返す
+        started = time.perf_counter()
+        chunks = ocr_engine.generate_stream(
+            image_features=image_features, prompt=prompt, priority=priority_class, deadline=deadline,
+            max_tokens=token_budget(image_size, used_crop_mode, content_density(screen))
+        )
+        first_chunk = await _cancel_on_disconnect(request, chunks.__anext__())
+        timings["first_token_ms"] = round((time.perf_counter() - started) * 1000, 2)
 
     except HTTPException:
         raise
+    except StopAsyncIteration:
+        first_chunk = None
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"OCR処理中にエラーが発生しました: {str(e)}"
         )
 
+    async def event_stream() -> AsyncIterator[str]:
+        extractor = IncrementalTextExtractor()
+        region_parser = GroundingParser(image_size) if output_format == 'regions' else None
+        regions: List[dict] = []
+        raw_output = ""
+        num_tokens = 0
+        truncated = None
+        try:
+            chunk = first_chunk
+            while chunk is not None:
+                raw_output = chunk["text"]
+                num_tokens = chunk["num_tokens"]
+                truncated = chunk["truncated"]
+                if chunk["delta"]:
+                    yield _format_event(stream_format, "delta", {
+                        "delta": chunk["delta"],
+                        "num_tokens": chunk["num_tokens"]
+                    })
+                    for line in extractor.feed(chunk["delta"]):
+                        yield _format_event(stream_format, "line", {"text": line})
+                    if region_parser is not None:
+                        for region in region_parser.feed(chunk["delta"]):
+                            regions.append(region)
+                            yield _format_event(stream_format, "region", region)
+                chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            pass
+        except Exception as e:
+            record_error(e)
+            detail = e.detail if isinstance(e, HTTPException) else f"OCR処理中にエラーが発生しました: {str(e)}"
+            yield _format_event(stream_format, "error", {"detail": detail})
+            return
+        finally:
+            await chunks.aclose()
+
+        for line in extractor.flush():
+            yield _format_event(stream_format, "line", {"text": line})
+        if region_parser is not None:
+            for region in region_parser.flush():
+                regions.append(region)
+                yield _format_event(stream_format, "region", region)
+
+        timings["generate_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        result = store_result(cache_key, build_result(
+            file.filename, (raw_output, num_tokens, truncated), image_size, used_crop_mode, screen, timings
+        ))
+        if region_parser is not None:
+            result["regions"] = regions
+        yield _format_event(stream_format, "done", result)
+
+    return StreamingResponse(event_stream(), media_type=media_type, headers=stream_headers)
+
 
 if __name__ == "__main__":
     import uvicorn
 
-    # サーバー起動
-    uvicorn.run(
-        app,
-        host="0.0.0.0",
-        port=8000,
-        log_level="info"
-    )
+    if FRONTEND_WORKERS <= 1:
+        # サーバー起動
+        uvicorn.run(
+            app,
+            host="0.0.0.0",
+            port=8000,
+            log_level="info"
+        )
+    else:
+        # 実行中のまま残ったジョブは、ワーカーを起動する前にここで1回だけキュー待ちに戻す
+        if JOB_STORE == 'sqlite':
+            recovered = recover_jobs()
+            if recovered:
+                print(f"実行中だったジョブをキュー待ちに戻しました: {recovered}件")
+
+        # エンジンサーバーを1プロセスだけ起動し（OCR_ENGINE_SOCKET 指定時は起動済みのものを使う）、
+        # 各HTTPワーカーはソケット経由で接続する。ワーカーは環境変数を引き継いで起動される
+        engine_process = None
+        if not ENGINE_SOCKET:
+            from engine_server import start_engine_process, DEFAULT_ENGINE_SOCKET
+            engine_process = start_engine_process(DEFAULT_ENGINE_SOCKET)
+            os.environ['OCR_ENGINE_SOCKET'] = DEFAULT_ENGINE_SOCKET
+        try:
+            uvicorn.run(
+                "api_router:app",
+                host="0.0.0.0",
+                port=8000,
+                workers=FRONTEND_WORKERS,
+                log_level="info"
+            )
+        finally:
+            if engine_process is not None:
+                engine_process.terminate()
+                engine_process.join()
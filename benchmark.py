@@ -0,0 +1,739 @@
+"""
+ベンチマークモジュール
+testdata/inputs のファイルを指定した並列数でOCRし、レイテンシ・スループット・ステージ別の所要時間を計測
+
+使用例:
+    # 起動中のAPIサーバーに対して計測
+    python3 benchmark.py --target http --url http://localhost:8000 --concurrency 8 --requests 100
+
+    # GPUなしでCPU側の処理（読み込み・前処理・テキスト抽出）を計測（フェイクバックエンド）
+    python3 benchmark.py --target local --backend fake --concurrency 4 --output bench.json
+
+    # 前回の結果と比較
+    python3 benchmark.py --target local --compare bench.json
+
+    # 画像読み込みの比較（元の解像度 vs モデル入力解像度への縮小）
+    python3 benchmark.py --loader-comparison --backend vllm --crop-mode true,false
+
+    # n-gram繰り返し抑制のトークンあたりのオーバーヘッドを比較（従来実装 vs ベクトル化）
+    python3 benchmark.py --logits-microbenchmark
+"""
+
+import argparse
+import asyncio
+import difflib
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+# デフォルトの入力ファイル
+DEFAULT_INPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testdata', 'inputs')
+
+# デフォルトのプロンプト
+DEFAULT_PROMPT = '<image>\n<Free OCR.'
+
+# 集計するパーセンタイル
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    線形補間でパーセンタイルを計算
+
+    Args:
+        values: 値のリスト
+        q: パーセンタイル（0〜100）
+
+    Returns:
+        float: パーセンタイル値（値がない場合は0.0）
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """
+    値の分布（平均・最小・最大・パーセンタイル）を集計
+    """
+    summary = {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 2) if values else 0.0,
+        "min": round(min(values), 2) if values else 0.0,
+        "max": round(max(values), 2) if values else 0.0
+    }
+    for q in PERCENTILES:
+        summary[f"p{q}"] = round(percentile(values, q), 2)
+    return summary
+
+
+def build_workload(
+    files: List[str],
+    crop_modes: List[bool],
+    prompts: List[str],
+    num_requests: int,
+    seed: int
+) -> List[Tuple[str, bool, str]]:
+    """
+    ファイル・クロップモード・プロンプトの組み合わせから、再現可能な順序のリクエスト列を作成
+
+    Returns:
+        List[Tuple[str, bool, str]]: (ファイルパス, クロップモード, プロンプト) のリスト
+    """
+    combinations = [
+        (path, crop_mode, prompt)
+        for path in files
+        for crop_mode in crop_modes
+        for prompt in prompts
+    ]
+    workload = [combinations[i % len(combinations)] for i in range(num_requests)]
+    random.Random(seed).shuffle(workload)
+    return workload
+
+
+class HTTPTarget:
+    """
+    起動中のAPIサーバーの /ocr にリクエストを送る計測対象
+    """
+
+    name = 'http'
+
+    def __init__(self, url: str, all_pages: bool = False, timeout: float = 600.0):
+        self.url = url.rstrip('/')
+        self.all_pages = all_pages
+        self.timeout = timeout
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def _post(self, file_content: bytes, filename: str, crop_mode: bool, prompt: str) -> Tuple[int, dict]:
+        boundary = uuid.uuid4().hex
+        fields = {
+            "crop_mode": "true" if crop_mode else "false",
+            "prompt": prompt,
+            "all_pages": "true" if self.all_pages else "false"
+        }
+        body = b""
+        for name, value in fields.items():
+            body += (
+                f"--{boundary}\r\n"
+                f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                f"{value}\r\n"
+            ).encode('utf-8')
+        body += (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n"
+        ).encode('utf-8') + file_content + f"\r\n--{boundary}--\r\n".encode('utf-8')
+
+        request = urllib.request.Request(
+            f"{self.url}/ocr",
+            data=body,
+            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+            method="POST"
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                detail = json.loads(e.read())
+            except ValueError:
+                detail = {}
+            return e.code, detail
+
+    async def run(self, file_content: bytes, filename: str, crop_mode: bool, prompt: str) -> Tuple[int, dict]:
+        return await asyncio.to_thread(self._post, file_content, filename, crop_mode, prompt)
+
+
+class LocalTarget:
+    """
+    APIサーバーを起動せず、同じプロセス内でOCR処理（読み込み・前処理・推論・テキスト抽出）を実行する計測対象
+
+    結果キャッシュ・画像特徴量キャッシュは計測を歪めるため、use_cache=Falseの場合は参照・保存しない
+    （繰り返し送信する同じファイルでも毎回デコードと前処理を計測する）。
+    """
+
+    name = 'local'
+
+    def __init__(self, all_pages: bool = False, use_cache: bool = False):
+        self.all_pages = all_pages
+        self.use_cache = use_cache
+        self.api = None
+
+    async def start(self):
+        import api_router
+        from fastapi import HTTPException
+
+        self.api = api_router
+        self.http_exception = HTTPException
+        api_router.worker_pool.start()
+        await api_router.ocr_engine.initialize()
+
+    async def stop(self):
+        self.api.ocr_engine.shutdown()
+        self.api.worker_pool.shutdown()
+
+    async def run(self, file_content: bytes, filename: str, crop_mode: bool, prompt: str) -> Tuple[int, dict]:
+        page_range = (1, None) if self.all_pages and self.api.is_pdf(filename) else None
+        try:
+            result = await self.api.ocr_file(
+                file_content, filename, crop_mode, prompt, page_range, use_cache=self.use_cache
+            )
+        except self.http_exception as e:
+            return e.status_code, {"detail": e.detail}
+        except Exception as e:
+            return 500, {"detail": str(e)}
+        return 200, result
+
+
+def _result_timings(result: dict) -> List[Dict[str, float]]:
+    """
+    レスポンスからステージ別の所要時間を取り出す（複数ページの場合はページごと）
+    """
+    if result.get("pages"):
+        return [page.get("timings", {}) for page in result["pages"]]
+    return [result["timings"]] if result.get("timings") else []
+
+
+async def run_benchmark(
+    target,
+    workload: List[Tuple[str, bool, str]],
+    concurrency: int,
+    warmup: int = 0
+) -> dict:
+    """
+    ワークロードを指定した並列数で実行し、結果を集計
+
+    Args:
+        target: 計測対象（HTTPTarget または LocalTarget）
+        workload: (ファイルパス, クロップモード, プロンプト) のリスト
+        concurrency: 同時に実行するリクエスト数
+        warmup: 先頭から計測前に順に実行するリクエスト数（集計に含めない）
+
+    Returns:
+        dict: 集計結果
+    """
+    contents: Dict[str, bytes] = {}
+    for path, _, _ in workload:
+        if path not in contents:
+            with open(path, 'rb') as f:
+                contents[path] = f.read()
+
+    for path, crop_mode, prompt in workload[:warmup]:
+        await target.run(contents[path], os.path.basename(path), crop_mode, prompt)
+    workload = workload[warmup:]
+
+    semaphore = asyncio.Semaphore(concurrency)
+    records: List[dict] = []
+
+    async def run_one(index: int, path: str, crop_mode: bool, prompt: str):
+        async with semaphore:
+            started = time.perf_counter()
+            status, result = await target.run(contents[path], os.path.basename(path), crop_mode, prompt)
+            latency_ms = (time.perf_counter() - started) * 1000
+        records.append({
+            "index": index,
+            "file": os.path.basename(path),
+            "crop_mode": crop_mode,
+            "prompt": prompt,
+            "status": status,
+            "latency_ms": latency_ms,
+            "num_tokens": result.get("num_tokens", 0) if status == 200 else 0,
+            "cached": result.get("cached", False) if status == 200 else False,
+            "timings": _result_timings(result) if status == 200 else []
+        })
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_one(index, path, crop_mode, prompt)
+        for index, (path, crop_mode, prompt) in enumerate(workload)
+    ))
+    wall_seconds = time.perf_counter() - started
+
+    succeeded = [record for record in records if record["status"] == 200]
+    errors: Dict[str, int] = {}
+    for record in records:
+        if record["status"] != 200:
+            errors[str(record["status"])] = errors.get(str(record["status"]), 0) + 1
+
+    stages: Dict[str, List[float]] = {}
+    for record in succeeded:
+        for timings in record["timings"]:
+            for key, value in timings.items():
+                stages.setdefault(key, []).append(value)
+
+    by_file: Dict[str, List[float]] = {}
+    for record in succeeded:
+        by_file.setdefault(record["file"], []).append(record["latency_ms"])
+
+    # キャッシュから返した結果は生成していないためトークン数に含めない
+    total_tokens = sum(record["num_tokens"] for record in succeeded if not record["cached"])
+    return {
+        "requests": len(records),
+        "succeeded": len(succeeded),
+        "failed": len(records) - len(succeeded),
+        "cached": sum(1 for record in succeeded if record["cached"]),
+        "errors": errors,
+        "wall_seconds": round(wall_seconds, 3),
+        "requests_per_second": round(len(succeeded) / wall_seconds, 3) if wall_seconds else 0.0,
+        "tokens_per_second": round(total_tokens / wall_seconds, 1) if wall_seconds else 0.0,
+        "total_tokens": total_tokens,
+        "latency_ms": summarize([record["latency_ms"] for record in succeeded]),
+        "stages_ms": {key: summarize(values) for key, values in sorted(stages.items())},
+        "files_latency_ms": {key: summarize(values) for key, values in sorted(by_file.items())},
+        "records": sorted(records, key=lambda record: record["index"])
+    }
+
+
+def _peak_rss_kb() -> int:
+    """
+    プロセスのピークメモリ（KB）
+
+    ru_maxrssはexec前のプロセスの値を引き継ぐため、Linuxでは /proc の VmHWM を優先する。
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _measure_load(path: str, crop_mode: Optional[bool]) -> dict:
+    """
+    画像を1回読み込み、読み込み時間とピークメモリ増加量を計測する（計測ごとに新しいプロセスで実行）
+    """
+    from image_loader import load_image_from_file
+
+    with open(path, 'rb') as f:
+        file_content = f.read()
+    baseline_kb = _peak_rss_kb()
+    started = time.perf_counter()
+    image = load_image_from_file(file_content, os.path.basename(path), crop_mode)
+    elapsed = time.perf_counter() - started
+    peak_kb = _peak_rss_kb()
+    return {
+        "decode_ms": round(elapsed * 1000, 2),
+        "peak_rss_delta_mb": round((peak_kb - baseline_kb) / 1024, 1),
+        "size": list(image.size)
+    }
+
+
+def _model_views(image, crop_mode: bool) -> list:
+    """
+    DeepseekOCRProcessorと同じ変換で、モデルに入力される全体画像とタイル画像を作成
+    """
+    from PIL import ImageOps
+    from inference_backend import BASE_SIZE, IMAGE_SIZE, crop_grid
+
+    views = [ImageOps.pad(image, (BASE_SIZE, BASE_SIZE), color=(127, 127, 127))]
+    grid = crop_grid(*image.size) if crop_mode else (1, 1)
+    if grid != (1, 1):
+        views.append(image.resize((IMAGE_SIZE * grid[0], IMAGE_SIZE * grid[1])))
+    return views
+
+
+def _psnr(views_a: list, views_b: list) -> float:
+    """
+    モデル入力画像どうしのPSNR（dB、同一の場合は inf）
+    """
+    import numpy as np
+
+    if [view.size for view in views_a] != [view.size for view in views_b]:
+        return 0.0
+    squared_errors = [
+        np.mean((np.asarray(a, dtype=np.float32) - np.asarray(b, dtype=np.float32)) ** 2)
+        for a, b in zip(views_a, views_b)
+    ]
+    mse = float(np.mean(squared_errors))
+    return float('inf') if mse == 0 else round(10 * np.log10(255 ** 2 / mse), 2)
+
+
+async def run_loader_comparison(
+    files: List[str],
+    crop_modes: List[bool],
+    prompt: str,
+    run_ocr: bool
+) -> List[dict]:
+    """
+    元の解像度での読み込みと、モデル入力解像度への縮小読み込みを比較
+
+    読み込み時間とピークメモリ（別プロセスで計測）、モデル入力画像のPSNRを比較し、
+    run_ocrの場合は両方の画像でOCRを実行して抽出テキストの一致率を求める。
+    """
+    from image_loader import load_image_from_file
+    from deepseek_ocr_engine import ocr_engine, preprocess_image_features
+
+    if run_ocr:
+        await ocr_engine.initialize()
+
+    context = multiprocessing.get_context('spawn')
+
+    def measure(path: str, crop_mode: Optional[bool]) -> dict:
+        # ピークメモリは前の計測の影響を受けないよう毎回新しいプロセスで計測
+        with context.Pool(1) as pool:
+            return pool.apply(_measure_load, (path, crop_mode))
+
+    results = []
+    try:
+        for path in files:
+            with open(path, 'rb') as f:
+                file_content = f.read()
+            filename = os.path.basename(path)
+            for crop_mode in crop_modes:
+                full_image = load_image_from_file(file_content, filename, None)
+                adaptive_image = load_image_from_file(file_content, filename, crop_mode)
+                result = {
+                    "file": filename,
+                    "crop_mode": crop_mode,
+                    "full": measure(path, None),
+                    "adaptive": measure(path, crop_mode),
+                    "model_input_psnr_db": _psnr(
+                        _model_views(full_image, crop_mode),
+                        _model_views(adaptive_image, crop_mode)
+                    )
+                }
+
+                if run_ocr:
+                    texts = []
+                    for image in (full_image, adaptive_image):
+                        raw_output = await ocr_engine.generate(
+                            image_features=preprocess_image_features(image, crop_mode),
+                            prompt=prompt
+                        )
+                        texts.append(ocr_engine.extract_text(raw_output))
+                    result["text_similarity"] = round(
+                        difflib.SequenceMatcher(None, texts[0], texts[1]).ratio(), 4
+                    )
+                results.append(result)
+    finally:
+        if run_ocr:
+            ocr_engine.shutdown()
+    return results
+
+
+def print_loader_comparison(results: List[dict]):
+    """
+    画像読み込みの比較結果を表示
+    """
+    print(f"{'ファイル':<20} {'crop':<5} {'サイズ(元→縮小)':<26} {'読込ms(元→縮小)':<18} "
+          f"{'メモリMB(元→縮小)':<18} {'PSNR':>7} {'テキスト一致':>10}")
+    for result in results:
+        full, adaptive = result["full"], result["adaptive"]
+        sizes = f"{full['size'][0]}x{full['size'][1]}→{adaptive['size'][0]}x{adaptive['size'][1]}"
+        similarity = result.get("text_similarity")
+        print(
+            f"{result['file']:<20} {str(result['crop_mode']):<5} {sizes:<26} "
+            f"{full['decode_ms']:>7.1f}→{adaptive['decode_ms']:<8.1f} "
+            f"{full['peak_rss_delta_mb']:>7.1f}→{adaptive['peak_rss_delta_mb']:<8.1f} "
+            f"{result['model_input_psnr_db']:>7} {similarity if similarity is not None else '-':>10}"
+        )
+
+
+def _reference_ngram_ban(input_ids: List[int], scores, ngram_size: int, window_size: int, whitelist: set):
+    """
+    DeepSeek-OCRの NoRepeatNGramLogitsProcessor と同じ処理（比較用）
+    """
+    if len(input_ids) < ngram_size:
+        return scores, set()
+    current_prefix = tuple(input_ids[-(ngram_size - 1):])
+    search_start = max(0, len(input_ids) - window_size)
+    search_end = len(input_ids) - ngram_size + 1
+    banned_tokens = set()
+    for i in range(search_start, search_end):
+        ngram = tuple(input_ids[i:i + ngram_size])
+        if ngram[:-1] == current_prefix:
+            banned_tokens.add(ngram[-1])
+    banned_tokens = banned_tokens - whitelist
+    if banned_tokens:
+        scores = scores.copy()
+        for token in banned_tokens:
+            scores[token] = -float("inf")
+    return scores, banned_tokens
+
+
+def _synthetic_output(length: int, seed: int) -> List[int]:
+    """
+    OCR出力を模したトークン列（通常のテキストと、表の行のような長い繰り返しを含む）
+    """
+    from inference_backend import NGRAM_WHITELIST_TOKEN_IDS
+
+    rng = random.Random(seed)
+    cell_tokens = sorted(NGRAM_WHITELIST_TOKEN_IDS)
+    tokens: List[int] = []
+    while len(tokens) < length:
+        if len(tokens) > 100 and rng.random() < 0.3:
+            # 直前の区間の繰り返し（禁止トークンが発生する）
+            start = rng.randrange(max(0, len(tokens) - 80), len(tokens) - 40)
+            tokens.extend(tokens[start:start + rng.randrange(30, 41)])
+        elif rng.random() < 0.2:
+            # 表のセル
+            tokens.extend([cell_tokens[0], rng.randrange(1000, 1100), cell_tokens[1]])
+        else:
+            tokens.extend(rng.randrange(1000, 30000) for _ in range(rng.randrange(5, 20)))
+    return tokens[:length]
+
+
+def run_logits_microbenchmark(length: int = 8192, vocab_size: int = 129280, seed: int = 0) -> dict:
+    """
+    n-gram繰り返し抑制の1トークンあたりの処理時間を、従来実装とベクトル化実装で比較
+
+    生成を1トークンずつ再現し、出力長の区間ごとに処理時間を集計する。
+    両実装の禁止トークンが一致することも確認する。
+    """
+    import numpy as np
+    from inference_backend import NGRAM_SIZE, NGRAM_WHITELIST_TOKEN_IDS, NGRAM_WINDOW_SIZE
+    from ngram_processor import NGramBanLogitsProcessor
+
+    tokens = _synthetic_output(length, seed)
+    scores = np.zeros(vocab_size, dtype=np.float32)
+    processor = NGramBanLogitsProcessor(
+        ngram_size=NGRAM_SIZE,
+        window_size=NGRAM_WINDOW_SIZE,
+        whitelist_token_ids=NGRAM_WHITELIST_TOKEN_IDS
+    )
+    # 出力長の区間（トークン位置の上限）
+    boundaries = [bound for bound in (512, 2048, 4096, 8192) if bound < length] + [length]
+    timings = {name: {bound: [] for bound in boundaries} for name in ("reference", "vectorized")}
+    mismatches = 0
+    banned_steps = 0
+
+    generated: List[int] = []
+    for token in tokens:
+        bound = next(bound for bound in boundaries if len(generated) < bound)
+
+        started = time.perf_counter()
+        _, reference_banned = _reference_ngram_ban(
+            generated, scores, NGRAM_SIZE, NGRAM_WINDOW_SIZE, NGRAM_WHITELIST_TOKEN_IDS
+        )
+        timings["reference"][bound].append((time.perf_counter() - started) * 1e6)
+
+        started = time.perf_counter()
+        processor(generated, scores)
+        timings["vectorized"][bound].append((time.perf_counter() - started) * 1e6)
+
+        # その場で書き換えたスコアを戻す
+        vectorized_banned = set(processor.banned_tokens(generated))
+        if vectorized_banned:
+            scores[list(vectorized_banned)] = 0.0
+        if reference_banned:
+            banned_steps += 1
+        if vectorized_banned != reference_banned:
+            mismatches += 1
+        generated.append(token)
+
+    return {
+        "length": length,
+        "vocab_size": vocab_size,
+        "ngram_size": NGRAM_SIZE,
+        "window_size": NGRAM_WINDOW_SIZE,
+        "banned_steps": banned_steps,
+        "mismatches": mismatches,
+        "per_token_us": {
+            name: {
+                f"<{bound}": summarize(values)
+                for bound, values in by_bound.items()
+            }
+            for name, by_bound in timings.items()
+        },
+        "total_ms": {
+            name: round(sum(sum(values) for values in by_bound.values()) / 1000, 2)
+            for name, by_bound in timings.items()
+        }
+    }
+
+
+def print_logits_microbenchmark(result: dict):
+    """
+    n-gram繰り返し抑制の比較結果を表示
+    """
+    print(f"出力長: {result['length']}  n-gram: {result['ngram_size']}  ウィンドウ: {result['window_size']}  "
+          f"禁止が発生したステップ: {result['banned_steps']}  不一致: {result['mismatches']}")
+    print(f"{'区間':<8} {'従来 mean/p99 (us)':>22} {'ベクトル化 mean/p99 (us)':>26}")
+    for interval in result["per_token_us"]["reference"]:
+        reference = result["per_token_us"]["reference"][interval]
+        vectorized = result["per_token_us"]["vectorized"][interval]
+        print(f"{interval:<8} {reference['mean']:>11.1f}/{reference['p99']:<10.1f} "
+              f"{vectorized['mean']:>13.1f}/{vectorized['p99']:<10.1f}")
+    total = result["total_ms"]
+    print(f"合計(ms): 従来={total['reference']:.1f}  ベクトル化={total['vectorized']:.1f}")
+
+
+def print_report(report: dict, baseline: Optional[dict] = None):
+    """
+    集計結果を表示（baseline指定時は前回の結果との差分も表示）
+    """
+    summary = report["summary"]
+
+    def delta(path: List[str]) -> str:
+        if baseline is None:
+            return ""
+        current, previous = summary, baseline.get("summary", {})
+        for key in path:
+            current = current.get(key, {}) if isinstance(current, dict) else {}
+            previous = previous.get(key, {}) if isinstance(previous, dict) else {}
+        if not isinstance(previous, (int, float)) or not previous:
+            return ""
+        return f"  ({(current - previous) / previous * 100:+.1f}%)"
+
+    config = report["config"]
+    print(f"対象: {config['target']}  並列数: {config['concurrency']}  リクエスト数: {summary['requests']}")
+    print(f"成功: {summary['succeeded']}  失敗: {summary['failed']}  キャッシュ: {summary['cached']}  エラー: {summary['errors']}")
+    print(f"経過時間: {summary['wall_seconds']:.2f}秒")
+    print(f"スループット: {summary['requests_per_second']:.2f} req/s{delta(['requests_per_second'])}")
+    print(f"トークン生成: {summary['tokens_per_second']:.1f} tokens/s{delta(['tokens_per_second'])}")
+    latency = summary["latency_ms"]
+    print("レイテンシ(ms): " + "  ".join(
+        f"p{q}={latency[f'p{q}']:.1f}{delta(['latency_ms', f'p{q}'])}" for q in PERCENTILES
+    ))
+    print("ステージ別(ms):")
+    for stage, values in summary["stages_ms"].items():
+        print(
+            f"  {stage:<22} mean={values['mean']:>9.2f}  p50={values['p50']:>9.2f}  "
+            f"p95={values['p95']:>9.2f}{delta(['stages_ms', stage, 'p50'])}"
+        )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="DeepSeek OCR ベンチマーク")
+    parser.add_argument('--target', choices=('http', 'local'), default='http',
+                        help="http: 起動中のAPIサーバー, local: 同一プロセスで実行")
+    parser.add_argument('--url', default='http://localhost:8000', help="APIサーバーのURL（http）")
+    parser.add_argument('--backend', choices=('vllm', 'fake'), default='fake',
+                        help="推論バックエンド（local）")
+    parser.add_argument('--inputs', nargs='+', default=[os.path.join(DEFAULT_INPUT_DIR, '*')],
+                        help="入力ファイル（globパターン可）")
+    parser.add_argument('--requests', type=int, default=20, help="計測するリクエスト数")
+    parser.add_argument('--concurrency', type=int, default=4, help="同時に実行するリクエスト数")
+    parser.add_argument('--warmup', type=int, default=1, help="計測前に実行するリクエスト数")
+    parser.add_argument('--crop-mode', default='true',
+                        help="クロップモード（カンマ区切りで複数指定: true,false）")
+    parser.add_argument('--prompt', action='append', help="プロンプト（複数指定可）")
+    parser.add_argument('--all-pages', action='store_true', help="PDFの全ページを処理")
+    parser.add_argument('--use-cache', action='store_true', help="結果キャッシュ・画像特徴量キャッシュを有効にする（local）")
+    parser.add_argument('--seed', type=int, default=0, help="リクエスト順序の乱数シード")
+    parser.add_argument('--output', help="結果を書き出すJSONファイル")
+    parser.add_argument('--compare', help="比較する前回の結果（JSONファイル）")
+    parser.add_argument('--records', action='store_true', help="リクエストごとの記録をJSONに含める")
+    parser.add_argument('--loader-comparison', action='store_true',
+                        help="元の解像度と縮小読み込みの速度・メモリ・精度を比較（--backend vllmでOCR結果も比較）")
+    parser.add_argument('--logits-microbenchmark', action='store_true',
+                        help="n-gram繰り返し抑制のトークンあたりの処理時間を従来実装と比較")
+    parser.add_argument('--max-tokens', type=int, default=8192,
+                        help="--logits-microbenchmark で再現する出力トークン数")
+    return parser.parse_args(argv)
+
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+
+    if args.logits_microbenchmark:
+        result = run_logits_microbenchmark(args.max_tokens, seed=args.seed)
+        print_logits_microbenchmark(result)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump({"logits_microbenchmark": result}, f, ensure_ascii=False, indent=2)
+            print(f"結果を保存しました: {args.output}")
+        return 0 if result["mismatches"] == 0 else 2
+
+    files = sorted({
+        path
+        for pattern in args.inputs
+        for path in glob.glob(pattern)
+        if os.path.isfile(path)
+    })
+    if not files:
+        print(f"入力ファイルが見つかりません: {args.inputs}")
+        return 1
+    crop_modes = [value.strip().lower() in ('true', '1', 'yes') for value in args.crop_mode.split(',')]
+    prompts = args.prompt or [DEFAULT_PROMPT]
+
+    if args.loader_comparison:
+        os.environ['OCR_BACKEND'] = args.backend
+        results = await run_loader_comparison(files, crop_modes, prompts[0], run_ocr=args.backend != 'fake')
+        print_loader_comparison(results)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump({"loader_comparison": results}, f, ensure_ascii=False, indent=2)
+            print(f"結果を保存しました: {args.output}")
+        return 0
+
+    if args.target == 'local':
+        # api_routerの読み込み前に設定する（バックエンド・ジョブストアはインポート時に決まる）
+        os.environ['OCR_BACKEND'] = args.backend
+        os.environ.setdefault('OCR_JOB_STORE', 'memory')
+        target = LocalTarget(all_pages=args.all_pages, use_cache=args.use_cache)
+    else:
+        target = HTTPTarget(args.url, all_pages=args.all_pages)
+
+    workload = build_workload(files, crop_modes, prompts, args.requests + args.warmup, args.seed)
+    started_at = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+    await target.start()
+    try:
+        summary = await run_benchmark(target, workload, args.concurrency, args.warmup)
+    finally:
+        await target.stop()
+
+    records = summary.pop("records")
+    report = {
+        "config": {
+            "target": args.target,
+            "url": args.url if args.target == 'http' else None,
+            "backend": args.backend if args.target == 'local' else None,
+            "files": [os.path.basename(path) for path in files],
+            "crop_modes": crop_modes,
+            "prompts": prompts,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "all_pages": args.all_pages,
+            "use_cache": args.use_cache,
+            "seed": args.seed
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "env": {key: value for key, value in sorted(os.environ.items()) if key.startswith('OCR_')}
+        },
+        "started_at": started_at,
+        "summary": summary
+    }
+    if args.records:
+        report["records"] = records
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.output}")
+    return 0 if summary["failed"] == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
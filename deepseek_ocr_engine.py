@@ -3,34 +3,108 @@ DeepSeek OCRエンジンモジュール
 OCRモデルの初期化と推論処理を管理
 """
 
+import asyncio
+import heapq
+import itertools
 import os
-import sys
 import time
-from typing import Optional
-import torch
+import uuid
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+from PIL import Image
+from fastapi import HTTPException
 
-# DeepSeek-OCRのモジュールパスを追加
-sys.path.insert(0, '/DeepSeek-OCR/DeepSeek-OCR-master/DeepSeek-OCR-vllm')
+from metrics import (
+    STAGE_SECONDS, GENERATED_TOKENS, REQUEST_SECONDS, PRIORITY_QUEUE_WAIT_SECONDS, DEADLINE_EXCEEDED,
+    TRUNCATED_REQUESTS, ABORTED_TOKENS
+)
+from inference_backend import (
+    InferenceBackend, create_backend, MODEL_PATH, MAX_TOKENS, NGRAM_SIZE, NGRAM_WINDOW_SIZE
+)
+from generation_monitor import GenerationMonitor, monitor_settings, TRUNCATED_MAX_TOKENS
+from shm_transport import encode_message, decode_message, encode_features, release, MAX_MESSAGE_BYTES
 
-if torch.version.cuda == '11.8':
-    os.environ["TRITON_PTXAS_PATH"] = "/usr/local/cuda-11.8/bin/ptxas"
+# 同時に推論するリクエスト数の上限（KVキャッシュ容量の目安: 8192トークン/リクエストで約60）
+MAX_IN_FLIGHT = int(os.environ.get('OCR_MAX_IN_FLIGHT', '60'))
 
-os.environ['VLLM_USE_V1'] = '0'
-os.environ["CUDA_VISIBLE_DEVICES"] = '0'
+# 推論枠の空き待ちができるリクエスト数の上限（超過時は429を返す）
+MAX_QUEUED = int(os.environ.get('OCR_MAX_QUEUED', '100'))
 
-from vllm import AsyncLLMEngine, SamplingParams
-from vllm.engine.arg_utils import AsyncEngineArgs
-from vllm.model_executor.models.registry import ModelRegistry
-from deepseek_ocr import DeepseekOCRForCausalLM
-from PIL import Image
-from process.ngram_norepeat import NoRepeatNGramLogitsProcessor
-from process.image_process import DeepseekOCRProcessor
-from fastapi import HTTPException
+# 1つのPDF内で同時に推論（と推論待ち）するページ数の上限
+PAGE_CONCURRENCY = int(os.environ.get('OCR_PAGE_CONCURRENCY', str(MAX_IN_FLIGHT)))
+
+# 優先度クラス（値が小さいクラスから推論枠を割り当てる）
+PRIORITY_CLASSES = {'interactive': 0, 'normal': 1, 'bulk': 2}
+DEFAULT_PRIORITY = 'normal'
+
+
+def _parse_priority_max_tokens(value: str) -> Dict[str, int]:
+    limits = {}
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        name, _, limit = item.partition('=')
+        name = name.strip()
+        if name not in PRIORITY_CLASSES or not limit.strip().isdigit():
+            raise ValueError(f"不正な OCR_PRIORITY_MAX_TOKENS の指定です: {item}")
+        limits[name] = min(int(limit), MAX_TOKENS)
+    return limits
+
+
+# 優先度クラスごとのmax_tokensの上限（例: "bulk=4096"。指定のないクラスはMAX_TOKENS）
+PRIORITY_MAX_TOKENS = _parse_priority_max_tokens(os.environ.get('OCR_PRIORITY_MAX_TOKENS', ''))
+
+
+def check_priority(priority: str):
+    """
+    優先度クラス名を検証
+
+    Raises:
+        HTTPException: 不正な優先度クラスの場合
+    """
+    if priority not in PRIORITY_CLASSES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不正な優先度クラスです: {priority} ({' / '.join(PRIORITY_CLASSES)})"
+        )
+
+
+def deadline_after(timeout: Optional[float]) -> Optional[float]:
+    """
+    タイムアウト（秒）をエンジンに渡す期限（time.monotonic()基準）に変換
+
+    Args:
+        timeout: タイムアウト（秒、Noneの場合は期限なし）
+
+    Returns:
+        Optional[float]: 期限
+    """
+    if timeout is None:
+        return None
+    if timeout <= 0:
+        raise HTTPException(status_code=400, detail="timeoutは正の秒数で指定してください")
+    return time.monotonic() + timeout
 
-ModelRegistry.register_model("DeepseekOCRForCausalLM", DeepseekOCRForCausalLM)
 
-# モデルパス
-MODEL_PATH = 'deepseek-ai/DeepSeek-OCR'
+# レプリカを割り当てるデバイス（カンマ区切り。指定時は各レプリカを別プロセスで実行）
+DEVICES = [device.strip() for device in os.environ.get('OCR_DEVICES', '').split(',') if device.strip()]
+
+# エンジンのレプリカ数（省略時はデバイス数、デバイス未指定時は1）
+REPLICAS = int(os.environ.get('OCR_REPLICAS', str(len(DEVICES) or 1)))
+
+# レプリカの選択方式（queue_depth: 推論中+待機中の件数, tokens: 残りの生成トークン数の見積もり）
+ROUTING = os.environ.get('OCR_ROUTING', 'queue_depth')
+
+# レプリカのヘルスチェック間隔（秒）
+HEALTH_CHECK_INTERVAL = float(os.environ.get('OCR_HEALTH_CHECK_INTERVAL', '10'))
+
+# エンジンサーバー（engine_server.py）のUnixソケットのパス（指定時はエンジンを別プロセスで実行し、このプロセスは前処理とHTTPのみを行う）
+ENGINE_SOCKET = os.environ.get('OCR_ENGINE_SOCKET', '')
+
+# エンジンサーバーの状態（推論中・待機中の件数など）を取得する間隔（秒）
+ENGINE_STATUS_INTERVAL = float(os.environ.get('OCR_ENGINE_STATUS_INTERVAL', '1'))
+
+# エンジンサーバーの初期化完了を待つ時間の上限（秒）
+ENGINE_CONNECT_TIMEOUT = float(os.environ.get('OCR_ENGINE_CONNECT_TIMEOUT', '1800'))
 
 
 class DeepSeekOCREngine:
@@ -39,38 +113,46 @@ class DeepSeekOCREngine:
     OCRモデルの初期化と推論を管理するシングルトンクラス
     """
     
-    def __init__(self):
-        self.engine: Optional[AsyncLLMEngine] = None
-        self.processor = DeepseekOCRProcessor()
+    def __init__(
+        self,
+        backend: Optional[InferenceBackend] = None,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        max_queued: int = MAX_QUEUED
+    ):
+        # 推論バックエンド（省略時は環境変数 OCR_BACKEND で選択）
+        self.backend = backend if backend is not None else create_backend()
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        # 推論枠を使用中のリクエスト数
+        self._active = 0
+        # 推論枠の空き待ち（優先度, 期限, 到着順, 割り当て通知用Future）のヒープ
+        self._waiters: List[Tuple[int, float, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._queued = 0
+        # 推論中のリクエストID -> 推論開始時刻
+        self._in_flight: Dict[str, float] = {}
+        # 推論中のリクエストID -> 生成済みトークン数、max_tokens
+        self._generated: Dict[str, int] = {}
+        self._max_tokens: Dict[str, int] = {}
     
     async def initialize(self):
         """
         OCRエンジンを初期化
         """
-        if self.engine is not None:
+        if self.backend.is_initialized():
             print("OCRエンジンは既に初期化されています")
             return
         
-        print("OCRエンジンを初期化中...")
-        engine_args = AsyncEngineArgs(
-            model=MODEL_PATH,
-            hf_overrides={"architectures": ["DeepseekOCRForCausalLM"]},
-            block_size=256,
-            max_model_len=8192,
-            enforce_eager=False,
-            trust_remote_code=True,
-            tensor_parallel_size=1,
-            gpu_memory_utilization=0.75,
-        )
-        self.engine = AsyncLLMEngine.from_engine_args(engine_args)
+        print(f"OCRエンジンを初期化中... (バックエンド: {self.backend.name})")
+        await self.backend.initialize()
         print("OCRエンジンの初期化が完了しました")
     
     def shutdown(self):
         """
         エンジンのシャットダウン処理
         """
-        if self.engine is not None:
-            self.engine = None
+        if self.backend.is_initialized():
+            self.backend.shutdown()
             print("OCRエンジンをシャットダウンしました")
     
     def is_initialized(self) -> bool:
@@ -80,8 +162,137 @@ class DeepSeekOCREngine:
         Returns:
             bool: 初期化されている場合True
         """
-        return self.engine is not None
+        return self.backend.is_initialized()
+
+    @staticmethod
+    def new_request_id() -> str:
+        """
+        エンジン内で衝突しないリクエストIDを生成
+
+        Returns:
+            str: リクエストID
+        """
+        return f"request-{uuid.uuid4().hex}"
+
+    def in_flight_count(self) -> int:
+        """
+        推論中のリクエスト数を返す
+        """
+        return len(self._in_flight)
+
+    def queued_count(self) -> int:
+        """
+        推論枠の空き待ちをしているリクエスト数を返す
+        """
+        return self._queued
+
+    def outstanding_tokens(self) -> int:
+        """
+        推論中・待機中のリクエストが今後生成するトークン数の見積もり（上限まで生成すると仮定）
+        """
+        generated = sum(self._generated.values())
+        return sum(self._max_tokens.values()) + self._queued * MAX_TOKENS - generated
+
+    async def check_health(self) -> bool:
+        """
+        バックエンドが推論可能な状態かを確認
+
+        Returns:
+            bool: 推論可能な場合True
+        """
+        return self.backend.is_initialized() and await self.backend.check_health()
+
+    @staticmethod
+    def max_tokens_for(priority: str = DEFAULT_PRIORITY) -> int:
+        """
+        優先度クラスの生成トークン数の上限を返す
+        """
+        return PRIORITY_MAX_TOKENS.get(priority, MAX_TOKENS)
+
+    def sampling_settings(self, priority: str = DEFAULT_PRIORITY) -> dict:
+        """
+        推論結果に影響するモデル・サンプリング設定を返す（キャッシュキー用）
+
+        Args:
+            priority: 優先度クラス（クラスごとにmax_tokensの上限が異なる場合がある）
+
+        Returns:
+            dict: バックエンド、モデルパスとサンプリング設定
+        """
+        return {
+            "backend": self.backend.name,
+            "model": MODEL_PATH,
+            "temperature": 0.0,
+            "max_tokens": self.max_tokens_for(priority),
+            "ngram_size": NGRAM_SIZE,
+            "ngram_window_size": NGRAM_WINDOW_SIZE,
+            "monitor": monitor_settings()
+        }
+
+    async def abort(self, request_id: str):
+        """
+        推論中のリクエストを中断してKVキャッシュを解放
+
+        Args:
+            request_id: 中断するリクエストID
+        """
+        if self.backend.is_initialized() and request_id in self._in_flight:
+            await self.backend.abort(request_id)
+            print(f"リクエストを中断しました: {request_id}")
     
+    async def _acquire_slot(self, priority: str, deadline: Optional[float]):
+        """
+        推論枠を確保（空きがない場合は優先度・期限の順に割り当てを待つ）
+
+        Raises:
+            HTTPException: 待ち行列が満杯（429）、または待機中に期限を過ぎた（504）場合
+        """
+        # 空き待ちがいる間は枠がすべて使用中（解放時は待機者に直接渡す）
+        if self._active < self.max_in_flight and self._queued == 0:
+            self._active += 1
+            return
+        if self._queued >= self.max_queued:
+            raise HTTPException(
+                status_code=429,
+                detail="OCRエンジンが混雑しています。しばらく待ってから再度お試しください。"
+            )
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (
+            PRIORITY_CLASSES[priority],
+            deadline if deadline is not None else float('inf'),
+            next(self._sequence),
+            waiter
+        ))
+        self._queued += 1
+        try:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            DEADLINE_EXCEEDED.inc(priority=priority, stage="queue")
+            raise HTTPException(
+                status_code=504,
+                detail="推論枠の待機中に期限を過ぎたため中断しました"
+            )
+        except BaseException:
+            # 割り当てと同時にキャンセルされた場合は枠を次の待機者に渡す
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()
+            raise
+        finally:
+            self._queued -= 1
+
+    def _release_slot(self):
+        """
+        推論枠を解放（待機者がいれば最も優先度の高い待機者に割り当てる）
+        """
+        while self._waiters:
+            waiter = heapq.heappop(self._waiters)[-1]
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
     def preprocess_image(self, image: Image.Image, crop_mode: bool = True) -> dict:
         """
         画像を前処理してOCRエンジン用の特徴量に変換
@@ -93,78 +304,176 @@ class DeepSeekOCREngine:
         Returns:
             dict: 画像特徴量
         """
-        image_features = self.processor.tokenize_with_images(
-            images=[image],
-            bos=True,
-            eos=True,
-            cropping=crop_mode
-        )
-        return image_features
+        return self.backend.preprocess_image(image, crop_mode)
     
-    async def generate(self, image_features=None, prompt: str = '') -> str:
+    async def generate_stream(
+        self,
+        image_features=None,
+        prompt: str = '',
+        request_id: Optional[str] = None,
+        priority: str = DEFAULT_PRIORITY,
+        deadline: Optional[float] = None,
+        max_tokens: Optional[int] = None
+    ) -> AsyncIterator[dict]:
         """
-        OCRモデルでテキストを生成
+        OCRモデルでテキストを生成し、生成途中の出力を逐次返す
+
+        推論枠は優先度クラス、期限、到着順の順に割り当てる。
+        期限を過ぎたリクエストは待機中・生成中のいずれでも中断する。
+        繰り返し・低エントロピー・停滞した生成はエンジン側で中断し、
+        それまでの出力を打ち切りの理由（truncated）とともに最後の出力として返す。
         
         Args:
             image_features: 前処理された画像特徴量
             prompt: プロンプト文字列
+            request_id: エンジンに渡すリクエストID（省略時は自動生成）
+            priority: 優先度クラス（interactive / normal / bulk）
+            deadline: 期限（time.monotonic()基準、Noneの場合は期限なし）
+            max_tokens: 生成トークン数の上限（優先度クラスの上限より小さい場合のみ適用）
             
-        Returns:
-            str: OCRモデルの生出力
+        Yields:
+            dict: 生成途中の出力
+                - request_id: リクエストID
+                - text: これまでに生成されたテキスト全体
+                - delta: 前回からの差分テキスト
+                - num_tokens: これまでに生成されたトークン数
+                - finished: 生成が完了したか（打ち切った場合もTrue）
+                - truncated: 打ち切りの理由（repetition, low_entropy, stalled, max_tokens）、
+                  打ち切っていない場合はNone
             
         Raises:
-            HTTPException: エンジンが初期化されていない、またはプロンプトが無効な場合
+            HTTPException: エンジンが初期化されていない、プロンプトや優先度が無効、
+                待ち行列が満杯、または期限を過ぎた場合
         """
-        if self.engine is None:
+        if not self.backend.is_initialized():
             raise HTTPException(
                 status_code=503,
                 detail="OCRエンジンが初期化されていません"
             )
 
-        # LogitsProcessorの設定（繰り返しを防ぐ）
-        logits_processors = [
-            NoRepeatNGramLogitsProcessor(
-                ngram_size=30,
-                window_size=90,
-                whitelist_token_ids={128821, 128822}  # <td>, </td>
-            )
-        ]
-
-        # サンプリングパラメータ
-        sampling_params = SamplingParams(
-            temperature=0.0,
-            max_tokens=8192,
-            logits_processors=logits_processors,
-            skip_special_tokens=False,
-        )
-
-        request_id = f"request-{int(time.time())}"
-
-        # リクエストの構築
-        if image_features and '<image>' in prompt:
-            request = {
-                "prompt": prompt,
-                "multi_modal_data": {"image": image_features}
-            }
-        elif prompt:
-            request = {
-                "prompt": prompt
-            }
-        else:
+        if not prompt:
             raise HTTPException(
                 status_code=400,
                 detail="プロンプトが指定されていません"
             )
+        check_priority(priority)
+
+        if request_id is None:
+            request_id = self.new_request_id()
+
+        # 推論枠の確保（枠が埋まっている場合は優先度順の待ち行列に入る）
+        queued_at = time.perf_counter()
+        await self._acquire_slot(priority, deadline)
+        queue_wait = time.perf_counter() - queued_at
+        STAGE_SECONDS.observe(queue_wait, stage="queue_wait")
+        PRIORITY_QUEUE_WAIT_SECONDS.observe(queue_wait, priority=priority)
 
         # 推論実行
+        max_tokens = min(self.max_tokens_for(priority), max_tokens or MAX_TOKENS)
+        self._in_flight[request_id] = time.time()
+        self._generated[request_id] = 0
+        self._max_tokens[request_id] = max_tokens
+        started = time.perf_counter()
+        printed_length = 0
+        num_tokens = 0
+        first_token_observed = False
+        completed = False
+        truncated = None
+        monitor = GenerationMonitor()
+        outputs = self.backend.generate(prompt, image_features, request_id, max_tokens)
+        try:
+            while True:
+                try:
+                    if deadline is None:
+                        output = await outputs.__anext__()
+                    else:
+                        output = await asyncio.wait_for(
+                            outputs.__anext__(), max(0.0, deadline - time.monotonic())
+                        )
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    DEADLINE_EXCEEDED.inc(priority=priority, stage="generate")
+                    raise HTTPException(
+                        status_code=504,
+                        detail=f"生成中に期限を過ぎたため中断しました（生成済み {num_tokens} トークン）"
+                    )
+                num_tokens = output["num_tokens"]
+                # 最初のトークンまでの時間は、トークンを含む最初の出力で1回だけ記録
+                if num_tokens > 0 and not first_token_observed:
+                    STAGE_SECONDS.observe(time.perf_counter() - started, stage="first_token")
+                    first_token_observed = True
+                self._generated[request_id] = num_tokens
+                full_text = output["text"]
+                delta = full_text[printed_length:]
+                printed_length = len(full_text)
+
+                reason = monitor.feed(full_text, num_tokens)
+                if reason is None and output["finished"] and num_tokens >= max_tokens:
+                    reason = TRUNCATED_MAX_TOKENS
+                if reason is not None:
+                    truncated = reason
+                    TRUNCATED_REQUESTS.inc(reason=reason)
+                    if not output["finished"]:
+                        ABORTED_TOKENS.inc(num_tokens, reason=reason)
+                yield {
+                    "request_id": request_id,
+                    "text": full_text,
+                    "delta": delta,
+                    "num_tokens": output["num_tokens"],
+                    "finished": output["finished"] or truncated is not None,
+                    "truncated": truncated
+                }
+                if truncated is not None and not output["finished"]:
+                    # 劣化した生成はエンジン側で中断してKVキャッシュと推論枠を解放する
+                    print(f"劣化した生成を検出しました（{truncated}, {num_tokens}トークン）: {request_id}")
+                    await self.abort(request_id)
+                    break
+            completed = True
+            REQUEST_SECONDS.observe(time.perf_counter() - queued_at, priority=priority)
+        finally:
+            # クライアント切断・期限切れやストリームの途中終了の場合はエンジン側の推論も中断
+            if not completed:
+                await self.abort(request_id)
+            await outputs.aclose()
+            GENERATED_TOKENS.inc(num_tokens)
+            self._in_flight.pop(request_id, None)
+            self._generated.pop(request_id, None)
+            self._max_tokens.pop(request_id, None)
+            self._release_slot()
+
+    async def generate(
+        self,
+        image_features=None,
+        prompt: str = '',
+        request_id: Optional[str] = None,
+        priority: str = DEFAULT_PRIORITY,
+        deadline: Optional[float] = None,
+        max_tokens: Optional[int] = None
+    ) -> str:
+        """
+        OCRモデルでテキストを生成
+        
+        Args:
+            image_features: 前処理された画像特徴量
+            prompt: プロンプト文字列
+            request_id: エンジンに渡すリクエストID（省略時は自動生成）
+            priority: 優先度クラス（interactive / normal / bulk）
+            deadline: 期限（time.monotonic()基準、Noneの場合は期限なし）
+            max_tokens: 生成トークン数の上限（優先度クラスの上限より小さい場合のみ適用）
+            
+        Returns:
+            str: OCRモデルの生出力（打ち切った場合はそれまでの出力）
+            
+        Raises:
+            HTTPException: エンジンが初期化されていない、プロンプトや優先度が無効、
+                待ち行列が満杯、または期限を過ぎた場合
+        """
         final_output = ""
-        async for request_output in self.engine.generate(
-            request, sampling_params, request_id
+        async for chunk in self.generate_stream(
+            image_features, prompt, request_id, priority, deadline, max_tokens
         ):
-            if request_output.outputs:
-                full_text = request_output.outputs[0].text
-                final_output = full_text
-
+            final_output = chunk["text"]
         return final_output
     
     @staticmethod
@@ -201,5 +510,644 @@ class DeepSeekOCREngine:
         return "\n".join(results)
 
 
-# グローバルエンジンインスタンス
-ocr_engine = DeepSeekOCREngine()
+class IncrementalTextExtractor:
+    """
+    ストリーミング出力から `<|ref|>text<|/ref|>` の次行のテキストを逐次抽出するクラス
+
+    `DeepSeekOCREngine.extract_text` と同じ規則で、行が確定した時点でテキストを返す。
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._expect_text = False
+
+    def feed(self, delta: str) -> List[str]:
+        """
+        生成された差分テキストを追加
+
+        Args:
+            delta: 差分テキスト
+
+        Returns:
+            List[str]: 新たに確定したテキスト行
+        """
+        self._buffer += delta
+        results = []
+        while "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            results.extend(self._consume(line))
+        return results
+
+    def flush(self) -> List[str]:
+        """
+        生成完了時に残りのバッファを処理
+
+        Returns:
+            List[str]: 新たに確定したテキスト行
+        """
+        line, self._buffer = self._buffer, ""
+        return self._consume(line) if line else []
+
+    def _consume(self, line: str) -> List[str]:
+        line = line.strip()
+        results = []
+
+        # 直前の行が `<|ref|>text<|/ref|>` なら、タグなしの純テキストを追加
+        if self._expect_text:
+            self._expect_text = False
+            if line and not line.startswith("<|"):
+                results.append(line)
+
+        if "<|ref|>text<|/ref|>" in line:
+            self._expect_text = True
+
+        return results
+
+
+class EnginePool:
+    """
+    DeepSeekOCREngineのレプリカを束ね、負荷の小さいレプリカへリクエストを振り分けるクラス
+
+    DeepSeekOCREngineと同じインターフェースを持つ。ヘルスチェックに失敗したレプリカ
+    （生成中の例外の直後にも確認する）はローテーションから外し、
+    定期的なヘルスチェックが成功した時点で戻す。
+    """
+
+    def __init__(
+        self,
+        replicas: Optional[List[DeepSeekOCREngine]] = None,
+        routing: str = ROUTING,
+        health_check_interval: float = HEALTH_CHECK_INTERVAL
+    ):
+        if routing not in ('queue_depth', 'tokens'):
+            raise ValueError(f"不正なルーティング方式です: {routing} (queue_depth または tokens)")
+        self.replicas = replicas if replicas is not None else self.create_replicas()
+        self.routing = routing
+        self.health_check_interval = health_check_interval
+        # ローテーション中のレプリカ番号
+        self._healthy = set(range(len(self.replicas)))
+        # 推論中のリクエストID -> 担当レプリカ
+        self._routes: Dict[str, DeepSeekOCREngine] = {}
+        self._health_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def create_replicas(
+        replicas: int = REPLICAS,
+        devices: Optional[List[str]] = None
+    ) -> List[DeepSeekOCREngine]:
+        """
+        設定に応じたレプリカを生成（デバイス指定時は各レプリカを順にデバイスへ割り当てる）
+
+        Args:
+            replicas: レプリカ数
+            devices: 割り当てるデバイス（省略時は環境変数 OCR_DEVICES）
+
+        Returns:
+            List[DeepSeekOCREngine]: レプリカ
+        """
+        devices = DEVICES if devices is None else devices
+        if replicas == 1 and not devices:
+            return [DeepSeekOCREngine()]
+        return [
+            DeepSeekOCREngine(backend=create_backend(device=devices[index % len(devices)] if devices else None))
+            for index in range(replicas)
+        ]
+
+    async def initialize(self):
+        """
+        全レプリカを並行に初期化し、ヘルスチェックを開始
+
+        初期化に失敗したレプリカはローテーションから外す。全レプリカが失敗した場合は例外を送出する。
+        """
+        results = await asyncio.gather(
+            *(replica.initialize() for replica in self.replicas),
+            return_exceptions=True
+        )
+        for index, result in enumerate(results):
+            if isinstance(result, BaseException):
+                print(f"レプリカ{index}の初期化に失敗しました: {result}")
+                self._healthy.discard(index)
+        if not self._healthy:
+            raise next(result for result in results if isinstance(result, BaseException))
+
+        if self._health_task is None and self.health_check_interval > 0:
+            self._health_task = asyncio.create_task(self._health_check_loop())
+
+    def shutdown(self):
+        """
+        ヘルスチェックを停止し、全レプリカをシャットダウン
+        """
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for replica in self.replicas:
+            replica.shutdown()
+
+    def is_initialized(self) -> bool:
+        """
+        推論可能なレプリカがあるかチェック
+
+        Returns:
+            bool: ローテーション中の初期化済みレプリカがある場合True
+        """
+        return any(self.replicas[index].is_initialized() for index in self._healthy)
+
+    new_request_id = staticmethod(DeepSeekOCREngine.new_request_id)
+    extract_text = staticmethod(DeepSeekOCREngine.extract_text)
+
+    def in_flight_count(self) -> int:
+        """
+        全レプリカで推論中のリクエスト数を返す
+        """
+        return sum(replica.in_flight_count() for replica in self.replicas)
+
+    def queued_count(self) -> int:
+        """
+        全レプリカで推論枠の空き待ちをしているリクエスト数を返す
+        """
+        return sum(replica.queued_count() for replica in self.replicas)
+
+    def healthy_count(self) -> int:
+        """
+        ローテーション中のレプリカ数を返す
+        """
+        return len(self._healthy)
+
+    def sampling_settings(self, priority: str = DEFAULT_PRIORITY) -> dict:
+        """
+        推論結果に影響するモデル・サンプリング設定を返す（全レプリカで共通）
+        """
+        return self.replicas[0].sampling_settings(priority)
+
+    def stats(self) -> List[dict]:
+        """
+        レプリカごとの状態を返す（ヘルスチェックエンドポイント用）
+        """
+        return [
+            {
+                "replica": index,
+                "device": getattr(replica.backend, "device", None),
+                "healthy": index in self._healthy,
+                "in_flight_requests": replica.in_flight_count(),
+                "queued_requests": replica.queued_count(),
+                "outstanding_tokens": replica.outstanding_tokens()
+            }
+            for index, replica in enumerate(self.replicas)
+        ]
+
+    async def abort(self, request_id: str):
+        """
+        推論中のリクエストを担当レプリカで中断
+
+        Args:
+            request_id: 中断するリクエストID
+        """
+        replica = self._routes.get(request_id)
+        if replica is not None:
+            await replica.abort(request_id)
+
+    def preprocess_image(self, image: Image.Image, crop_mode: bool = True) -> dict:
+        """
+        画像を前処理してOCRエンジン用の特徴量に変換（前処理は全レプリカで共通）
+        """
+        return self.replicas[0].preprocess_image(image, crop_mode)
+
+    def _load(self, index: int) -> tuple:
+        replica = self.replicas[index]
+        if self.routing == 'tokens':
+            return replica.outstanding_tokens(), index
+        return replica.in_flight_count() + replica.queued_count(), replica.outstanding_tokens(), index
+
+    def _select(self, excluded: Set[int]) -> Optional[int]:
+        """
+        ローテーション中で負荷が最も小さいレプリカの番号を返す
+        """
+        candidates = [
+            index for index in self._healthy
+            if index not in excluded and self.replicas[index].is_initialized()
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=self._load)
+
+    def mark_unhealthy(self, index: int, reason: str = ""):
+        """
+        レプリカをローテーションから外す
+        """
+        if index in self._healthy:
+            self._healthy.discard(index)
+            print(f"レプリカ{index}をローテーションから外しました: {reason}")
+
+    @staticmethod
+    async def _replica_healthy(replica: DeepSeekOCREngine) -> bool:
+        try:
+            return await replica.check_health()
+        except Exception:
+            return False
+
+    async def check_health(self) -> bool:
+        """
+        全レプリカのヘルスチェックを行い、ローテーションを更新
+
+        Returns:
+            bool: 推論可能なレプリカがある場合True
+        """
+        results = await asyncio.gather(
+            *(self._replica_healthy(replica) for replica in self.replicas)
+        )
+        for index, result in enumerate(results):
+            if result:
+                if index not in self._healthy:
+                    self._healthy.add(index)
+                    print(f"レプリカ{index}をローテーションに戻しました")
+            else:
+                self.mark_unhealthy(index, "ヘルスチェックに失敗しました")
+        return bool(self._healthy)
+
+    async def _health_check_loop(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            await self.check_health()
+
+    async def generate_stream(
+        self,
+        image_features=None,
+        prompt: str = '',
+        request_id: Optional[str] = None,
+        priority: str = DEFAULT_PRIORITY,
+        deadline: Optional[float] = None,
+        max_tokens: Optional[int] = None
+    ) -> AsyncIterator[dict]:
+        """
+        負荷の小さいレプリカでテキストを生成し、生成途中の出力を逐次返す
+
+        レプリカが例外を送出し、かつヘルスチェックにも失敗した場合はローテーションから外し、
+        まだ出力を返していなければ別のレプリカで生成をやり直す。
+
+        Yields:
+            dict: 生成途中の出力（DeepSeekOCREngine.generate_streamと同じ形式）
+
+        Raises:
+            HTTPException: 推論可能なレプリカがない、プロンプトや優先度が無効、
+                待ち行列が満杯、または期限を過ぎた場合
+        """
+        if request_id is None:
+            request_id = self.new_request_id()
+
+        tried: Set[int] = set()
+        while True:
+            index = self._select(tried)
+            if index is None:
+                raise HTTPException(
+                    status_code=503,
+                    detail="推論可能なOCRエンジンがありません"
+                )
+            tried.add(index)
+            replica = self.replicas[index]
+            self._routes[request_id] = replica
+            started = False
+            try:
+                async for chunk in replica.generate_stream(
+                    image_features, prompt, request_id, priority, deadline, max_tokens
+                ):
+                    started = True
+                    yield chunk
+                return
+            except HTTPException:
+                raise
+            except Exception as e:
+                # レプリカが正常なら入力などリクエスト側の問題として扱う
+                if await self._replica_healthy(replica):
+                    raise
+                self.mark_unhealthy(index, f"{type(e).__name__}: {e}")
+                if started:
+                    raise
+            finally:
+                self._routes.pop(request_id, None)
+
+    async def generate(
+        self,
+        image_features=None,
+        prompt: str = '',
+        request_id: Optional[str] = None,
+        priority: str = DEFAULT_PRIORITY,
+        deadline: Optional[float] = None,
+        max_tokens: Optional[int] = None
+    ) -> str:
+        """
+        負荷の小さいレプリカでテキストを生成
+
+        Returns:
+            str: OCRモデルの生出力
+        """
+        final_output = ""
+        async for chunk in self.generate_stream(
+            image_features, prompt, request_id, priority, deadline, max_tokens
+        ):
+            final_output = chunk["text"]
+        return final_output
+
+
+class RemoteEngine:
+    """
+    別プロセスのエンジンサーバー（engine_server.py）にUnixソケットで接続するクライアント
+
+    EnginePoolと同じインターフェースを持ち、複数のHTTPワーカープロセスが1つのエンジンを共有するために使う。
+    前処理はこのプロセス内の同種のバックエンド（モデルは読み込まない）で行い、
+    画像特徴量はpickleせずに共有メモリでエンジンサーバーに渡す。
+    生成途中の出力は差分としてソケットで受け取り、接続を閉じると生成が中断される。
+    推論中・待機中の件数などは定期的に取得したエンジンサーバーの状態を返す。
+    """
+
+    def __init__(
+        self,
+        socket_path: str = ENGINE_SOCKET,
+        status_interval: float = ENGINE_STATUS_INTERVAL,
+        connect_timeout: float = ENGINE_CONNECT_TIMEOUT
+    ):
+        self.socket_path = socket_path
+        self.status_interval = status_interval
+        self.connect_timeout = connect_timeout
+        # 前処理とサンプリング設定用（モデルは読み込まない）
+        self._local = DeepSeekOCREngine()
+        self._status: dict = {}
+        self._status_task: Optional[asyncio.Task] = None
+        # 推論中のリクエストID -> エンジンサーバーとの接続
+        self._connections: Dict[str, asyncio.StreamWriter] = {}
+
+    async def _request(self, message: dict) -> dict:
+        """
+        エンジンサーバーにコマンドを送り、1件の応答を受け取る
+        """
+        reader, writer = await asyncio.open_unix_connection(self.socket_path, limit=MAX_MESSAGE_BYTES)
+        try:
+            writer.write(encode_message(message))
+            await writer.drain()
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError("エンジンサーバーとの接続が切断されました")
+            return decode_message(line)
+        finally:
+            writer.close()
+
+    async def refresh_status(self) -> dict:
+        """
+        エンジンサーバーの状態を取得（接続できない場合は空の状態にする）
+
+        Returns:
+            dict: 初期化状態、推論中・待機中の件数、レプリカごとの状態
+        """
+        try:
+            self._status = await self._request({"op": "status"})
+        except (OSError, ValueError):
+            self._status = {}
+        return self._status
+
+    async def initialize(self):
+        """
+        エンジンサーバーの初期化完了を待ち、状態の定期取得を開始
+
+        Raises:
+            RuntimeError: エンジンサーバーの初期化に失敗した、または待機時間の上限を過ぎた場合
+        """
+        print(f"エンジンサーバーの初期化完了を待機中... ({self.socket_path})")
+        started = time.monotonic()
+        while not (await self.refresh_status()).get("initialized"):
+            if self._status.get("error"):
+                raise RuntimeError(f"エンジンサーバーの初期化に失敗しました: {self._status['error']}")
+            if time.monotonic() - started > self.connect_timeout:
+                raise RuntimeError(f"エンジンサーバーが{self.connect_timeout:.0f}秒以内に初期化されませんでした")
+            await asyncio.sleep(0.5)
+        print("エンジンサーバーに接続しました")
+
+        if self._status_task is None and self.status_interval > 0:
+            self._status_task = asyncio.create_task(self._status_loop())
+
+    async def _status_loop(self):
+        while True:
+            await asyncio.sleep(self.status_interval)
+            await self.refresh_status()
+
+    def shutdown(self):
+        """
+        状態の定期取得を停止し、推論中の接続を閉じる（エンジンサーバー自体は停止しない）
+        """
+        if self._status_task is not None:
+            self._status_task.cancel()
+            self._status_task = None
+        for writer in self._connections.values():
+            writer.close()
+        self._connections.clear()
+        self._status = {}
+
+    def is_initialized(self) -> bool:
+        """
+        エンジンサーバーが推論可能かチェック（最後に取得した状態による）
+        """
+        return bool(self._status.get("initialized"))
+
+    new_request_id = staticmethod(DeepSeekOCREngine.new_request_id)
+    extract_text = staticmethod(DeepSeekOCREngine.extract_text)
+
+    def in_flight_count(self) -> int:
+        """
+        エンジンサーバーで推論中のリクエスト数を返す（全ワーカーの合計）
+        """
+        return self._status.get("in_flight_requests", 0)
+
+    def queued_count(self) -> int:
+        """
+        エンジンサーバーで推論枠の空き待ちをしているリクエスト数を返す（全ワーカーの合計）
+        """
+        return self._status.get("queued_requests", 0)
+
+    def healthy_count(self) -> int:
+        """
+        エンジンサーバーのローテーション中のレプリカ数を返す
+        """
+        return self._status.get("healthy_replicas", 0)
+
+    def stats(self) -> List[dict]:
+        """
+        エンジンサーバーのレプリカごとの状態を返す
+        """
+        return self._status.get("replicas", [])
+
+    @property
+    def replicas(self) -> List[dict]:
+        """
+        エンジンサーバーのレプリカ（ウォームアップで並行に投入する件数に使う）
+        """
+        return self.stats() or [{}]
+
+    def sampling_settings(self, priority: str = DEFAULT_PRIORITY) -> dict:
+        """
+        推論結果に影響するモデル・サンプリング設定を返す（エンジンサーバーと同じ環境変数から求める）
+        """
+        return self._local.sampling_settings(priority)
+
+    def preprocess_image(self, image: Image.Image, crop_mode: bool = True) -> dict:
+        """
+        画像を前処理してOCRエンジン用の特徴量に変換（このプロセス内で行う）
+        """
+        return self._local.preprocess_image(image, crop_mode)
+
+    async def check_health(self) -> bool:
+        """
+        エンジンサーバーの状態を取得し、推論可能なレプリカがあるかを返す
+        """
+        status = await self.refresh_status()
+        return bool(status.get("initialized")) and status.get("healthy_replicas", 0) > 0
+
+    async def render_metrics(self) -> str:
+        """
+        エンジンサーバーのメトリクス（Prometheus形式）を取得
+        """
+        return (await self._request({"op": "metrics"}))["metrics"]
+
+    async def claim_warm_up(self) -> bool:
+        """
+        ウォームアップの実行を要求（エンジンサーバーを共有するワーカーのうち最初の1つのみTrue）
+        """
+        return bool((await self._request({"op": "claim_warmup"})).get("claimed"))
+
+    async def abort(self, request_id: str):
+        """
+        エンジンサーバーとの接続を閉じて推論中のリクエストを中断
+
+        Args:
+            request_id: 中断するリクエストID
+        """
+        writer = self._connections.pop(request_id, None)
+        if writer is not None:
+            writer.close()
+
+    async def generate_stream(
+        self,
+        image_features=None,
+        prompt: str = '',
+        request_id: Optional[str] = None,
+        priority: str = DEFAULT_PRIORITY,
+        deadline: Optional[float] = None,
+        max_tokens: Optional[int] = None
+    ) -> AsyncIterator[dict]:
+        """
+        エンジンサーバーでテキストを生成し、生成途中の出力を逐次返す
+
+        画像特徴量の共有メモリはエンジンサーバーが読み込んだ時点で解放する。
+        ストリームを途中で閉じた場合は接続を閉じ、エンジンサーバー側の生成も中断される。
+
+        Yields:
+            dict: 生成途中の出力（DeepSeekOCREngine.generate_streamと同じ形式）
+
+        Raises:
+            HTTPException: エンジンサーバーに接続できない、プロンプトや優先度が無効、
+                待ち行列が満杯、または期限を過ぎた場合
+        """
+        if not self.is_initialized():
+            raise HTTPException(
+                status_code=503,
+                detail="OCRエンジンが初期化されていません"
+            )
+        if request_id is None:
+            request_id = self.new_request_id()
+
+        encoded, shm = encode_features(image_features)
+        writer = None
+        try:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.socket_path, limit=MAX_MESSAGE_BYTES)
+            except OSError as e:
+                raise HTTPException(
+                    status_code=503,
+                    detail=f"エンジンサーバーに接続できません: {e}"
+                )
+            self._connections[request_id] = writer
+            writer.write(encode_message({
+                "op": "generate",
+                "request_id": request_id,
+                "prompt": prompt,
+                "features": encoded,
+                "priority": priority,
+                # 期限はプロセス間で共有できないため残り時間で渡す
+                "timeout": None if deadline is None else deadline - time.monotonic(),
+                "max_tokens": max_tokens
+            }))
+            await writer.drain()
+
+            text = ""
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise RuntimeError("エンジンサーバーとの接続が切断されました")
+                message = decode_message(line)
+                kind = message["type"]
+                if kind == "accepted":
+                    # エンジンサーバーが画像特徴量をコピーしたため共有メモリを解放
+                    release(shm)
+                    shm = None
+                elif kind == "chunk":
+                    text += message["delta"]
+                    yield {
+                        "request_id": request_id,
+                        "text": text,
+                        "delta": message["delta"],
+                        "num_tokens": message["num_tokens"],
+                        "finished": message["finished"],
+                        "truncated": message["truncated"]
+                    }
+                elif kind == "done":
+                    return
+                elif message.get("status_code") is not None:
+                    raise HTTPException(status_code=message["status_code"], detail=message["detail"])
+                else:
+                    raise RuntimeError(message["detail"])
+        finally:
+            self._connections.pop(request_id, None)
+            if writer is not None:
+                writer.close()
+            release(shm)
+
+    async def generate(
+        self,
+        image_features=None,
+        prompt: str = '',
+        request_id: Optional[str] = None,
+        priority: str = DEFAULT_PRIORITY,
+        deadline: Optional[float] = None,
+        max_tokens: Optional[int] = None
+    ) -> str:
+        """
+        エンジンサーバーでテキストを生成
+
+        Returns:
+            str: OCRモデルの生出力
+        """
+        final_output = ""
+        async for chunk in self.generate_stream(
+            image_features, prompt, request_id, priority, deadline, max_tokens
+        ):
+            final_output = chunk["text"]
+        return final_output
+
+
+# グローバルエンジンインスタンス（レプリカ数は OCR_REPLICAS / OCR_DEVICES で指定。
+# OCR_ENGINE_SOCKET 指定時は別プロセスのエンジンサーバーに接続する）
+ocr_engine = RemoteEngine() if ENGINE_SOCKET else EnginePool()
+
+
+def preprocess_image_features(image: Image.Image, crop_mode: bool = True) -> dict:
+    """
+    グローバルエンジンのプロセッサで画像を前処理
+
+    ワーカープール（プロセスプールを含む）から呼び出せるモジュール関数。
+    プロセスプールの場合は各ワーカープロセス内のプロセッサが使われる。
+
+    Args:
+        image: PIL Image オブジェクト
+        crop_mode: クロップモードを有効にするか
+
+    Returns:
+        dict: 画像特徴量
+    """
+    return ocr_engine.preprocess_image(image=image, crop_mode=crop_mode)
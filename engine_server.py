@@ -0,0 +1,224 @@
+"""
+エンジンサーバーモジュール
+OCRエンジン（EnginePool）を1つのプロセスで保持し、複数のHTTPワーカープロセスからの生成リクエストをUnixソケットで受け付ける
+
+単独で起動する場合:
+    OCR_ENGINE_SOCKET=/tmp/deepseek_ocr_engine.sock python engine_server.py
+"""
+
+import asyncio
+import multiprocessing
+import os
+import signal
+import time
+from typing import Optional
+
+from fastapi import HTTPException
+
+from deepseek_ocr_engine import EnginePool, ENGINE_SOCKET
+from metrics import REGISTRY
+from shm_transport import encode_message, decode_message, decode_features, MAX_MESSAGE_BYTES
+
+# OCR_ENGINE_SOCKET 未指定時のソケットのパス
+DEFAULT_ENGINE_SOCKET = '/tmp/deepseek_ocr_engine.sock'
+
+
+class EngineServer:
+    """
+    エンジンサーバークラス
+
+    1接続で1コマンドを処理する。コマンドと応答は1行1件のJSONで、画像特徴量は共有メモリで受け取る。
+    - status: 初期化状態、推論中・待機中の件数、レプリカごとの状態を返す
+    - metrics: エンジン側のメトリクス（Prometheus形式）を返す
+    - claim_warmup: ウォームアップを実行するワーカーを1つだけ選ぶ（最初に要求したワーカーにのみ claimed=true を返す）
+    - generate: 画像特徴量を読み込んだ時点で accepted を返し、生成途中の出力を chunk（差分）として
+      逐次返したあと done を返す。失敗した場合は error（status_code, detail）を返す。
+      生成中にクライアントが接続を閉じた場合は生成を中断する
+    """
+
+    def __init__(self, socket_path: str = ENGINE_SOCKET or DEFAULT_ENGINE_SOCKET, engine: Optional[EnginePool] = None):
+        self.socket_path = socket_path
+        # OCR_ENGINE_SOCKET が設定されているとグローバルの ocr_engine はクライアントになるため、エンジンは別に生成
+        self.engine = engine if engine is not None else EnginePool()
+        self.error: Optional[str] = None
+        self._warmup_claimed = False
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        """
+        ソケットで待ち受けを開始してからエンジンを初期化
+
+        初期化中・初期化失敗もstatusで応答し、クライアントが待機・失敗を判断できるようにする。
+        """
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = await asyncio.start_unix_server(
+            self._handle, path=self.socket_path, limit=MAX_MESSAGE_BYTES
+        )
+        print(f"エンジンサーバーを起動しました: {self.socket_path}")
+        try:
+            await self.engine.initialize()
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            print(f"OCRエンジンの初期化に失敗しました: {self.error}")
+
+    async def shutdown(self):
+        """
+        待ち受けを停止し、エンジンをシャットダウン
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        self.engine.shutdown()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def status(self) -> dict:
+        """
+        エンジンの状態を返す
+        """
+        return {
+            "initialized": self.engine.is_initialized(),
+            "error": self.error,
+            "in_flight_requests": self.engine.in_flight_count(),
+            "queued_requests": self.engine.queued_count(),
+            "healthy_replicas": self.engine.healthy_count(),
+            "replicas": self.engine.stats()
+        }
+
+    @staticmethod
+    async def _send(writer: asyncio.StreamWriter, message: dict):
+        writer.write(encode_message(message))
+        await writer.drain()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            line = await reader.readline()
+            if not line:
+                return
+            request = decode_message(line)
+            op = request.get("op")
+            if op == "status":
+                await self._send(writer, self.status())
+            elif op == "metrics":
+                await self._send(writer, {"metrics": REGISTRY.render()})
+            elif op == "claim_warmup":
+                claimed = not self._warmup_claimed
+                self._warmup_claimed = True
+                await self._send(writer, {"claimed": claimed})
+            elif op == "generate":
+                await self._generate(request, reader, writer)
+            else:
+                await self._send(writer, {"type": "error", "status_code": 400, "detail": f"不正なコマンドです: {op}"})
+        except (ConnectionError, ValueError) as e:
+            print(f"エンジンサーバーの接続でエラーが発生しました: {type(e).__name__}: {e}")
+        finally:
+            writer.close()
+
+    async def _generate(self, request: dict, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        生成リクエストを処理し、クライアントが接続を閉じた場合は生成を中断
+        """
+        try:
+            image_features = decode_features(request["features"])
+        except (OSError, KeyError, TypeError, ValueError) as e:
+            await self._send(writer, {
+                "type": "error", "status_code": None, "detail": f"画像特徴量を読み込めません: {type(e).__name__}: {e}"
+            })
+            return
+        await self._send(writer, {"type": "accepted"})
+
+        timeout = request.get("timeout")
+        deadline = None if timeout is None else time.monotonic() + max(0.0, timeout)
+        generation = asyncio.create_task(self._stream(
+            writer, image_features, request["prompt"], request["request_id"],
+            request["priority"], deadline, request.get("max_tokens")
+        ))
+        # クライアントは生成中に何も送らないため、読み込みが終わるのは接続が閉じられた場合のみ
+        disconnect = asyncio.create_task(reader.read(1))
+        try:
+            await asyncio.wait({generation, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if not generation.done():
+                # 生成を中断（generate_streamの終了処理でエンジン側もabortされる）
+                generation.cancel()
+            disconnect.cancel()
+            await asyncio.gather(generation, disconnect, return_exceptions=True)
+
+    async def _stream(
+        self,
+        writer: asyncio.StreamWriter,
+        image_features,
+        prompt: str,
+        request_id: str,
+        priority: str,
+        deadline: Optional[float],
+        max_tokens: Optional[int]
+    ):
+        try:
+            async for chunk in self.engine.generate_stream(
+                image_features, prompt, request_id, priority, deadline, max_tokens
+            ):
+                await self._send(writer, {
+                    "type": "chunk",
+                    "delta": chunk["delta"],
+                    "num_tokens": chunk["num_tokens"],
+                    "finished": chunk["finished"],
+                    "truncated": chunk["truncated"]
+                })
+            await self._send(writer, {"type": "done"})
+        except HTTPException as e:
+            await self._send(writer, {"type": "error", "status_code": e.status_code, "detail": e.detail})
+        except ConnectionError:
+            raise
+        except Exception as e:
+            await self._send(writer, {"type": "error", "status_code": None, "detail": f"{type(e).__name__}: {e}"})
+
+
+async def serve(socket_path: str = ENGINE_SOCKET or DEFAULT_ENGINE_SOCKET):
+    """
+    エンジンサーバーを起動し、SIGTERM/SIGINTを受けるまで待ち受ける
+    """
+    server = EngineServer(socket_path)
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopped.set)
+    try:
+        await server.start()
+        await stopped.wait()
+    finally:
+        await server.shutdown()
+        print("エンジンサーバーを停止しました")
+
+
+def main(socket_path: str = ENGINE_SOCKET or DEFAULT_ENGINE_SOCKET):
+    """
+    エンジンサーバーのプロセスのエントリポイント
+    """
+    asyncio.run(serve(socket_path))
+
+
+def start_engine_process(socket_path: str = DEFAULT_ENGINE_SOCKET) -> multiprocessing.Process:
+    """
+    エンジンサーバーを子プロセスで起動（HTTPワーカーを複数起動する場合に api_router.py から使う）
+
+    CUDA初期化済みのプロセスをforkしないようspawnで起動する。レプリカを別プロセスで実行する場合に
+    子プロセスを起動できるよう、デーモンプロセスにはしない。
+
+    Args:
+        socket_path: 待ち受けるUnixソケットのパス
+
+    Returns:
+        multiprocessing.Process: エンジンサーバーのプロセス
+    """
+    process = multiprocessing.get_context('spawn').Process(
+        target=main, args=(socket_path,), name="ocr-engine-server"
+    )
+    process.start()
+    return process
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+画像特徴量キャッシュモジュール
+画像（PDFはページ）の内容とクロップモードをキーに、前処理済みの画像特徴量と白紙の判定結果をメモリ（LRU）に保持
+"""
+
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple, Union
+
+from metrics import FEATURE_CACHE_LOOKUPS
+
+# 最大エントリ数
+FEATURE_CACHE_MAX_ENTRIES = int(os.environ.get('OCR_FEATURE_CACHE_MAX_ENTRIES', '256'))
+
+# 最大サイズ（バイト、0の場合はキャッシュ無効）
+FEATURE_CACHE_MAX_BYTES = int(os.environ.get('OCR_FEATURE_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+
+
+def content_digest(file_content: Union[bytes, memoryview]) -> str:
+    """
+    ファイル内容のハッシュ（SHA-256の16進文字列）
+    """
+    return hashlib.sha256(file_content).hexdigest()
+
+
+def feature_key(digest: str, crop_mode: Union[bool, str], page: Optional[int] = None) -> str:
+    """
+    画像特徴量のキャッシュキーを生成（プロンプトに依存しないため、異なるプロンプト間で共有される）
+
+    Args:
+        digest: content_digest() で求めたファイル内容のハッシュ
+        crop_mode: クロップモード（true / false、または自動選択の auto）
+        page: PDFのページ番号（画像ファイルの場合はNone）
+
+    Returns:
+        str: キャッシュキー
+    """
+    mode = crop_mode if isinstance(crop_mode, str) else int(bool(crop_mode))
+    return f"{digest}:{page or 0}:{mode}"
+
+
+def feature_nbytes(value) -> int:
+    """
+    画像特徴量のメモリ使用量の概算（テンソル・配列はnbytes、それ以外はオブジェクトのサイズ）
+    """
+    nbytes = getattr(value, 'nbytes', None)
+    if isinstance(nbytes, int):
+        return nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(feature_nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(feature_nbytes(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class FeatureCache:
+    """
+    画像特徴量キャッシュクラス
+
+    エントリ数と特徴量の合計サイズで古いものから削除するLRUキャッシュ。
+    PDFのページ変換スレッドからも参照されるため、操作はロックで保護する。
+    """
+
+    def __init__(self, max_entries: int = FEATURE_CACHE_MAX_ENTRIES, max_bytes: int = FEATURE_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # キー -> (サイズ, 画像特徴量, 元の画像サイズ, 白紙の判定結果)
+        self._entries: "OrderedDict[str, Tuple[int, object, Tuple[int, int], Optional[dict]]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Tuple[object, Tuple[int, int], Optional[dict]]]:
+        """
+        キャッシュから画像特徴量を取得
+
+        Args:
+            key: feature_key() で生成したキー
+
+        Returns:
+            Optional[Tuple[object, Tuple[int, int], Optional[dict]]]: 画像特徴量、元の画像サイズと
+                白紙の判定結果（存在しない場合はNone）
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                FEATURE_CACHE_LOOKUPS.inc(result="miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            FEATURE_CACHE_LOOKUPS.inc(result="hit")
+            _, features, image_size, screen = entry
+            return features, image_size, screen
+
+    def put(self, key: str, features, image_size: Tuple[int, int], screen: Optional[dict] = None):
+        """
+        画像特徴量をキャッシュに保存（上限より大きい場合は保存しない）
+
+        白紙と判定したページは前処理を省略するため、画像特徴量がなくても判定結果を保存する。
+
+        Args:
+            key: feature_key() で生成したキー
+            features: 前処理済みの画像特徴量（白紙のページはNone）
+            image_size: 元の画像サイズ（幅, 高さ）
+            screen: 白紙の判定結果（判定していない場合はNone）
+        """
+        if features is None and not (screen is not None and screen["blank"]):
+            return
+        size = feature_nbytes(features)
+        with self._lock:
+            if size > self.max_bytes:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (size, features, tuple(image_size), screen)
+            self._bytes += size
+
+            # 古いエントリから削除
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        """
+        キャッシュを空にする
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """
+        キャッシュの統計情報を返す
+
+        Returns:
+            dict: ヒット数、ミス数、エントリ数、使用サイズなど
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes
+            }
+
+    def bytes_used(self) -> int:
+        """
+        キャッシュ中の画像特徴量の合計サイズ（バイト）
+        """
+        return self._bytes
+
+    def _remove(self, key: str):
+        size, _, _, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+# グローバルキャッシュインスタンス
+feature_cache = FeatureCache()
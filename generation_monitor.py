@@ -0,0 +1,174 @@
+"""
+生成監視モジュール
+ストリーミング出力から繰り返し・低エントロピー・進行の停滞を検出し、早期中断の理由を返す
+"""
+
+import math
+import os
+import re
+import zlib
+from collections import Counter
+from typing import Optional, Tuple
+
+from inference_backend import crop_grid
+
+# 劣化した生成の検出を有効にするか
+DEGENERATION_CHECK = os.environ.get('OCR_DEGENERATION_CHECK', '1') == '1'
+
+# 検出を始める生成トークン数（短い出力は判定しない）
+DEGENERATION_MIN_TOKENS = int(os.environ.get('OCR_DEGENERATION_MIN_TOKENS', '256'))
+
+# 判定に使う末尾の文字数
+DEGENERATION_WINDOW = int(os.environ.get('OCR_DEGENERATION_WINDOW', '1024'))
+
+# 末尾の圧縮率（zlib圧縮後/圧縮前）がこれ未満の場合は繰り返しと判定
+# （表のタグと空白を除いた内容で判定する。空のセルの多い表はタグだけで圧縮率が低くなるため）
+REPETITION_RATIO = float(os.environ.get('OCR_REPETITION_RATIO', '0.08'))
+
+# 繰り返しの判定で表のタグと空白を除く範囲（末尾の文字数。タグの多い表でも判定に足りる内容を残す）
+REPETITION_SCAN_WINDOW = DEGENERATION_WINDOW * 8
+
+# 末尾の文字エントロピー（ビット/文字）がこれ未満の場合は低エントロピーと判定
+LOW_ENTROPY_BITS = float(os.environ.get('OCR_LOW_ENTROPY_BITS', '1.0'))
+
+# 空白以外の文字が増えないまま生成できるトークン数（超過時は停滞と判定）
+STALL_TOKENS = int(os.environ.get('OCR_STALL_TOKENS', '512'))
+
+# 判定する間隔（生成トークン数）
+CHECK_INTERVAL_TOKENS = 32
+
+# 画像に応じた生成トークン数の上限（基本値 + 画像1枚（全体画像・タイル）あたりの値、両方0の場合は無効）
+TOKEN_BUDGET_BASE = int(os.environ.get('OCR_TOKEN_BUDGET_BASE', '0'))
+TOKEN_BUDGET_PER_TILE = int(os.environ.get('OCR_TOKEN_BUDGET_PER_TILE', '0'))
+
+# 内容の密度（page_screen.screen_page の推定値、0〜1）に応じた生成トークン数の上限
+# （基本値 + 密度1.0あたりの値。0の場合は無効、タイル数による上限と両方有効な場合は小さい方）
+TOKEN_BUDGET_PER_DENSITY = int(os.environ.get('OCR_TOKEN_BUDGET_PER_DENSITY', '0'))
+
+# 打ち切りの理由
+TRUNCATED_REPETITION = 'repetition'
+TRUNCATED_LOW_ENTROPY = 'low_entropy'
+TRUNCATED_STALLED = 'stalled'
+TRUNCATED_MAX_TOKENS = 'max_tokens'
+
+# 繰り返しの判定から除く表のタグと空白
+_TABLE_MARKUP = re.compile(r'</?(?:table|thead|tbody|tr|th|td)\b[^>]*>|\s+')
+
+
+def monitor_settings() -> dict:
+    """
+    出力に影響する監視・トークン数上限の設定を返す（キャッシュキー用）
+    """
+    return {
+        "degeneration_check": DEGENERATION_CHECK,
+        "degeneration_min_tokens": DEGENERATION_MIN_TOKENS,
+        "degeneration_window": DEGENERATION_WINDOW,
+        "repetition_ratio": REPETITION_RATIO,
+        "low_entropy_bits": LOW_ENTROPY_BITS,
+        "stall_tokens": STALL_TOKENS,
+        "token_budget": [TOKEN_BUDGET_BASE, TOKEN_BUDGET_PER_TILE, TOKEN_BUDGET_PER_DENSITY]
+    }
+
+
+def token_budget(
+    image_size: Optional[Tuple[int, int]],
+    crop_mode: bool,
+    density: Optional[float] = None
+) -> Optional[int]:
+    """
+    画像サイズとタイル数、内容の密度から生成トークン数の上限を計算
+
+    クロップモードではタイル数が多い（大きい・縦長の）画像ほど上限を大きくする。
+    TOKEN_BUDGET_PER_DENSITY を設定した場合は、文字の少ないページほど上限を小さくする。
+
+    Args:
+        image_size: 元の画像サイズ（幅, 高さ）。Noneの場合は全体画像のみとして扱う
+        crop_mode: クロップモード
+        density: 内容の密度の推定値（推定していない場合はNone）
+
+    Returns:
+        Optional[int]: 生成トークン数の上限（無効な場合はNone）
+    """
+    budgets = []
+    # 基本値のみの場合は従来どおりタイル数による上限とする
+    if TOKEN_BUDGET_PER_TILE > 0 or (TOKEN_BUDGET_BASE > 0 and TOKEN_BUDGET_PER_DENSITY <= 0):
+        columns, rows = crop_grid(*image_size) if crop_mode and image_size is not None else (1, 1)
+        # 全体画像 + タイル（分割されない場合はタイルなし）
+        images = 1 + (columns * rows if columns * rows > 1 else 0)
+        budgets.append(TOKEN_BUDGET_BASE + TOKEN_BUDGET_PER_TILE * images)
+    if TOKEN_BUDGET_PER_DENSITY > 0 and density is not None:
+        budgets.append(TOKEN_BUDGET_BASE + round(TOKEN_BUDGET_PER_DENSITY * density))
+    if not budgets:
+        return None
+    return max(1, min(budgets))
+
+
+def _entropy(text: str) -> float:
+    """
+    文字の出現頻度によるエントロピー（ビット/文字）
+    """
+    counts = Counter(text)
+    total = len(text)
+    return -sum(count / total * math.log2(count / total) for count in counts.values())
+
+
+def _is_repetitive(text: str) -> bool:
+    """
+    表のタグと空白を除いた末尾の内容の圧縮率が REPETITION_RATIO 未満かを判定
+
+    除いた後の内容が DEGENERATION_WINDOW に満たない場合は判定しない。
+    """
+    content = _TABLE_MARKUP.sub('', text[-REPETITION_SCAN_WINDOW:])[-DEGENERATION_WINDOW:]
+    if len(content) < DEGENERATION_WINDOW:
+        return False
+    encoded = content.encode('utf-8')
+    return len(zlib.compress(encoded)) / len(encoded) < REPETITION_RATIO
+
+
+class GenerationMonitor:
+    """
+    生成途中の出力を監視し、劣化した生成を検出するクラス
+
+    CHECK_INTERVAL_TOKENSトークンごとに出力の末尾を調べ、
+    短いパターンの繰り返し（表のタグと空白を除いた内容の圧縮率が極端に低い）、低エントロピー（同じ文字の連続など）、
+    空白以外の出力が増えない停滞を検出する。
+    """
+
+    def __init__(self, enabled: bool = DEGENERATION_CHECK):
+        self.enabled = enabled
+        self._next_check = DEGENERATION_MIN_TOKENS
+        # 空白以外の文字数と、それが最後に増えた時点のトークン数
+        self._content_length = 0
+        self._progress_tokens = 0
+
+    def feed(self, text: str, num_tokens: int) -> Optional[str]:
+        """
+        生成途中の出力を確認
+
+        Args:
+            text: これまでに生成されたテキスト全体
+            num_tokens: これまでに生成されたトークン数
+
+        Returns:
+            Optional[str]: 劣化を検出した場合は理由（repetition, low_entropy, stalled）
+        """
+        if not self.enabled or num_tokens < self._next_check:
+            return None
+        self._next_check = num_tokens + CHECK_INTERVAL_TOKENS
+
+        # 末尾の空白を除いた長さで進行を判定（空白・改行のみの生成は停滞とみなす）
+        content_length = len(text.rstrip())
+        if content_length > self._content_length:
+            self._content_length = content_length
+            self._progress_tokens = num_tokens
+        elif num_tokens - self._progress_tokens >= STALL_TOKENS:
+            return TRUNCATED_STALLED
+
+        tail = text[-DEGENERATION_WINDOW:]
+        if len(tail) < DEGENERATION_WINDOW:
+            return None
+        if _entropy(tail) < LOW_ENTROPY_BITS:
+            return TRUNCATED_LOW_ENTROPY
+        if _is_repetitive(text):
+            return TRUNCATED_REPETITION
+        return None
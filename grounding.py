@@ -0,0 +1,199 @@
+"""
+グラウンディング出力パーサーモジュール
+`<|ref|>ラベル<|/ref|><|det|>[[x1, y1, x2, y2]]<|/det|>` 形式のモデル出力を領域のリストに変換
+"""
+
+import json
+from typing import List, Optional, Tuple
+
+# グラウンディングのタグ
+REF_START = '<|ref|>'
+REF_END = '<|/ref|>'
+DET_START = '<|det|>'
+DET_END = '<|/det|>'
+
+# モデルが出力する座標の最大値（座標は画像サイズに対して0〜999に正規化されている）
+COORD_MAX = 999
+
+# ラベルから領域の種類への対応（ここにないラベルはtext）
+REGION_TYPES = {
+    'title': 'title',
+    'sub_title': 'title',
+    'table': 'table',
+    'image': 'image'
+}
+
+
+def region_type(label: str) -> str:
+    """
+    ラベルを領域の種類（text, table, image, title）に変換
+
+    Args:
+        label: `<|ref|>` 内のラベル
+
+    Returns:
+        str: 領域の種類
+    """
+    return REGION_TYPES.get(label, 'text')
+
+
+def scale_box(box: List[float], image_size: Tuple[int, int]) -> List[int]:
+    """
+    正規化された座標を画像のピクセル座標に変換
+
+    Args:
+        box: 正規化された座標 [x1, y1, x2, y2]
+        image_size: 元の画像サイズ（幅, 高さ）
+
+    Returns:
+        List[int]: ピクセル座標 [x1, y1, x2, y2]
+    """
+    width, height = image_size
+    x1, y1, x2, y2 = box
+    return [
+        int(x1 / COORD_MAX * width),
+        int(y1 / COORD_MAX * height),
+        int(x2 / COORD_MAX * width),
+        int(y2 / COORD_MAX * height)
+    ]
+
+
+def _parse_boxes(det: str) -> List[List[float]]:
+    """
+    `<|det|>` 内の座標リストを読み取る（読み取れない場合は空リスト）
+    """
+    try:
+        boxes = json.loads(det)
+    except ValueError:
+        return []
+    if not isinstance(boxes, list):
+        return []
+    if boxes and not isinstance(boxes[0], list):
+        boxes = [boxes]
+    return [box for box in boxes if isinstance(box, list) and len(box) == 4]
+
+
+class GroundingParser:
+    """
+    グラウンディング出力を1回の走査で領域に分割するインクリメンタルパーサー
+
+    ストリーミングの差分を順に渡すと、次の `<|ref|>` が現れて内容が確定した領域から返す。
+    各領域は type（text, table, image, title）、label、text、
+    normalized_boxes（0〜999）、boxes（画像サイズ指定時のピクセル座標、未指定時はNone）を持つ。
+    """
+
+    def __init__(self, image_size: Optional[Tuple[int, int]] = None):
+        self.image_size = image_size
+        # 未確定の出力（現在の領域の内容の先頭から）
+        self._buffer = ""
+        # `<|ref|>` を探し始める位置
+        self._scan_from = 0
+        # 内容を読み取り中の領域
+        self._current: Optional[dict] = None
+
+    def feed(self, delta: str) -> List[dict]:
+        """
+        生成された差分テキストを追加
+
+        Args:
+            delta: 差分テキスト
+
+        Returns:
+            List[dict]: 新たに確定した領域
+        """
+        self._buffer += delta
+        regions = []
+        while True:
+            start = self._buffer.find(REF_START, self._scan_from)
+            if start < 0:
+                # タグの途中で区切られている可能性がある末尾だけを次回に再走査する
+                self._scan_from = max(self._scan_from, len(self._buffer) - len(REF_START) + 1)
+                if self._current is None:
+                    # 最初の領域より前の出力は保持しない
+                    self._buffer = self._buffer[self._scan_from:]
+                    self._scan_from = 0
+                break
+
+            header = self._read_header(start)
+            if header is None:
+                # タグが未完成のため続きを待つ
+                self._scan_from = start
+                break
+            label, boxes, header_end = header
+
+            if self._current is not None:
+                regions.append(self._finish(self._buffer[:start]))
+            self._current = {"label": label, "normalized_boxes": boxes}
+            self._buffer = self._buffer[header_end:]
+            self._scan_from = 0
+        return regions
+
+    def flush(self) -> List[dict]:
+        """
+        生成完了時に残りの領域を確定
+
+        Returns:
+            List[dict]: 新たに確定した領域
+        """
+        if self._current is None:
+            return []
+        region = self._finish(self._buffer)
+        self._buffer = ""
+        self._scan_from = 0
+        return [region]
+
+    def _read_header(self, start: int) -> Optional[Tuple[str, List[List[float]], int]]:
+        """
+        start位置の `<|ref|>...<|/ref|>`（と続く `<|det|>...<|/det|>`）を読み取る
+
+        Returns:
+            Optional[Tuple[str, List[List[float]], int]]: ラベル、正規化座標、タグの終了位置
+                （タグが未完成の場合はNone）
+        """
+        label_start = start + len(REF_START)
+        ref_end = self._buffer.find(REF_END, label_start)
+        if ref_end < 0:
+            return None
+        label = self._buffer[label_start:ref_end].strip()
+
+        det_start = ref_end + len(REF_END)
+        following = self._buffer[det_start:det_start + len(DET_START)]
+        if following != DET_START[:len(following)]:
+            # 座標のない領域
+            return label, [], det_start
+        if len(following) < len(DET_START):
+            return None
+        det_end = self._buffer.find(DET_END, det_start)
+        if det_end < 0:
+            return None
+        boxes = _parse_boxes(self._buffer[det_start + len(DET_START):det_end])
+        return label, boxes, det_end + len(DET_END)
+
+    def _finish(self, content: str) -> dict:
+        region = self._current
+        self._current = None
+        return {
+            "type": region_type(region["label"]),
+            "label": region["label"],
+            "text": content.strip(),
+            "normalized_boxes": region["normalized_boxes"],
+            "boxes": (
+                [scale_box(box, self.image_size) for box in region["normalized_boxes"]]
+                if self.image_size is not None else None
+            )
+        }
+
+
+def parse_grounding(raw_output: str, image_size: Optional[Tuple[int, int]] = None) -> List[dict]:
+    """
+    グラウンディング出力全体を領域のリストに変換
+
+    Args:
+        raw_output: OCRモデルの生出力
+        image_size: 元の画像サイズ（幅, 高さ）。指定時はピクセル座標も返す
+
+    Returns:
+        List[dict]: 出力順の領域（グラウンディングのタグがない場合は空リスト）
+    """
+    parser = GroundingParser(image_size)
+    return parser.feed(raw_output) + parser.flush()
@@ -3,25 +3,291 @@
 画像ファイルやPDFファイルを読み込んでPIL Imageオブジェクトとして返す
 """
 
+import io
+import math
 import os
 import tempfile
-from typing import Optional
+import zipfile
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple, Union
 from PIL import Image
 from fastapi import HTTPException
-from pdf2image import convert_from_path
+
+from inference_backend import BASE_SIZE, IMAGE_SIZE, crop_grid
+from page_screen import screen_page
+
+# PDF処理のインポート（PyMuPDFを優先し、pdf2imageはフォールバック）
+try:
+    import pymupdf
+except ImportError:
+    try:
+        import fitz as pymupdf  # PyMuPDF 1.24.3より前のモジュール名
+    except ImportError:
+        pymupdf = None
+
+try:
+    from pdf2image import convert_from_path, pdfinfo_from_path
+except ImportError:
+    convert_from_path = pdfinfo_from_path = None
 
 # 対応する画像ファイルの拡張子
 SUPPORTED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tiff', '.pdf')
 
+# アーカイブファイルの拡張子
+ARCHIVE_EXTENSIONS = ('.zip',)
+
+# PDFのラスタライズ解像度
+PDF_DPI = 300
+
+# ファイル内容（bytes、またはアップロードファイルを参照するmemoryview）
+FileContent = Union[bytes, memoryview]
+
+# 読み込み時にモデルの入力解像度まで縮小するか（1: 有効, 0: 元の解像度のまま）
+ADAPTIVE_RESIZE = os.environ.get('OCR_ADAPTIVE_RESIZE', '1') == '1'
+
+# PDFのレンダラー（auto: PyMuPDFがあれば使用, pymupdf: メモリ上で描画, pdf2image: pdftoppmで変換）
+PDF_RENDERER = os.environ.get('OCR_PDF_RENDERER', 'auto')
+
+
+def is_pdf(filename: str) -> bool:
+    """
+    ファイル名がPDFかどうかを判定
+
+    Args:
+        filename: ファイル名
+
+    Returns:
+        bool: PDFの場合True
+    """
+    return filename.lower().endswith('.pdf')
+
+
+def is_archive(filename: str) -> bool:
+    """
+    ファイル名がアーカイブ（ZIP）かどうかを判定
+
+    Args:
+        filename: ファイル名
+
+    Returns:
+        bool: アーカイブの場合True
+    """
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def open_archive(file_obj: BinaryIO, filename: str) -> Tuple[zipfile.ZipFile, List[str]]:
+    """
+    ZIPファイルを開き、処理対象のファイル名一覧を返す
+
+    ディレクトリ、隠しファイル、macOSのメタデータ（__MACOSX）は除外する。
+    非対応形式のファイルは一覧に含め、読み込み時にエラーとして扱う。
+
+    Args:
+        file_obj: ZIPファイルのファイルオブジェクト（シーク可能であること）
+        filename: ファイル名
+
+    Returns:
+        Tuple[zipfile.ZipFile, List[str]]: 開いたZIPファイルと処理対象のファイル名一覧
+
+    Raises:
+        HTTPException: ZIPファイルとして読み込めない場合
+    """
+    try:
+        archive = zipfile.ZipFile(file_obj)
+    except zipfile.BadZipFile as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"ZIPファイルの読み込みに失敗しました: {filename}: {str(e)}"
+        )
+
+    member_names = [
+        info.filename
+        for info in archive.infolist()
+        if not info.is_dir()
+        and not info.filename.startswith('__MACOSX/')
+        and not os.path.basename(info.filename).startswith('.')
+    ]
+    print(f"ZIPファイルを展開: {filename} ({len(member_names)}ファイル)")
+    return archive, member_names
+
+
+class _MemoryReader(io.RawIOBase):
+    """
+    memoryviewをコピーせずに読み込むファイルオブジェクト
+    """
+
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        size = min(len(buffer), len(self._view) - self._position)
+        if size <= 0:
+            return 0
+        buffer[:size] = self._view[self._position:self._position + size]
+        self._position += size
+        return size
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def close(self):
+        super().close()
+        self._view.release()
+
+
+def _open_stream(file_content: FileContent) -> BinaryIO:
+    """
+    ファイル内容を読み込み用のファイルオブジェクトにする（bytesのBytesIOはコピーされない）
+    """
+    if isinstance(file_content, bytes):
+        return io.BytesIO(file_content)
+    return io.BufferedReader(_MemoryReader(memoryview(file_content)))
+
+
+def _open_pdf_document(file_content: FileContent):
+    """
+    PyMuPDFでPDFを開く（memoryviewに対応していない古いバージョンではbytesにコピー）
+    """
+    try:
+        return pymupdf.open(stream=file_content, filetype='pdf')
+    except TypeError:
+        return pymupdf.open(stream=bytes(file_content), filetype='pdf')
+
+
+def estimate_decoded_bytes(file_content: FileContent, filename: str, crop_mode: Optional[bool] = None) -> int:
+    """
+    1枚の画像（PDFは1ページ目）のデコードと前処理に必要なメモリの概算
+
+    ヘッダーのみを読み、デコード後の画像（縮小を考慮）、RGB変換、
+    前処理後の全体画像とタイル（float32）の合計を返す。
+
+    Args:
+        file_content: ファイルのバイナリコンテンツ
+        filename: ファイル名
+        crop_mode: OCRで使用するクロップモード（Noneの場合は元の解像度で読み込む）
+
+    Returns:
+        int: 概算のバイト数（推定できない場合はファイルサイズ）
+    """
+    try:
+        if is_pdf(filename):
+            if pymupdf is not None and pdf_renderer() == 'pymupdf':
+                with _open_pdf_document(file_content) as document:
+                    rect = document[0].rect
+                size = _page_size(rect.width, rect.height, _page_dpi(rect.width, rect.height, crop_mode))
+            else:
+                # pdf2imageはPDF_DPIで変換する（A4として概算）
+                size = _page_size(595, 842)
+            bands = 3
+        else:
+            img = Image.open(_open_stream(file_content))
+            size = img.size
+            if crop_mode is not None and ADAPTIVE_RESIZE and img.format == 'JPEG':
+                # draft()と同じく、必要なサイズ以上で最も小さい1/2^nの倍率
+                target = target_size(*size, crop_mode)
+                scale = 1
+                while scale < 8 and size[0] // (scale * 2) >= target[0] and size[1] // (scale * 2) >= target[1]:
+                    scale *= 2
+                size = (-(-size[0] // scale), -(-size[1] // scale))
+            bands = len(img.getbands()) + (0 if img.mode == 'RGB' else 3)
+    except Exception:
+        return len(file_content)
+
+    grid = crop_grid(*size) if crop_mode else (1, 1)
+    preprocess_bytes = (BASE_SIZE * BASE_SIZE + IMAGE_SIZE * IMAGE_SIZE * grid[0] * grid[1]) * 3 * 4
+    return size[0] * size[1] * bands + preprocess_bytes
+
+
+def target_size(width: int, height: int, crop_mode: bool) -> Tuple[int, int]:
+    """
+    DeepseekOCRProcessorの入力に必要な最小の画像サイズを計算
+
+    全体画像はBASE_SIZE四方に、クロップモードのタイルは（IMAGE_SIZE x タイル数）に
+    リサイズされるため、両方を満たす大きさまでは縮小しても入力は変わらない。
+    縮小でタイル分割数が変わる場合や、縮小の必要がない場合は元のサイズを返す。
+
+    Args:
+        width: 画像の幅
+        height: 画像の高さ
+        crop_mode: クロップモード
+
+    Returns:
+        Tuple[int, int]: 縮小後のサイズ（幅, 高さ）
+    """
+    scale = BASE_SIZE / max(width, height)
+    grid = crop_grid(width, height) if crop_mode else (1, 1)
+    if grid != (1, 1):
+        scale = max(scale, IMAGE_SIZE * grid[0] / width, IMAGE_SIZE * grid[1] / height)
+    if scale >= 1:
+        return width, height
+
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    if crop_mode and crop_grid(*size) != grid:
+        return width, height
+    return size
+
 
-def load_image_from_file(file_content: bytes, filename: str) -> Optional[Image.Image]:
+def _downscale(img: Image.Image, crop_mode: Optional[bool]) -> Image.Image:
+    """
+    モデルの入力解像度の2倍以上ある画像を整数倍で縮小する（crop_modeがNoneの場合は縮小しない）
+
+    最終的なリサイズはDeepseekOCRProcessorが行うため、ここでは必要なサイズを
+    下回らない範囲で平均化による縮小（Image.reduce）のみ行う。
+    """
+    original_size = img.info.get('original_size', img.size)
+    img.info['original_size'] = original_size
+    if crop_mode is None or not ADAPTIVE_RESIZE:
+        return img
+    size = target_size(*original_size, crop_mode)
+    factor = min(img.size[0] // size[0], img.size[1] // size[1])
+    if factor < 2:
+        return img
+    try:
+        reduced = img.reduce(factor)
+    except ValueError:
+        # 縮小に対応していない画像モード
+        return img
+    if crop_mode and crop_grid(*reduced.size) != crop_grid(*original_size):
+        return img
+    reduced.info['original_size'] = original_size
+    print(f"  モデル入力解像度に縮小: {img.size} -> {reduced.size}")
+    return reduced
+
+
+def load_image_from_file(
+    file_content: FileContent,
+    filename: str,
+    crop_mode: Optional[bool] = None,
+    screen: bool = False
+) -> Optional[Image.Image]:
     """
     アップロードされたファイルから画像を読み込む
-    
+
+    crop_modeを指定した場合、モデルの入力に必要な解像度まで縮小して返す
+    （JPEGはデコード時にDCT領域で縮小し、PDFは必要な解像度で描画する）。
+    元の画像サイズは img.info['original_size'] に記録する。
+    screenを指定した場合、縮小後の画像で白紙の判定と内容の密度の推定を行い img.info['screen'] に記録する。
+
     Args:
         file_content: ファイルのバイナリコンテンツ
         filename: ファイル名
-        
+        crop_mode: OCRで使用するクロップモード（Noneの場合は元の解像度のまま）
+        screen: 白紙の判定を行うか（page_screen.screen_page）
+
     Returns:
         PIL.Image.Image: 読み込んだ画像（RGB形式）
         
@@ -36,40 +302,39 @@ def load_image_from_file(file_content: bytes, filename: str) -> Optional[Image.I
         )
 
     try:
-        # PDFファイルの処理
-        if filename.lower().endswith('.pdf'):
-            print(f"PDFファイルを画像に変換中: {filename}")
-            
-            # 一時ファイルに保存してPDF変換
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-                temp_file.write(file_content)
-                temp_path = temp_file.name
-
+        # PDFファイルの処理（最初のページのみ）
+        if is_pdf(filename):
+            pages = iter_pdf_pages(
+                file_content, filename, first_page=1, last_page=1, crop_mode=crop_mode, screen=screen
+            )
             try:
-                # PDFの最初のページを画像として変換（300 DPIで高品質変換）
-                images = convert_from_path(
-                    temp_path,
-                    first_page=1,
-                    last_page=1,
-                    dpi=300,
-                    fmt='RGB'
-                )
-                if images:
-                    img = images[0]
-                    print(f"  PDF変換完了: サイズ={img.size}, モード={img.mode}, DPI=300")
-                    return img
-                else:
-                    raise Exception("PDFファイルの変換結果が空です")
+                _, img = next(pages)
             finally:
-                # 一時ファイルを削除
-                os.unlink(temp_path)
+                pages.close()
+            return img
 
         # 通常の画像ファイルの処理
         else:
             print(f"画像ファイルを読み込み中: {filename}")
-            
-            import io
-            img = Image.open(io.BytesIO(file_content))
+
+            stream = _open_stream(file_content)
+            img = Image.open(stream)
+            original_size = img.size
+            if crop_mode is not None and ADAPTIVE_RESIZE and img.format == 'JPEG':
+                # JPEGはデコード時に1/2〜1/8へ縮小（必要なサイズ以上で最も小さい倍率）
+                img.draft('RGB', target_size(*original_size, crop_mode))
+            # 遅延読み込みを避け、デコードをこの時点で完了させる
+            img.load()
+            # PNGなどは読み込み後もファイルを参照し続けるため、アップロード内容の参照をここで解放する
+            stream.close()
+            img.info['original_size'] = original_size
+
+            # 縮小してからRGBに変換する（二値・パレット画像はグレースケール/RGBにしてから縮小）
+            if img.mode == '1':
+                img = img.convert('L')
+            elif img.mode == 'P':
+                img = img.convert('RGB')
+            img = _downscale(img, crop_mode)
 
             # RGB形式に変換（OCR処理の標準化）
             if img.mode != 'RGB':
@@ -77,6 +342,8 @@ def load_image_from_file(file_content: bytes, filename: str) -> Optional[Image.I
                 img = img.convert('RGB')
 
             print(f"  画像読み込み完了: サイズ={img.size}, モード={img.mode}")
+            if screen:
+                img.info['screen'] = screen_page(img)
             return img
 
     except HTTPException:
@@ -86,3 +353,220 @@ def load_image_from_file(file_content: bytes, filename: str) -> Optional[Image.I
             status_code=500,
             detail=f"画像の読み込みに失敗しました: {str(e)}"
         )
+
+
+def iter_pdf_pages(
+    file_content: FileContent,
+    filename: str,
+    first_page: int = 1,
+    last_page: Optional[int] = None,
+    crop_mode: Optional[bool] = None,
+    skip_page: Optional[Callable[[int], bool]] = None,
+    screen: bool = False
+) -> Iterator[Tuple[int, Optional[Image.Image]]]:
+    """
+    PDFの各ページを1ページずつ画像に変換して返すジェネレータ
+
+    ページは要求されるたびに変換されるため、変換済みのページから
+    順にOCR推論へ投入できる。crop_modeを指定した場合は、PDF_DPIで描画した場合の
+    サイズからモデルの入力に必要な解像度を求め、それ以下のDPIで描画する。
+
+    Args:
+        file_content: PDFファイルのバイナリコンテンツ
+        filename: ファイル名
+        first_page: 変換を開始するページ番号（1始まり）
+        last_page: 変換を終了するページ番号（Noneの場合は最終ページ）
+        crop_mode: OCRで使用するクロップモード（Noneの場合はPDF_DPIで描画）
+        skip_page: ページ番号を受け取り、Trueを返したページは変換せずに画像をNoneとして返す
+        screen: 各ページの白紙の判定を行い、結果を img.info['screen'] に記録するか
+
+    Yields:
+        Tuple[int, Optional[PIL.Image.Image]]: ページ番号と画像（RGB形式、変換を省略したページはNone）
+
+    Raises:
+        HTTPException: ページ範囲が不正、または変換に失敗した場合
+    """
+    if not is_pdf(filename):
+        raise HTTPException(
+            status_code=400,
+            detail=f"ページ指定はPDFファイルのみ対応しています: {filename}"
+        )
+
+    if pdf_renderer() == 'pymupdf':
+        pages = _iter_pdf_pages_pymupdf(file_content, filename, first_page, last_page, crop_mode, skip_page)
+    else:
+        pages = _iter_pdf_pages_pdf2image(file_content, filename, first_page, last_page, crop_mode, skip_page)
+    try:
+        for page_number, img in pages:
+            if screen and img is not None:
+                img.info['screen'] = screen_page(img)
+            yield page_number, img
+    finally:
+        pages.close()
+
+
+def pdf_renderer() -> str:
+    """
+    使用するPDFレンダラーを返す
+
+    Returns:
+        str: pymupdf または pdf2image
+
+    Raises:
+        HTTPException: 指定されたレンダラーが利用できない場合
+    """
+    renderer = PDF_RENDERER
+    if renderer == 'auto':
+        renderer = 'pymupdf' if pymupdf is not None else 'pdf2image'
+    if renderer == 'pymupdf' and pymupdf is None:
+        raise HTTPException(status_code=500, detail="PyMuPDFがインストールされていません")
+    if renderer == 'pdf2image' and convert_from_path is None:
+        raise HTTPException(status_code=500, detail="pdf2imageがインストールされていません")
+    if renderer not in ('pymupdf', 'pdf2image'):
+        raise HTTPException(status_code=500, detail=f"不正なPDFレンダラーです: {renderer}")
+    return renderer
+
+
+def _page_size(width_pt: float, height_pt: float, dpi: float = PDF_DPI) -> Tuple[int, int]:
+    """
+    ページサイズ（ポイント）を指定したDPIで描画した場合のピクセルサイズ
+    """
+    return math.ceil(width_pt * dpi / 72), math.ceil(height_pt * dpi / 72)
+
+
+def _page_dpi(width_pt: float, height_pt: float, crop_mode: Optional[bool]) -> float:
+    """
+    モデルの入力に必要な解像度を満たす最小の描画DPIを計算（PDF_DPIを上限とする）
+    """
+    if crop_mode is None or not ADAPTIVE_RESIZE:
+        return PDF_DPI
+    full_size = _page_size(width_pt, height_pt)
+    size = target_size(*full_size, crop_mode)
+    if size == full_size:
+        return PDF_DPI
+    # 描画サイズの丸めでタイル分割数が変わらないよう、わずかに大きく描画する
+    dpi = min(PDF_DPI, PDF_DPI * max(size[0] / full_size[0], size[1] / full_size[1]) * 1.01)
+    if crop_mode and crop_grid(*_page_size(width_pt, height_pt, dpi)) != crop_grid(*full_size):
+        return PDF_DPI
+    return dpi
+
+
+def _check_page_range(first_page: int, last_page: Optional[int], page_count: int) -> int:
+    """
+    ページ範囲を検証し、終了ページを返す（Noneまたは総ページ数を超える場合は最終ページ）
+    """
+    if last_page is None or last_page > page_count:
+        last_page = page_count
+    if first_page < 1 or first_page > last_page:
+        raise HTTPException(
+            status_code=400,
+            detail=f"ページ範囲が不正です: {first_page}-{last_page} (総ページ数: {page_count})"
+        )
+    return last_page
+
+
+def _iter_pdf_pages_pymupdf(
+    file_content: FileContent,
+    filename: str,
+    first_page: int,
+    last_page: Optional[int],
+    crop_mode: Optional[bool],
+    skip_page: Optional[Callable[[int], bool]] = None
+) -> Iterator[Tuple[int, Optional[Image.Image]]]:
+    """
+    PyMuPDFでアップロード内容からメモリ上で直接ページを描画する（一時ファイル・子プロセスなし）
+    """
+    try:
+        document = _open_pdf_document(file_content)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"PDFファイルの読み込みに失敗しました: {str(e)}"
+        )
+
+    try:
+        last_page = _check_page_range(first_page, last_page, document.page_count)
+        print(f"PDFファイルを画像に変換中: {filename} (ページ {first_page}-{last_page}/{document.page_count})")
+        for page_number in range(first_page, last_page + 1):
+            if skip_page is not None and skip_page(page_number):
+                yield page_number, None
+                continue
+            try:
+                page = document[page_number - 1]
+                dpi = _page_dpi(page.rect.width, page.rect.height, crop_mode)
+                pixmap = page.get_pixmap(
+                    matrix=pymupdf.Matrix(dpi / 72, dpi / 72), colorspace=pymupdf.csRGB, alpha=False
+                )
+                # ピクセルバッファから直接RGB画像を作成（行末のパディングはstrideで処理）
+                img = Image.frombytes(
+                    'RGB', (pixmap.width, pixmap.height), pixmap.samples,
+                    'raw', 'RGB', pixmap.stride
+                )
+            except Exception as e:
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"PDFの{page_number}ページ目の変換に失敗しました: {str(e)}"
+                )
+            img.info['original_size'] = _page_size(page.rect.width, page.rect.height)
+            print(f"  ページ{page_number}変換完了: サイズ={img.size}, モード={img.mode}, DPI={dpi:.0f}")
+            yield page_number, img
+    finally:
+        document.close()
+
+
+def _iter_pdf_pages_pdf2image(
+    file_content: FileContent,
+    filename: str,
+    first_page: int,
+    last_page: Optional[int],
+    crop_mode: Optional[bool],
+    skip_page: Optional[Callable[[int], bool]] = None
+) -> Iterator[Tuple[int, Optional[Image.Image]]]:
+    """
+    pdf2image（pdftoppm）で一時ファイル経由でページを変換する（PDF_DPIで変換後に縮小）
+    """
+    # 一時ファイルに保存してPDF変換
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
+        temp_file.write(file_content)
+        temp_path = temp_file.name
+
+    try:
+        try:
+            page_count = int(pdfinfo_from_path(temp_path)["Pages"])
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"PDFファイルの読み込みに失敗しました: {str(e)}"
+            )
+
+        last_page = _check_page_range(first_page, last_page, page_count)
+
+        print(f"PDFファイルを画像に変換中: {filename} (ページ {first_page}-{last_page}/{page_count})")
+        for page_number in range(first_page, last_page + 1):
+            if skip_page is not None and skip_page(page_number):
+                yield page_number, None
+                continue
+            try:
+                images = convert_from_path(
+                    temp_path,
+                    first_page=page_number,
+                    last_page=page_number,
+                    dpi=PDF_DPI,
+                    fmt='RGB'
+                )
+            except Exception as e:
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"PDFの{page_number}ページ目の変換に失敗しました: {str(e)}"
+                )
+            if not images:
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"PDFの{page_number}ページ目の変換結果が空です"
+                )
+            img = _downscale(images[0], crop_mode)
+            print(f"  ページ{page_number}変換完了: サイズ={img.size}, モード={img.mode}, DPI={PDF_DPI}")
+            yield page_number, img
+    finally:
+        # 一時ファイルを削除
+        os.unlink(temp_path)
@@ -0,0 +1,648 @@
+"""
+推論バックエンドモジュール
+DeepSeekOCREngineが委譲する前処理・テキスト生成・中断処理を実装
+"""
+
+import asyncio
+import functools
+import multiprocessing
+import os
+import queue
+import re
+import sys
+import threading
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from PIL import Image, ImageOps
+
+# 使用するバックエンド（vllm または fake）
+BACKEND = os.environ.get('OCR_BACKEND', 'vllm')
+
+# モデルパス
+MODEL_PATH = 'deepseek-ai/DeepSeek-OCR'
+
+# DeepSeek-OCRのモジュールパス
+DEEPSEEK_OCR_VLLM_PATH = '/DeepSeek-OCR/DeepSeek-OCR-master/DeepSeek-OCR-vllm'
+
+# サンプリング設定
+MAX_TOKENS = 8192
+NGRAM_SIZE = 30
+NGRAM_WINDOW_SIZE = 90
+NGRAM_WHITELIST_TOKEN_IDS = {128821, 128822}  # <td>, </td>
+
+# vLLMのプレフィックスキャッシュ（同じ画像を複数のプロンプトで処理する場合に画像トークンのKVキャッシュを再利用）
+# V0エンジンのブロックのハッシュは画像の内容を含まない場合があるため、使用するvLLMで確認してから有効にする
+PREFIX_CACHING = os.environ.get('OCR_PREFIX_CACHING', '0') == '1'
+
+# 前処理でのプロンプト文字列のトークン化結果をキャッシュする件数
+PROMPT_ENCODE_CACHE_SIZE = 256
+
+# DeepseekOCRProcessorの画像サイズ設定（全体画像、タイル、タイル数の範囲）
+BASE_SIZE = 1024
+IMAGE_SIZE = 640
+MIN_CROPS = 2
+MAX_CROPS = 6
+
+# フェイクバックエンドの設定
+FAKE_OUTPUT_PATH = os.environ.get(
+    'OCR_FAKE_OUTPUT',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testdata', 'outputs', 'result_ori.mmd')
+)
+FAKE_LATENCY = float(os.environ.get('OCR_FAKE_LATENCY', '0.2'))
+FAKE_TOKENS_PER_SECOND = float(os.environ.get('OCR_FAKE_TOKENS_PER_SECOND', '500'))
+
+
+def crop_grid(width: int, height: int) -> Tuple[int, int]:
+    """
+    DeepseekOCRProcessorがクロップモードで選ぶタイル分割数（横, 縦）を計算
+
+    IMAGE_SIZE以下の画像は分割されない（1x1）。
+
+    Args:
+        width: 画像の幅
+        height: 画像の高さ
+
+    Returns:
+        Tuple[int, int]: 横方向と縦方向のタイル数
+    """
+    if width <= IMAGE_SIZE and height <= IMAGE_SIZE:
+        return 1, 1
+
+    aspect_ratio = width / height
+    target_ratios = sorted(
+        set(
+            (i, j)
+            for n in range(MIN_CROPS, MAX_CROPS + 1)
+            for i in range(1, n + 1)
+            for j in range(1, n + 1)
+            if MIN_CROPS <= i * j <= MAX_CROPS
+        ),
+        key=lambda ratio: ratio[0] * ratio[1]
+    )
+
+    best_ratio_diff = float('inf')
+    best_ratio = (1, 1)
+    area = width * height
+    for ratio in target_ratios:
+        ratio_diff = abs(aspect_ratio - ratio[0] / ratio[1])
+        if ratio_diff < best_ratio_diff:
+            best_ratio_diff = ratio_diff
+            best_ratio = ratio
+        elif ratio_diff == best_ratio_diff:
+            if area > 0.5 * IMAGE_SIZE * IMAGE_SIZE * ratio[0] * ratio[1]:
+                best_ratio = ratio
+    return best_ratio
+
+
+class InferenceBackend:
+    """
+    推論バックエンドの基底クラス
+
+    generateは生成途中の出力を辞書（text: 生成済みテキスト全体,
+    num_tokens: 生成トークン数, finished: 完了したか）で逐次返す。
+    """
+
+    name = 'base'
+
+    async def initialize(self):
+        raise NotImplementedError
+
+    def shutdown(self):
+        raise NotImplementedError
+
+    def is_initialized(self) -> bool:
+        raise NotImplementedError
+
+    def preprocess_image(self, image: Image.Image, crop_mode: bool = True):
+        raise NotImplementedError
+
+    def generate(
+        self,
+        prompt: str,
+        image_features,
+        request_id: str,
+        max_tokens: int = MAX_TOKENS
+    ) -> AsyncIterator[dict]:
+        raise NotImplementedError
+
+    async def abort(self, request_id: str):
+        raise NotImplementedError
+
+    async def check_health(self) -> bool:
+        """
+        バックエンドが推論可能な状態かを確認する（エンジンプールのヘルスチェック用）
+        """
+        return self.is_initialized()
+
+
+class VLLMBackend(InferenceBackend):
+    """
+    vLLMのAsyncLLMEngineでDeepSeek-OCRモデルを実行するバックエンド
+
+    torch・vLLM・deepseek_ocr・NumPyは初回使用時（initializeまたは前処理）に読み込む。
+    """
+
+    name = 'vllm'
+
+    def __init__(self):
+        self.engine = None
+        self.processor = None
+        self._modules = None
+        # 全リクエストで共有するLogitsProcessor（状態を持たない）とmax_tokensごとのサンプリングパラメータ
+        self._logits_processors = None
+        self._sampling_params: Dict[int, object] = {}
+
+    def _load_modules(self) -> dict:
+        """
+        GPU推論に必要なモジュールを読み込む
+        """
+        if self._modules is not None:
+            return self._modules
+
+        # DeepSeek-OCRのモジュールパスを追加
+        if DEEPSEEK_OCR_VLLM_PATH not in sys.path:
+            sys.path.insert(0, DEEPSEEK_OCR_VLLM_PATH)
+
+        import torch
+        if torch.version.cuda == '11.8':
+            os.environ["TRITON_PTXAS_PATH"] = "/usr/local/cuda-11.8/bin/ptxas"
+
+        os.environ['VLLM_USE_V1'] = '0'
+        os.environ.setdefault("CUDA_VISIBLE_DEVICES", '0')
+
+        from vllm import AsyncLLMEngine, SamplingParams
+        from vllm.engine.arg_utils import AsyncEngineArgs
+        from vllm.model_executor.models.registry import ModelRegistry
+        from deepseek_ocr import DeepseekOCRForCausalLM
+        from process.image_process import DeepseekOCRProcessor
+
+        ModelRegistry.register_model("DeepseekOCRForCausalLM", DeepseekOCRForCausalLM)
+
+        self._modules = {
+            "AsyncLLMEngine": AsyncLLMEngine,
+            "AsyncEngineArgs": AsyncEngineArgs,
+            "SamplingParams": SamplingParams,
+            "DeepseekOCRProcessor": DeepseekOCRProcessor
+        }
+        return self._modules
+
+    async def initialize(self):
+        modules = self._load_modules()
+        engine_args = modules["AsyncEngineArgs"](
+            model=MODEL_PATH,
+            hf_overrides={"architectures": ["DeepseekOCRForCausalLM"]},
+            block_size=256,
+            max_model_len=8192,
+            enforce_eager=False,
+            trust_remote_code=True,
+            tensor_parallel_size=1,
+            gpu_memory_utilization=0.75,
+            enable_prefix_caching=PREFIX_CACHING,
+        )
+        self.engine = modules["AsyncLLMEngine"].from_engine_args(engine_args)
+
+    def shutdown(self):
+        self.engine = None
+
+    def is_initialized(self) -> bool:
+        return self.engine is not None
+
+    def _create_processor(self):
+        """
+        DeepseekOCRProcessorを生成し、プロンプト文字列のトークン化をキャッシュする
+
+        tokenize_with_imagesは画像ごとに同じプロンプトの各区間をトークン化し直すため、
+        encodeの結果を文字列ごとに再利用する（呼び出し側が変更できるよう毎回リストをコピーして返す）。
+        """
+        processor = self._load_modules()["DeepseekOCRProcessor"]()
+        encode = processor.encode
+
+        @functools.lru_cache(maxsize=PROMPT_ENCODE_CACHE_SIZE)
+        def cached_encode(text: str, bos: bool, eos: bool) -> Tuple[int, ...]:
+            return tuple(encode(text, bos=bos, eos=eos))
+
+        processor.encode = lambda text, bos=True, eos=False: list(cached_encode(text, bos, eos))
+        return processor
+
+    def preprocess_image(self, image: Image.Image, crop_mode: bool = True):
+        if self.processor is None:
+            self.processor = self._create_processor()
+        return self.processor.tokenize_with_images(
+            images=[image],
+            bos=True,
+            eos=True,
+            cropping=crop_mode
+        )
+
+    def sampling_params(self, max_tokens: int = MAX_TOKENS):
+        """
+        max_tokensごとのサンプリングパラメータ（初回のみ生成し、以降は再利用）
+
+        vLLMはリクエスト追加時にSamplingParamsを複製し、clone()を持たないLogitsProcessorは
+        複製せずに参照するため、状態を持たないn-gram抑制の1インスタンスを全リクエストで共有できる。
+        """
+        sampling_params = self._sampling_params.get(max_tokens)
+        if sampling_params is None:
+            if self._logits_processors is None:
+                # NumPyを使うためモジュールの読み込みを最初の推論まで遅らせる
+                from ngram_processor import NGramBanLogitsProcessor
+
+                # LogitsProcessorの設定（繰り返しを防ぐ）
+                self._logits_processors = [
+                    NGramBanLogitsProcessor(
+                        ngram_size=NGRAM_SIZE,
+                        window_size=NGRAM_WINDOW_SIZE,
+                        whitelist_token_ids=NGRAM_WHITELIST_TOKEN_IDS
+                    )
+                ]
+            sampling_params = self._load_modules()["SamplingParams"](
+                temperature=0.0,
+                max_tokens=max_tokens,
+                logits_processors=self._logits_processors,
+                skip_special_tokens=False,
+            )
+            self._sampling_params[max_tokens] = sampling_params
+        return sampling_params
+
+    async def generate(
+        self,
+        prompt: str,
+        image_features,
+        request_id: str,
+        max_tokens: int = MAX_TOKENS
+    ) -> AsyncIterator[dict]:
+        sampling_params = self.sampling_params(max_tokens)
+
+        # リクエストの構築
+        if image_features and '<image>' in prompt:
+            request = {
+                "prompt": prompt,
+                "multi_modal_data": {"image": image_features}
+            }
+        else:
+            request = {
+                "prompt": prompt
+            }
+
+        async for request_output in self.engine.generate(
+            request, sampling_params, request_id
+        ):
+            if request_output.outputs:
+                output = request_output.outputs[0]
+                yield {
+                    "text": output.text,
+                    "num_tokens": len(output.token_ids),
+                    "finished": request_output.finished
+                }
+
+    async def abort(self, request_id: str):
+        if self.engine is not None:
+            await self.engine.abort(request_id)
+
+    async def check_health(self) -> bool:
+        if self.engine is None:
+            return False
+        try:
+            await self.engine.check_health()
+        except Exception:
+            return False
+        return True
+
+
+class FakeBackend(InferenceBackend):
+    """
+    GPUなしで動作する決定的なフェイクバックエンド（負荷試験・CI用）
+
+    記録済みのモデル出力を、指定した初回遅延とトークン生成速度で再生する。
+    前処理はDeepseekOCRProcessorと同じサイズへのリサイズ・パディングを行い、
+    CPU側の処理負荷を再現する。
+    healthyをFalseにすると、ヘルスチェックと生成が失敗する（障害時の動作確認用）。
+    """
+
+    name = 'fake'
+
+    # 生成を進める間隔（秒）
+    STEP_INTERVAL = 0.01
+
+    def __init__(
+        self,
+        output_path: str = FAKE_OUTPUT_PATH,
+        latency: float = FAKE_LATENCY,
+        tokens_per_second: float = FAKE_TOKENS_PER_SECOND,
+        output_text: Optional[str] = None
+    ):
+        self.output_path = output_path
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.output_text = output_text
+        self.healthy = True
+        self._tokens: Optional[List[str]] = None
+        self._running: Set[str] = set()
+        self._aborted: Set[str] = set()
+
+    async def initialize(self):
+        if self.output_text is None:
+            with open(self.output_path, 'r', encoding='utf-8') as f:
+                self.output_text = f.read()
+        # 空白・記号・最大4文字の語を1トークンとして扱う
+        self._tokens = re.findall(r'\s+|<\|[^|]*\|>|[^\s<]{1,4}|<', self.output_text)
+
+    def shutdown(self):
+        self._tokens = None
+
+    def is_initialized(self) -> bool:
+        return self._tokens is not None
+
+    def preprocess_image(self, image: Image.Image, crop_mode: bool = True) -> Dict[str, object]:
+        global_view = ImageOps.pad(image, (BASE_SIZE, BASE_SIZE), color=(127, 127, 127))
+        grid = crop_grid(*image.size) if crop_mode else (1, 1)
+        if grid != (1, 1):
+            # タイル分割前のリサイズ（処理負荷の再現のみで結果は使わない）
+            image.resize((IMAGE_SIZE * grid[0], IMAGE_SIZE * grid[1]))
+        return {
+            "image_size": image.size,
+            "global_view_size": global_view.size,
+            "crop_grid": grid,
+            "crop_mode": crop_mode
+        }
+
+    async def generate(
+        self,
+        prompt: str,
+        image_features,
+        request_id: str,
+        max_tokens: int = MAX_TOKENS
+    ) -> AsyncIterator[dict]:
+        if not self.healthy:
+            raise RuntimeError("フェイクバックエンドは障害状態です")
+        tokens = self._tokens[:max_tokens]
+        tokens_per_step = max(1, int(self.tokens_per_second * self.STEP_INTERVAL))
+        step_interval = tokens_per_step / self.tokens_per_second
+
+        self._running.add(request_id)
+        try:
+            await asyncio.sleep(self.latency)
+            num_tokens = 0
+            while num_tokens < len(tokens):
+                if request_id in self._aborted:
+                    return
+                num_tokens = min(len(tokens), num_tokens + tokens_per_step)
+                yield {
+                    "text": "".join(tokens[:num_tokens]),
+                    "num_tokens": num_tokens,
+                    "finished": num_tokens == len(tokens)
+                }
+                if num_tokens < len(tokens):
+                    await asyncio.sleep(step_interval)
+        finally:
+            self._running.discard(request_id)
+            self._aborted.discard(request_id)
+
+    async def abort(self, request_id: str):
+        if request_id in self._running:
+            self._aborted.add(request_id)
+
+    async def check_health(self) -> bool:
+        return self.is_initialized() and self.healthy
+
+
+def _serve_backend(
+    backend_name: str,
+    device: Optional[str],
+    requests: multiprocessing.Queue,
+    responses: multiprocessing.Queue
+):
+    """
+    SubprocessBackendの子プロセスのエントリポイント
+
+    CUDAの初期化前に使用するデバイスを固定してから、バックエンドを実行する。
+    """
+    if device is not None:
+        os.environ['CUDA_VISIBLE_DEVICES'] = device
+    asyncio.run(_serve_backend_async(backend_name, requests, responses))
+
+
+async def _serve_backend_async(
+    backend_name: str,
+    requests: multiprocessing.Queue,
+    responses: multiprocessing.Queue
+):
+    """
+    親プロセスからのコマンド（generate, abort, ping, stop）を受けてバックエンドを操作する
+
+    応答は (種類, リクエストID, 内容) のタプルで返す。
+    """
+    backend = create_backend(backend_name)
+    try:
+        await backend.initialize()
+    except Exception as e:
+        responses.put(("init", None, f"{type(e).__name__}: {e}"))
+        return
+    responses.put(("init", None, None))
+
+    loop = asyncio.get_running_loop()
+    tasks: Dict[str, asyncio.Task] = {}
+
+    async def run(request_id: str, prompt: str, image_features, max_tokens: int):
+        try:
+            async for output in backend.generate(prompt, image_features, request_id, max_tokens):
+                responses.put(("output", request_id, output))
+            responses.put(("done", request_id, None))
+        except Exception as e:
+            responses.put(("error", request_id, f"{type(e).__name__}: {e}"))
+        finally:
+            tasks.pop(request_id, None)
+
+    try:
+        while True:
+            command, request_id, payload = await loop.run_in_executor(None, requests.get)
+            if command == "generate":
+                tasks[request_id] = asyncio.create_task(run(request_id, *payload))
+            elif command == "abort":
+                await backend.abort(request_id)
+            elif command == "ping":
+                responses.put(("pong", request_id, await backend.check_health()))
+            elif command == "stop":
+                break
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        backend.shutdown()
+
+
+class SubprocessBackend(InferenceBackend):
+    """
+    推論バックエンドを子プロセスで実行するバックエンド（レプリカごとにGPUを分けるためのもの）
+
+    子プロセスはCUDA_VISIBLE_DEVICESを指定したデバイスに固定してからモデルを読み込む。
+    前処理は親プロセス内の同種のバックエンド（モデルは読み込まない）で行い、
+    生成・中断・ヘルスチェックのみを子プロセスに送る。
+    """
+
+    # ヘルスチェックの応答を待つ時間（秒）
+    PING_TIMEOUT = 5.0
+
+    # 子プロセスの終了を待つ時間（秒）
+    STOP_TIMEOUT = 10.0
+
+    def __init__(self, backend_name: str = BACKEND, device: Optional[str] = None):
+        self.name = backend_name
+        self.device = device
+        self._local = create_backend(backend_name)
+        self._process: Optional[multiprocessing.Process] = None
+        self._requests: Optional[multiprocessing.Queue] = None
+        self._responses: Optional[multiprocessing.Queue] = None
+        self._reader: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ready: Optional[asyncio.Future] = None
+        self._initialized = False
+        self._streams: Dict[str, asyncio.Queue] = {}
+        self._pings: Dict[str, asyncio.Future] = {}
+        self._ping_count = 0
+
+    async def initialize(self):
+        # CUDA初期化済みのプロセスをforkしないようspawnで起動
+        context = multiprocessing.get_context('spawn')
+        self._loop = asyncio.get_running_loop()
+        self._ready = self._loop.create_future()
+        self._requests = context.Queue()
+        self._responses = context.Queue()
+        self._process = context.Process(
+            target=_serve_backend,
+            args=(self.name, self.device, self._requests, self._responses),
+            daemon=True
+        )
+        self._process.start()
+        self._reader = threading.Thread(target=self._read_responses, daemon=True)
+        self._reader.start()
+
+        error = await self._ready
+        if error is not None:
+            self.shutdown()
+            raise RuntimeError(f"推論プロセスの初期化に失敗しました (device={self.device}): {error}")
+        self._initialized = True
+
+    def shutdown(self):
+        self._initialized = False
+        if self._process is None:
+            return
+        if self._process.is_alive():
+            self._requests.put(("stop", None, None))
+            self._process.join(self.STOP_TIMEOUT)
+            if self._process.is_alive():
+                self._process.terminate()
+        self._responses.put(None)
+        self._reader.join()
+        self._process = None
+
+    def is_initialized(self) -> bool:
+        return self._initialized and self._process is not None and self._process.is_alive()
+
+    def preprocess_image(self, image: Image.Image, crop_mode: bool = True):
+        return self._local.preprocess_image(image, crop_mode)
+
+    def _read_responses(self):
+        """
+        子プロセスからの応答を受け取り、イベントループ側に渡す（専用スレッドで実行）
+
+        子プロセスが異常終了した場合は、待機中の生成をすべて失敗させる。
+        """
+        while True:
+            try:
+                message = self._responses.get(timeout=1.0)
+            except queue.Empty:
+                if self._process.is_alive():
+                    continue
+                message = ("exit", None, f"推論プロセスが終了しました (exitcode={self._process.exitcode})")
+            if message is None:
+                return
+            self._loop.call_soon_threadsafe(self._dispatch, message)
+            if message[0] == "exit":
+                return
+
+    def _dispatch(self, message: tuple):
+        kind, request_id, payload = message
+        if kind == "init":
+            if not self._ready.done():
+                self._ready.set_result(payload)
+        elif kind == "pong":
+            future = self._pings.pop(request_id, None)
+            if future is not None and not future.done():
+                future.set_result(payload)
+        elif kind == "exit":
+            self._initialized = False
+            if not self._ready.done():
+                self._ready.set_result(payload)
+            for stream in self._streams.values():
+                stream.put_nowait(("error", payload))
+            for future in self._pings.values():
+                if not future.done():
+                    future.set_result(False)
+            self._pings.clear()
+        else:
+            stream = self._streams.get(request_id)
+            if stream is not None:
+                stream.put_nowait((kind, payload))
+
+    async def generate(
+        self,
+        prompt: str,
+        image_features,
+        request_id: str,
+        max_tokens: int = MAX_TOKENS
+    ) -> AsyncIterator[dict]:
+        if not self.is_initialized():
+            raise RuntimeError(f"推論プロセスが停止しています (device={self.device})")
+        stream: asyncio.Queue = asyncio.Queue()
+        self._streams[request_id] = stream
+        try:
+            self._requests.put(("generate", request_id, (prompt, image_features, max_tokens)))
+            while True:
+                kind, payload = await stream.get()
+                if kind == "output":
+                    yield payload
+                elif kind == "done":
+                    return
+                else:
+                    raise RuntimeError(payload)
+        finally:
+            self._streams.pop(request_id, None)
+
+    async def abort(self, request_id: str):
+        if self.is_initialized():
+            self._requests.put(("abort", request_id, None))
+
+    async def check_health(self) -> bool:
+        if not self.is_initialized():
+            return False
+        self._ping_count += 1
+        ping_id = f"ping-{self._ping_count}"
+        future = self._loop.create_future()
+        self._pings[ping_id] = future
+        self._requests.put(("ping", ping_id, None))
+        try:
+            return await asyncio.wait_for(future, self.PING_TIMEOUT)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._pings.pop(ping_id, None)
+
+
+def create_backend(name: str = BACKEND, device: Optional[str] = None) -> InferenceBackend:
+    """
+    設定に応じた推論バックエンドを生成
+
+    Args:
+        name: バックエンド名（vllm または fake）
+        device: 使用するデバイス（指定時はCUDA_VISIBLE_DEVICESを固定した子プロセスで実行）
+
+    Returns:
+        InferenceBackend: 推論バックエンド
+    """
+    if device is not None:
+        return SubprocessBackend(name, device)
+    if name == 'vllm':
+        return VLLMBackend()
+    if name == 'fake':
+        return FakeBackend()
+    raise ValueError(f"不正なバックエンド種別です: {name} (vllm または fake)")
@@ -0,0 +1,564 @@
+"""
+ジョブキューモジュール
+OCRを非同期ジョブとして受け付け、優先度付きキューとワーカーで順次実行
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from fastapi import HTTPException
+
+from deepseek_ocr_engine import MAX_IN_FLIGHT, PAGE_CONCURRENCY
+
+# ジョブの永続化先（sqlite または memory）
+JOB_STORE = os.environ.get('OCR_JOB_STORE', 'sqlite')
+
+# SQLiteデータベースのパス
+JOB_DB_PATH = os.environ.get('OCR_JOB_DB_PATH', 'ocr_jobs.sqlite3')
+
+# 同時に実行するジョブ数（既定は、各ジョブがPDFの全ページを同時に推論しても推論枠の数を超えない数）
+JOB_WORKERS = int(os.environ.get('OCR_JOB_WORKERS', str(max(1, MAX_IN_FLIGHT // PAGE_CONCURRENCY))))
+
+# エンジンが混雑(429)していた場合にジョブを再投入するまでの待ち時間（秒）
+JOB_RETRY_DELAY = float(os.environ.get('OCR_JOB_RETRY_DELAY', '1.0'))
+
+# ジョブの状態
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_SUCCEEDED = 'succeeded'
+STATUS_FAILED = 'failed'
+
+
+class JobProgress:
+    """
+    実行中ジョブの進捗（生成トークン数、処理済みページ数、推論済みページの結果）
+
+    エンジンの混雑（429）でジョブを再投入する場合は同じ進捗を引き継ぎ、推論済みのページは再実行しない。
+    """
+
+    def __init__(self):
+        self.pages_total: Optional[int] = None
+        self.pages_done = 0
+        # リクエストID -> 生成トークン数
+        self._tokens: Dict[str, int] = {}
+        # ページ番号 -> 推論済みページの結果
+        self.finished_pages: Dict[int, tuple] = {}
+
+    def update_tokens(self, request_id: str, num_tokens: int):
+        """
+        リクエストごとの生成トークン数を更新
+        """
+        self._tokens[request_id] = num_tokens
+
+    def page_done(self):
+        """
+        処理済みページ数を1増やす
+        """
+        self.pages_done += 1
+
+    def finish_page(self, page_number: int, page: tuple):
+        """
+        推論済みページの結果を記録（再投入時に再利用）
+        """
+        self.finished_pages[page_number] = page
+
+    def complete(self, pages_total: int):
+        """
+        全ページを処理済みにする（結果キャッシュから返した場合）
+        """
+        self.pages_total = pages_total
+        self.pages_done = pages_total
+
+    @property
+    def tokens_generated(self) -> int:
+        return sum(self._tokens.values())
+
+    def to_dict(self) -> dict:
+        return {
+            "tokens_generated": self.tokens_generated,
+            "pages_done": self.pages_done,
+            "pages_total": self.pages_total
+        }
+
+
+class JobStore:
+    """
+    ジョブ永続化の基底クラス
+
+    ジョブの状態と結果、および未完了ジョブの入力ファイルを保存する。
+    実行中のジョブには実行しているプロセス（owner）のPIDを記録する。
+    """
+
+    def create(self, job: dict, file_content: bytes):
+        raise NotImplementedError
+
+    def update(self, job: dict):
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def load_file(self, job_id: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def delete_file(self, job_id: str):
+        raise NotImplementedError
+
+    def claim(self, job_id: str, owner: int) -> Optional[dict]:
+        """
+        キュー待ちのジョブを実行中にする（他のプロセスが先に取得した場合や完了済みの場合はNone）
+        """
+        raise NotImplementedError
+
+    def requeue_orphaned(self, is_alive: Callable[[int], bool]) -> int:
+        """
+        実行中のジョブのうち、実行していたプロセスが終了しているものをキュー待ちに戻し、件数を返す
+        """
+        raise NotImplementedError
+
+    def list_queued(self) -> List[dict]:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryJobStore(JobStore):
+    """
+    メモリ上にジョブを保持するストア（再起動で消える）
+    """
+
+    def __init__(self):
+        self._jobs: Dict[str, dict] = {}
+        self._files: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def create(self, job: dict, file_content: bytes):
+        self._jobs[job["job_id"]] = dict(job)
+        self._files[job["job_id"]] = file_content
+
+    def update(self, job: dict):
+        self._jobs[job["job_id"]] = dict(job)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        job = self._jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+    def load_file(self, job_id: str) -> Optional[bytes]:
+        return self._files.get(job_id)
+
+    def delete_file(self, job_id: str):
+        self._files.pop(job_id, None)
+
+    def claim(self, job_id: str, owner: int) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] != STATUS_QUEUED:
+                return None
+            job.update(status=STATUS_RUNNING, owner=owner, started_at=time.time())
+            return dict(job)
+
+    def requeue_orphaned(self, is_alive: Callable[[int], bool]) -> int:
+        with self._lock:
+            orphaned = [
+                job for job in self._jobs.values()
+                if job["status"] == STATUS_RUNNING and (job.get("owner") is None or not is_alive(job["owner"]))
+            ]
+            for job in orphaned:
+                job.update(status=STATUS_QUEUED, owner=None, started_at=None)
+        return len(orphaned)
+
+    def list_queued(self) -> List[dict]:
+        return sorted(
+            (dict(job) for job in self._jobs.values() if job["status"] == STATUS_QUEUED),
+            key=lambda job: job["created_at"]
+        )
+
+
+class SQLiteJobStore(JobStore):
+    """
+    SQLiteにジョブを保存するストア（再起動後も未完了ジョブを再開できる）
+    """
+
+    # JSONとして保存する列
+    _JSON_COLUMNS = ("params", "progress", "result")
+    _COLUMNS = (
+        "job_id", "status", "priority", "filename", "params", "created_at",
+        "started_at", "finished_at", "progress", "result", "error", "status_code", "owner"
+    )
+
+    def __init__(self, path: str = JOB_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    priority INTEGER NOT NULL,
+                    filename TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    progress TEXT,
+                    result TEXT,
+                    error TEXT,
+                    status_code INTEGER,
+                    owner INTEGER,
+                    file_content BLOB
+                )
+                """
+            )
+            # owner列がない以前のデータベースに列を追加
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            if "owner" not in columns:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN owner INTEGER")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+
+    def _to_row(self, job: dict) -> tuple:
+        return tuple(
+            json.dumps(job.get(column), ensure_ascii=False) if column in self._JSON_COLUMNS else job.get(column)
+            for column in self._COLUMNS
+        )
+
+    def _from_row(self, row: tuple) -> dict:
+        job = dict(zip(self._COLUMNS, row))
+        for column in self._JSON_COLUMNS:
+            job[column] = json.loads(job[column]) if job[column] is not None else None
+        return job
+
+    def create(self, job: dict, file_content: bytes):
+        placeholders = ", ".join("?" for _ in range(len(self._COLUMNS) + 1))
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT INTO jobs ({', '.join(self._COLUMNS)}, file_content) VALUES ({placeholders})",
+                self._to_row(job) + (sqlite3.Binary(file_content),)
+            )
+
+    def update(self, job: dict):
+        assignments = ", ".join(f"{column} = ?" for column in self._COLUMNS[1:])
+        row = self._to_row(job)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE job_id = ?",
+                row[1:] + (row[0],)
+            )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(self._COLUMNS)} FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return self._from_row(row) if row is not None else None
+
+    def load_file(self, job_id: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_content FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return bytes(row[0]) if row is not None and row[0] is not None else None
+
+    def delete_file(self, job_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET file_content = NULL WHERE job_id = ?", (job_id,))
+
+    def claim(self, job_id: str, owner: int) -> Optional[dict]:
+        # 状態の確認と更新を1つのUPDATEで行い、複数のプロセスが同じジョブを取得しないようにする
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, owner = ?, started_at = ? WHERE job_id = ? AND status = ?",
+                (STATUS_RUNNING, owner, time.time(), job_id, STATUS_QUEUED)
+            )
+        return self.get(job_id) if cursor.rowcount == 1 else None
+
+    def requeue_orphaned(self, is_alive: Callable[[int], bool]) -> int:
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT job_id, owner FROM jobs WHERE status = ?", (STATUS_RUNNING,)
+            ).fetchall()
+            orphaned = [(job_id,) for job_id, owner in rows if owner is None or not is_alive(owner)]
+            self._conn.executemany(
+                "UPDATE jobs SET status = ?, owner = NULL, started_at = NULL WHERE job_id = ? AND status = ?",
+                [(STATUS_QUEUED, job_id, STATUS_RUNNING) for job_id, in orphaned]
+            )
+        return len(orphaned)
+
+    def list_queued(self) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(self._COLUMNS)} FROM jobs WHERE status = ? ORDER BY created_at",
+                (STATUS_QUEUED,)
+            ).fetchall()
+        return [self._from_row(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_job_store(kind: str = JOB_STORE) -> JobStore:
+    """
+    設定に応じたジョブストアを生成
+
+    Args:
+        kind: ストアの種類（sqlite または memory）
+
+    Returns:
+        JobStore: ジョブストア
+    """
+    if kind == 'memory':
+        return MemoryJobStore()
+    if kind == 'sqlite':
+        return SQLiteJobStore()
+    raise ValueError(f"不正なジョブストア種別です: {kind} (sqlite または memory)")
+
+
+def _process_alive(pid: int) -> bool:
+    """
+    プロセスが動作しているか（このプロセス自身は、ジョブを実行する前に復旧するため終了済みとみなす）
+    """
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def recover_jobs(store: Optional[JobStore] = None) -> int:
+    """
+    前回終了時に実行中だったジョブ（実行していたプロセスが終了しているもの）をキュー待ちに戻す
+
+    複数のHTTPワーカーでSQLiteのジョブストアを共有する場合は、ワーカーを起動する前に親プロセスで1回だけ実行する。
+
+    Args:
+        store: ジョブストア（省略時は設定に応じたストアを開いて閉じる）
+
+    Returns:
+        int: キュー待ちに戻したジョブ数
+    """
+    if store is not None:
+        return store.requeue_orphaned(_process_alive)
+    store = create_job_store()
+    try:
+        return store.requeue_orphaned(_process_alive)
+    finally:
+        store.close()
+
+
+# ジョブを実行するハンドラ: (ジョブ, 入力ファイル, 進捗) -> 結果
+JobHandler = Callable[[dict, bytes, JobProgress], Awaitable[dict]]
+
+
+class JobQueue:
+    """
+    優先度付きジョブキュー
+
+    ジョブは優先度（小さいほど優先）、投入順に複数のワーカーで実行される。
+    """
+
+    def __init__(self, store: Optional[JobStore] = None, workers: int = JOB_WORKERS):
+        self.store = store
+        self.workers = workers
+        self._handler: Optional[JobHandler] = None
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._sequence = itertools.count()
+        self._worker_tasks: List[asyncio.Task] = []
+        # 再投入待ちのタスク（参照を保持してガベージコレクションを防ぐ）
+        self._requeue_tasks: Set[asyncio.Task] = set()
+        # 実行中ジョブID -> 進捗
+        self._running: Dict[str, JobProgress] = {}
+        # 再投入待ちジョブID -> 前回の実行の進捗（推論済みのページを引き継ぐ）
+        self._retrying: Dict[str, JobProgress] = {}
+
+    async def start(self, handler: JobHandler, recover: bool = True):
+        """
+        ワーカーを起動し、キュー待ちのジョブ（前回終了時に未完了だったものを含む）を投入
+
+        ジョブはストアで取得（claim）してから実行するため、複数のプロセスが同じキュー待ちのジョブを
+        投入しても実行されるのは1回のみ。
+
+        Args:
+            handler: ジョブを実行するハンドラ
+            recover: 実行中のまま残ったジョブをキュー待ちに戻すか
+                （複数のHTTPワーカーの場合は親プロセスで recover_jobs を実行済みのためFalse）
+        """
+        if self._worker_tasks:
+            return
+        if self.store is None:
+            self.store = await asyncio.to_thread(create_job_store)
+        self._handler = handler
+        self._queue = asyncio.PriorityQueue()
+
+        if recover:
+            recovered = await asyncio.to_thread(recover_jobs, self.store)
+            if recovered:
+                print(f"実行中だったジョブをキュー待ちに戻しました: {recovered}件")
+        queued = await asyncio.to_thread(self.store.list_queued)
+        for job in queued:
+            self._enqueue(job)
+        if queued:
+            print(f"未完了のジョブを再投入しました: {len(queued)}件")
+
+        self._worker_tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self.workers)
+        ]
+        print(f"ジョブキューを起動しました: ワーカー数={self.workers}")
+
+    async def stop(self):
+        """
+        ワーカーを停止（実行中のジョブは次回起動時に再実行される）
+        """
+        tasks = self._worker_tasks + list(self._requeue_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._retrying.clear()
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+        print("ジョブキューを停止しました")
+
+    def is_running(self) -> bool:
+        return bool(self._worker_tasks)
+
+    async def submit(self, file_content: bytes, filename: str, params: dict, priority: int = 0) -> dict:
+        """
+        ジョブを投入
+
+        Args:
+            file_content: 入力ファイルのバイナリコンテンツ
+            filename: ファイル名
+            params: ハンドラに渡すOCR設定
+            priority: 優先度（小さいほど優先）
+
+        Returns:
+            dict: 投入したジョブ
+        """
+        if not self.is_running():
+            raise HTTPException(
+                status_code=503,
+                detail="ジョブキューが起動していません"
+            )
+
+        job = {
+            "job_id": f"job-{uuid.uuid4().hex}",
+            "status": STATUS_QUEUED,
+            "priority": priority,
+            "filename": filename,
+            "params": params,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "progress": None,
+            "result": None,
+            "error": None,
+            "status_code": None,
+            "owner": None
+        }
+        await asyncio.to_thread(self.store.create, job, file_content)
+        self._enqueue(job)
+        return job
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        """
+        ジョブを取得（実行中の場合は最新の進捗を含む）
+
+        Args:
+            job_id: ジョブID
+
+        Returns:
+            Optional[dict]: ジョブ（存在しない場合はNone）
+        """
+        if self.store is None:
+            return None
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is not None and job_id in self._running:
+            job["progress"] = self._running[job_id].to_dict()
+        return job
+
+    def stats(self) -> dict:
+        """
+        キュー内と実行中のジョブ数を返す
+        """
+        return {
+            "queued_jobs": self._queue.qsize() if self._queue is not None else 0,
+            "running_jobs": len(self._running)
+        }
+
+    def _enqueue(self, job: dict):
+        self._queue.put_nowait((job["priority"], next(self._sequence), job["job_id"]))
+
+    async def _requeue_later(self, job: dict):
+        await asyncio.sleep(JOB_RETRY_DELAY)
+        self._enqueue(job)
+
+    async def _worker(self):
+        while True:
+            _, _, job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"ジョブの実行中に予期しないエラーが発生しました: {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        # 他のワーカーが実行中・完了済みのジョブは取得できない
+        job = await asyncio.to_thread(self.store.claim, job_id, os.getpid())
+        if job is None:
+            return
+
+        file_content = await asyncio.to_thread(self.store.load_file, job_id)
+        if file_content is None:
+            job.update(status=STATUS_FAILED, finished_at=time.time(),
+                       error="ジョブの入力ファイルが見つかりません", status_code=500)
+            await asyncio.to_thread(self.store.update, job)
+            return
+
+        progress = self._retrying.pop(job_id, None) or JobProgress()
+        self._running[job_id] = progress
+
+        try:
+            result = await self._handler(job, file_content, progress)
+        except HTTPException as e:
+            if e.status_code == 429:
+                # エンジンが混雑している場合は失敗にせず、推論済みのページを引き継いで再投入
+                self._retrying[job_id] = progress
+                job.update(status=STATUS_QUEUED, started_at=None, owner=None)
+                await asyncio.to_thread(self.store.update, job)
+                task = asyncio.create_task(self._requeue_later(job))
+                self._requeue_tasks.add(task)
+                task.add_done_callback(self._requeue_tasks.discard)
+                return
+            job.update(status=STATUS_FAILED, error=e.detail, status_code=e.status_code)
+        except Exception as e:
+            job.update(status=STATUS_FAILED, error=f"OCR処理中にエラーが発生しました: {str(e)}", status_code=500)
+        else:
+            job.update(status=STATUS_SUCCEEDED, result=result)
+        finally:
+            self._running.pop(job_id, None)
+
+        job.update(finished_at=time.time(), progress=progress.to_dict())
+        await asyncio.to_thread(self.store.update, job)
+        await asyncio.to_thread(self.store.delete_file, job_id)
+
+
+# グローバルジョブキューインスタンス
+job_queue = JobQueue()
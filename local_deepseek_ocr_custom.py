@@ -1,203 +1,477 @@
-import asyncio
-import re
-import os
-
-import torch
-if torch.version.cuda == '11.8':
-    os.environ["TRITON_PTXAS_PATH"] = "/usr/local/cuda-11.8/bin/ptxas"
-
-os.environ['VLLM_USE_V1'] = '0'
-os.environ["CUDA_VISIBLE_DEVICES"] = '0'
-
-from vllm import AsyncLLMEngine, SamplingParams
-from vllm.engine.arg_utils import AsyncEngineArgs
-from vllm.model_executor.models.registry import ModelRegistry
-import time
-from deepseek_ocr import DeepseekOCRForCausalLM
-from PIL import Image, ImageDraw, ImageFont, ImageOps
-import numpy as np
-from tqdm import tqdm
-from process.ngram_norepeat import NoRepeatNGramLogitsProcessor
-from process.image_process import DeepseekOCRProcessor
-
-ModelRegistry.register_model("DeepseekOCRForCausalLM", DeepseekOCRForCausalLM)
-
-# PDF処理のインポート（オプション）
-try:
-    from pdf2image import convert_from_path
-    PDF_SUPPORT = True
-    print("PDF処理サポートが有効です。")
-except ImportError:
-    PDF_SUPPORT = False
-    print("警告: pdf2imageが見つかりません。PDFファイルは処理できません。")
-MODEL_PATH = 'deepseek-ai/DeepSeek-OCR' # change to your model path
-# INPUT_PATH = '/testdata/inputs/test.tiff'
-INPUT_PATH = '/testdata/inputs/IMG_8296.jpg'
-OUTPUT_PATH = '/testdata/outputs/'
-CROP_MODE = True
-# PROMPT = '<image>\n<|grounding|>Convert the document to markdown.'
-PROMPT = '<image>\n<Free OCR.'
-SUPPORTED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tiff', '.pdf') # 対応する画像ファイルの拡張子（大文字小文字両対応）
-
-def load_image(image_path):
-    
-    # ファイルの存在確認を追加
-    if not os.path.exists(image_path):
-        print(f"エラー: ファイルが見つかりません: {image_path}")
-        return None
-    
-    filename = os.path.basename(image_path)
-    
-    # 対応する拡張子かチェック
-    if not filename.lower().endswith(SUPPORTED_EXTENSIONS):
-        print(f"エラー: サポートされていないファイル形式: {filename}")
-        return None
-    
-    try:
-        # PDFファイルの処理
-        if filename.lower().endswith('.pdf'):
-            if PDF_SUPPORT:
-                print(f"PDFファイルを画像に変換中: {filename}")
-                try:
-                    # PDFの最初のページを画像として変換（300 DPIで高品質変換）
-                    images = convert_from_path(
-                        image_path, 
-                        first_page=1, 
-                        last_page=1,
-                        dpi=300,  # 高品質変換
-                        fmt='RGB'  # RGB形式で出力
-                    )
-                    if images:
-                        img = images[0]  # 最初のページを使用
-                        print(f"  PDF変換完了: サイズ={img.size}, モード={img.mode}, DPI=300")
-                        return img
-                    else:
-                        raise Exception("PDFファイルの変換結果が空です")
-                except Exception as pdf_error:
-                    print(f"  PDF変換エラー: {pdf_error}")
-                    return None
-            else:
-                print(f"エラー: PDFサポートが無効です。pdf2imageをインストールしてください。")
-                print("  インストール方法: pip install pdf2image")
-                return None
-        
-        # 通常の画像ファイルの処理
-        else:
-            print(f"画像ファイルを読み込み中: {filename}")
-            img = Image.open(image_path)
-            
-            # RGB形式に変換（OCR処理の標準化）
-            if img.mode != 'RGB':
-                print(f"  画像モードを{img.mode}からRGBに変換中...")
-                img = img.convert('RGB')
-            
-            print(f"  画像読み込み完了: サイズ={img.size}, モード={img.mode}")
-            return img
-            
-    except Exception as e:
-        print(f"エラー: 画像の読み込みに失敗しました: {filename}")
-        print(f"  詳細: {str(e)}")
-        return None
-
-
-
-async def stream_generate(image=None, prompt=''):
-
-    engine_args = AsyncEngineArgs(
-        model=MODEL_PATH,
-        hf_overrides={"architectures": ["DeepseekOCRForCausalLM"]},
-        block_size=256,
-        max_model_len=8192,
-        enforce_eager=False,
-        trust_remote_code=True,  
-        tensor_parallel_size=1,
-        gpu_memory_utilization=0.75,
-    )
-    engine = AsyncLLMEngine.from_engine_args(engine_args)
-    
-    logits_processors = [NoRepeatNGramLogitsProcessor(ngram_size=30, window_size=90, whitelist_token_ids= {128821, 128822})] #whitelist: <td>, </td> 
-
-    sampling_params = SamplingParams(
-        temperature=0.0,
-        max_tokens=8192,
-        logits_processors=logits_processors,
-        skip_special_tokens=False,
-        # ignore_eos=False,
-        
-    )
-    
-    request_id = f"request-{int(time.time())}"
-
-    printed_length = 0  
-
-    if image and '<image>' in prompt:
-        request = {
-            "prompt": prompt,
-            "multi_modal_data": {"image": image}
-        }
-    elif prompt:
-        request = {
-            "prompt": prompt
-        }
-    else:
-        assert False, f'prompt is none!!!'
-    async for request_output in engine.generate(
-        request, sampling_params, request_id
-    ):
-        # print(request_output)
-        if request_output.outputs:
-            full_text = request_output.outputs[0].text
-            # print(full_text)
-            new_text = full_text[printed_length:]
-            # print(new_text, end='', flush=True)
-            # print('test')
-            printed_length = len(full_text)
-            final_output = full_text
-    # print('\n') 
-
-    return final_output
-
-
-def extract_deepseek_text(ocr_output: str) -> str:
-    lines = ocr_output.splitlines()
-    results = []
-
-    for i, line in enumerate(lines):
-        line = line.strip()
-
-        # `<|ref|>text` がある行なら、次の行がテキスト
-        if "<|ref|>text<|/ref|>" in line:
-            # 次行が存在し、タグなしの純テキストなら追加
-            if i + 1 < len(lines):
-                next_line = lines[i + 1].strip()
-                
-                # 空行やタグ行は除外
-                if next_line and not next_line.startswith("<|"):
-                    results.append(next_line)
-
-    return "\n".join(results)
-
-if __name__ == "__main__":
-
-    os.makedirs(OUTPUT_PATH, exist_ok=True)
-    os.makedirs(f'{OUTPUT_PATH}/images', exist_ok=True)
-
-    image = load_image(INPUT_PATH).convert('RGB')
-
-    
-    if '<image>' in PROMPT:
-
-        image_features = DeepseekOCRProcessor().tokenize_with_images(images = [image], bos=True, eos=True, cropping=CROP_MODE)
-    else:
-        image_features = ''
-
-    prompt = PROMPT
-
-    result_out = asyncio.run(stream_generate(image_features, prompt))
-    
-    extracted_text = extract_deepseek_text(result_out)
-    print("\n【抽出されたテキスト】\n")
-    print("\n-------------------\n")
-    print(extracted_text)
-    print("\n-------------------\n")
-    
+import argparse
+import asyncio
+import glob
+import json
+import re
+import os
+import sys
+
+# DeepSeek-OCRのモジュールパスを追加（API用モジュールと同じディレクトリから実行する場合）
+DEEPSEEK_OCR_VLLM_PATH = '/DeepSeek-OCR/DeepSeek-OCR-master/DeepSeek-OCR-vllm'
+if os.path.isdir(DEEPSEEK_OCR_VLLM_PATH) and DEEPSEEK_OCR_VLLM_PATH not in sys.path:
+    sys.path.insert(0, DEEPSEEK_OCR_VLLM_PATH)
+
+import torch
+if torch.version.cuda == '11.8':
+    os.environ["TRITON_PTXAS_PATH"] = "/usr/local/cuda-11.8/bin/ptxas"
+
+os.environ['VLLM_USE_V1'] = '0'
+os.environ["CUDA_VISIBLE_DEVICES"] = '0'
+
+from vllm import AsyncLLMEngine, SamplingParams
+from vllm.engine.arg_utils import AsyncEngineArgs
+from vllm.model_executor.models.registry import ModelRegistry
+import time
+from deepseek_ocr import DeepseekOCRForCausalLM
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+import numpy as np
+from tqdm import tqdm
+from process.ngram_norepeat import NoRepeatNGramLogitsProcessor
+from process.image_process import DeepseekOCRProcessor
+
+ModelRegistry.register_model("DeepseekOCRForCausalLM", DeepseekOCRForCausalLM)
+
+# PDF処理のインポート（オプション）
+try:
+    from pdf2image import convert_from_path
+    PDF_SUPPORT = True
+    print("PDF処理サポートが有効です。")
+except ImportError:
+    PDF_SUPPORT = False
+    print("警告: pdf2imageが見つかりません。PDFファイルは処理できません。")
+MODEL_PATH = 'deepseek-ai/DeepSeek-OCR' # change to your model path
+# INPUT_PATH = '/testdata/inputs/test.tiff'
+INPUT_PATH = '/testdata/inputs/IMG_8296.jpg'
+OUTPUT_PATH = '/testdata/outputs/'
+CROP_MODE = True
+# PROMPT = '<image>\n<|grounding|>Convert the document to markdown.'
+PROMPT = '<image>\n<Free OCR.'
+SUPPORTED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tiff', '.pdf') # 対応する画像ファイルの拡張子（大文字小文字両対応）
+
+def load_image(image_path):
+    
+    # ファイルの存在確認を追加
+    if not os.path.exists(image_path):
+        print(f"エラー: ファイルが見つかりません: {image_path}")
+        return None
+    
+    filename = os.path.basename(image_path)
+    
+    # 対応する拡張子かチェック
+    if not filename.lower().endswith(SUPPORTED_EXTENSIONS):
+        print(f"エラー: サポートされていないファイル形式: {filename}")
+        return None
+    
+    try:
+        # PDFファイルの処理
+        if filename.lower().endswith('.pdf'):
+            if PDF_SUPPORT:
+                print(f"PDFファイルを画像に変換中: {filename}")
+                try:
+                    # PDFの最初のページを画像として変換（300 DPIで高品質変換）
+                    images = convert_from_path(
+                        image_path, 
+                        first_page=1, 
+                        last_page=1,
+                        dpi=300,  # 高品質変換
+                        fmt='RGB'  # RGB形式で出力
+                    )
+                    if images:
+                        img = images[0]  # 最初のページを使用
+                        print(f"  PDF変換完了: サイズ={img.size}, モード={img.mode}, DPI=300")
+                        return img
+                    else:
+                        raise Exception("PDFファイルの変換結果が空です")
+                except Exception as pdf_error:
+                    print(f"  PDF変換エラー: {pdf_error}")
+                    return None
+            else:
+                print(f"エラー: PDFサポートが無効です。pdf2imageをインストールしてください。")
+                print("  インストール方法: pip install pdf2image")
+                return None
+        
+        # 通常の画像ファイルの処理
+        else:
+            print(f"画像ファイルを読み込み中: {filename}")
+            img = Image.open(image_path)
+            
+            # RGB形式に変換（OCR処理の標準化）
+            if img.mode != 'RGB':
+                print(f"  画像モードを{img.mode}からRGBに変換中...")
+                img = img.convert('RGB')
+            
+            print(f"  画像読み込み完了: サイズ={img.size}, モード={img.mode}")
+            return img
+            
+    except Exception as e:
+        print(f"エラー: 画像の読み込みに失敗しました: {filename}")
+        print(f"  詳細: {str(e)}")
+        return None
+
+
+
+async def stream_generate(image=None, prompt=''):
+
+    engine_args = AsyncEngineArgs(
+        model=MODEL_PATH,
+        hf_overrides={"architectures": ["DeepseekOCRForCausalLM"]},
+        block_size=256,
+        max_model_len=8192,
+        enforce_eager=False,
+        trust_remote_code=True,  
+        tensor_parallel_size=1,
+        gpu_memory_utilization=0.75,
+    )
+    engine = AsyncLLMEngine.from_engine_args(engine_args)
+    
+    logits_processors = [NoRepeatNGramLogitsProcessor(ngram_size=30, window_size=90, whitelist_token_ids= {128821, 128822})] #whitelist: <td>, </td> 
+
+    sampling_params = SamplingParams(
+        temperature=0.0,
+        max_tokens=8192,
+        logits_processors=logits_processors,
+        skip_special_tokens=False,
+        # ignore_eos=False,
+        
+    )
+    
+    request_id = f"request-{int(time.time())}"
+
+    printed_length = 0  
+
+    if image and '<image>' in prompt:
+        request = {
+            "prompt": prompt,
+            "multi_modal_data": {"image": image}
+        }
+    elif prompt:
+        request = {
+            "prompt": prompt
+        }
+    else:
+        assert False, f'prompt is none!!!'
+    async for request_output in engine.generate(
+        request, sampling_params, request_id
+    ):
+        # print(request_output)
+        if request_output.outputs:
+            full_text = request_output.outputs[0].text
+            # print(full_text)
+            new_text = full_text[printed_length:]
+            # print(new_text, end='', flush=True)
+            # print('test')
+            printed_length = len(full_text)
+            final_output = full_text
+    # print('\n') 
+
+    return final_output
+
+
+def iter_batch_inputs(sources, prompt=PROMPT, crop_mode=CROP_MODE):
+    """
+    バッチモードの入力（ファイル、ディレクトリ、globパターン、JSONLマニフェスト）を順に返す
+
+    JSONLマニフェストは1行に1件、{"path": ..., "id": ..., "prompt": ..., "crop_mode": ...}
+    の形式（pathのみ必須、相対パスはマニフェストのディレクトリ基準）。
+    同じIDの入力は最初の1件のみ返す。
+    """
+    from fastapi import HTTPException
+    from page_screen import CROP_MODE_AUTO, parse_crop_mode
+
+    seen = set()
+
+    def parse_entry_crop_mode(value):
+        """
+        マニフェストのcrop_mode（真偽値、またはAPIと同じ true / false の文字列）を変換
+        """
+        if isinstance(value, bool):
+            return value
+        try:
+            parsed = parse_crop_mode(str(value))
+        except HTTPException as e:
+            raise ValueError(e.detail) from None
+        if parsed == CROP_MODE_AUTO:
+            raise ValueError("バッチモードではクロップモードの自動選択（auto）は使用できません")
+        return parsed
+
+    def make_item(path, entry=None):
+        entry = entry or {}
+        return {
+            "id": str(entry.get("id", path)),
+            "path": path,
+            "prompt": entry.get("prompt", prompt),
+            "crop_mode": parse_entry_crop_mode(entry.get("crop_mode", crop_mode))
+        }
+
+    for source in sources:
+        if source.lower().endswith('.jsonl'):
+            base_dir = os.path.dirname(os.path.abspath(source))
+            with open(source, 'r', encoding='utf-8') as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+            items = [
+                make_item(os.path.join(base_dir, entry.get("path") or entry["file"]), entry)
+                for entry in entries
+            ]
+        elif os.path.isdir(source):
+            items = [
+                make_item(os.path.join(root, name))
+                for root, _, names in sorted(os.walk(source))
+                for name in sorted(names)
+                if name.lower().endswith(SUPPORTED_EXTENSIONS)
+            ]
+        else:
+            paths = sorted(glob.glob(source, recursive=True)) or [source]
+            items = [make_item(path) for path in paths]
+
+        for item in items:
+            if item["id"] not in seen:
+                seen.add(item["id"])
+                yield item
+
+
+def load_completed_ids(output_path):
+    """
+    出力済みのJSONLから、成功した入力のIDを読み込む（再開時にスキップする）
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 中断時に書きかけになった行
+                continue
+            if record.get("success"):
+                completed.add(record["id"])
+    return completed
+
+
+async def run_batch(args):
+    """
+    バッチモード: エンジンを1回だけ初期化し、読み込み・前処理と推論を並行して実行する
+
+    読み込み・前処理はワーカープールで実行し、推論は最大 --concurrency 件を同時に実行する。
+    結果は1件ごとにJSONL（と任意でMarkdown）へ追記するため、中断後は同じコマンドで再開できる。
+    """
+    # API用のモジュールを利用（エンジン・画像読み込み・ワーカープール）
+    from fastapi import HTTPException
+    from deepseek_ocr_engine import DeepSeekOCREngine
+    from image_loader import load_image_from_file, iter_pdf_pages, is_pdf
+    from worker_pool import WorkerPool
+    from grounding import parse_grounding
+
+    output_dir = os.path.dirname(os.path.abspath(args.output))
+    os.makedirs(output_dir, exist_ok=True)
+    if args.markdown_dir:
+        os.makedirs(args.markdown_dir, exist_ok=True)
+
+    completed = load_completed_ids(args.output) if args.resume else set()
+    if completed:
+        print(f"出力済みの{len(completed)}件をスキップします: {args.output}")
+
+    # パイプライン内の件数は推論枠＋先読み分に制限する（エンジンの待ち行列が溢れないように）
+    pipeline_size = args.concurrency + args.workers
+    engine = DeepSeekOCREngine(max_in_flight=args.concurrency, max_queued=pipeline_size)
+    pool = WorkerPool('thread', args.workers)
+    pool.start()
+    await engine.initialize()
+
+    slots = asyncio.Semaphore(pipeline_size)
+    write_lock = asyncio.Lock()
+    counts = {"succeeded": 0, "failed": 0, "skipped": 0}
+    started = time.perf_counter()
+
+    async def ocr_image(image, item, timings):
+        """
+        1画像をOCRし、モデルの生出力と元の画像サイズを返す
+        """
+        image_size = image.info.get('original_size', image.size)
+        image_features = None
+        if '<image>' in item["prompt"]:
+            image_features = await pool.run(
+                "preprocess", engine.preprocess_image, image, item["crop_mode"], timings=timings
+            )
+        generate_started = time.perf_counter()
+        raw_output = await engine.generate(image_features=image_features, prompt=item["prompt"])
+        timings["generate_ms"] = round((time.perf_counter() - generate_started) * 1000, 2)
+        return raw_output, image_size
+
+    async def process(item, release_slot):
+        filename = os.path.basename(item["path"])
+        load_crop_mode = item["crop_mode"] if '<image>' in item["prompt"] else None
+        item_started = time.perf_counter()
+        try:
+            with open(item["path"], 'rb') as f:
+                file_content = f.read()
+
+            if args.all_pages and is_pdf(filename):
+                # 入力の推論枠を返し、ページごとに推論枠を確保する
+                # （エンジンの待ち行列と読み込み済みのページ画像をページ数に関係なく推論枠＋先読み分までに制限する）
+                release_slot()
+                pages = iter_pdf_pages(file_content, filename, crop_mode=load_crop_mode)
+                tasks = []
+                try:
+                    while True:
+                        await slots.acquire()
+                        page = None
+                        try:
+                            page = await asyncio.to_thread(next, pages, None)
+                        finally:
+                            if page is None:
+                                slots.release()
+                        if page is None:
+                            break
+                        task = asyncio.create_task(ocr_image(page[1], item, {}))
+                        task.add_done_callback(lambda _: slots.release())
+                        tasks.append(task)
+                    outputs = await asyncio.gather(*tasks)
+                except BaseException:
+                    for task in tasks:
+                        task.cancel()
+                    raise
+                finally:
+                    pages.close()
+                raw_output = "\n\n".join(page_output for page_output, _ in outputs)
+                regions = [
+                    {**region, "page": page_number}
+                    for page_number, (page_output, image_size) in enumerate(outputs, start=1)
+                    for region in parse_grounding(page_output, image_size)
+                ] if args.regions else None
+                timings = {}
+            else:
+                timings = {}
+                image = await pool.run(
+                    "decode", load_image_from_file, file_content, filename, load_crop_mode,
+                    timings=timings
+                )
+                raw_output, image_size = await ocr_image(image, item, timings)
+                regions = parse_grounding(raw_output, image_size) if args.regions else None
+
+            record = {
+                "id": item["id"],
+                "path": item["path"],
+                "success": True,
+                "extracted_text": engine.extract_text(raw_output),
+                "raw_output": raw_output,
+                "prompt": item["prompt"],
+                "crop_mode": item["crop_mode"],
+                "timings": timings
+            }
+            if regions is not None:
+                record["regions"] = regions
+        except Exception as e:
+            record = {
+                "id": item["id"],
+                "path": item["path"],
+                "success": False,
+                "error": e.detail if isinstance(e, HTTPException) else str(e)
+            }
+        record["elapsed_ms"] = round((time.perf_counter() - item_started) * 1000, 2)
+
+        async with write_lock:
+            with open(args.output, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if record["success"] and args.markdown_dir:
+                name = re.sub(r'[^\w.-]+', '_', item["id"]).strip('_')
+                with open(os.path.join(args.markdown_dir, f"{name}.md"), 'w', encoding='utf-8') as f:
+                    f.write(record["raw_output"])
+
+            counts["succeeded" if record["success"] else "failed"] += 1
+            status = "完了" if record["success"] else f"失敗: {record['error']}"
+            print(f"[{counts['succeeded'] + counts['failed']}] {item['id']} ({record['elapsed_ms']:.0f}ms) {status}")
+
+    async def run_item(item):
+        released = False
+
+        def release_slot():
+            nonlocal released
+            if not released:
+                released = True
+                slots.release()
+
+        try:
+            await process(item, release_slot)
+        finally:
+            release_slot()
+
+    tasks = set()
+    try:
+        for item in iter_batch_inputs(args.inputs, args.prompt, args.crop_mode):
+            if item["id"] in completed:
+                counts["skipped"] += 1
+                continue
+            await slots.acquire()
+            task = asyncio.create_task(run_item(item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        engine.shutdown()
+        pool.shutdown()
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"\nバッチ処理完了: 成功={counts['succeeded']}, 失敗={counts['failed']}, "
+        f"スキップ={counts['skipped']}, 経過時間={elapsed:.1f}秒, 出力={args.output}"
+    )
+    return 0 if counts["failed"] == 0 else 1
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="DeepSeek OCR（入力を指定しない場合は INPUT_PATH の1ファイルを処理）"
+    )
+    parser.add_argument('inputs', nargs='*',
+                        help="バッチモードの入力（ファイル、ディレクトリ、globパターン、JSONLマニフェスト）")
+    parser.add_argument('--output', default=os.path.join(OUTPUT_PATH, 'results.jsonl'),
+                        help="結果を追記するJSONLファイル")
+    parser.add_argument('--markdown-dir', help="入力ごとのモデル出力（Markdown）を書き出すディレクトリ")
+    parser.add_argument('--prompt', default=PROMPT, help="プロンプト（マニフェストの指定が優先）")
+    parser.add_argument('--crop-mode', action=argparse.BooleanOptionalAction, default=CROP_MODE,
+                        help="クロップモード（マニフェストの指定が優先）")
+    parser.add_argument('--all-pages', action='store_true', help="PDFの全ページを処理（既定は1ページ目のみ）")
+    parser.add_argument('--regions', action='store_true',
+                        help="グラウンディングの領域（種類・テキスト・ピクセル座標）を結果に追加")
+    parser.add_argument('--concurrency', type=int, default=60, help="同時に推論する件数")
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1),
+                        help="読み込み・前処理のワーカー数")
+    parser.add_argument('--resume', action=argparse.BooleanOptionalAction, default=True,
+                        help="出力済みの入力をスキップする")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    if args.inputs:
+        # バッチモード
+        raise SystemExit(asyncio.run(run_batch(args)))
+
+    os.makedirs(OUTPUT_PATH, exist_ok=True)
+    os.makedirs(f'{OUTPUT_PATH}/images', exist_ok=True)
+
+    image = load_image(INPUT_PATH).convert('RGB')
+
+    
+    if '<image>' in PROMPT:
+
+        image_features = DeepseekOCRProcessor().tokenize_with_images(images = [image], bos=True, eos=True, cropping=CROP_MODE)
+    else:
+        image_features = ''
+
+    prompt = PROMPT
+
+    result_out = asyncio.run(stream_generate(image_features, prompt))
+
+    # API用モジュールと同じ規則でテキストを抽出
+    from deepseek_ocr_engine import DeepSeekOCREngine
+    extracted_text = DeepSeekOCREngine.extract_text(result_out)
+    print("\n【抽出されたテキスト】\n")
+    print("\n-------------------\n")
+    print(extracted_text)
+    print("\n-------------------\n")
+    
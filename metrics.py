@@ -0,0 +1,348 @@
+"""
+メトリクスモジュール
+Prometheusのテキスト形式で公開するカウンタ・ゲージ・ヒストグラムを定義
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# 処理時間ヒストグラムのバケット（秒）
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """
+    メトリクスの基底クラス（ラベル値の組ごとに値を保持）
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: ラベルが一致しません: {sorted(labels)} != {sorted(self.labelnames)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}"
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """
+    単調増加するカウンタ
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Gauge(Metric):
+    """
+    任意に増減する値（関数を登録した場合は出力時に値を取得）
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float]):
+        """
+        出力時に値を取得する関数を登録（ラベルなしのゲージのみ）
+        """
+        self._function = function
+
+    def samples(self) -> List[str]:
+        if self._function is not None:
+            return [f"{self.name} {_format_value(self._function())}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Histogram(Metric):
+    """
+    値の分布を累積バケットで集計するヒストグラム
+    """
+
+    kind = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # ラベル値 -> (バケットごとの件数, 合計, 件数)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """
+        withブロックの処理時間（秒）を記録
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    メトリクスの登録とテキスト形式での出力
+    """
+
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Prometheusのテキスト形式（version 0.0.4）で出力
+
+        Returns:
+            str: 全メトリクスのテキスト
+        """
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+# グローバルレジストリ
+REGISTRY = MetricsRegistry()
+
+# 処理ステージごとの所要時間
+# stage: upload_read, decode, preprocess, queue_wait, first_token, generate, extract_text
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "ocr_stage_duration_seconds",
+    "OCR処理ステージごとの所要時間（秒）",
+    ["stage"]
+))
+
+# ワーカープールの空き待ち時間
+WORKER_POOL_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "ocr_worker_pool_wait_seconds",
+    "ワーカープールの空き待ち時間（秒）",
+    ["stage"]
+))
+
+# 生成トークン数
+GENERATED_TOKENS = REGISTRY.register(Counter(
+    "ocr_generated_tokens_total",
+    "OCRモデルが生成したトークン数"
+))
+
+# クロップモードで生成された画像タイル数
+IMAGE_TILES = REGISTRY.register(Counter(
+    "ocr_image_tiles_total",
+    "クロップモードの前処理で生成された画像タイル数"
+))
+
+# 白紙と判定して生成を省略したページ数（ROIモードでは領域数）
+BLANK_PAGES_SKIPPED = REGISTRY.register(Counter(
+    "ocr_blank_pages_skipped_total",
+    "白紙と判定して生成を省略したページ数"
+))
+
+# 優先度クラスごとのエンジン内の所要時間（推論枠の待機から生成完了まで）と推論枠の待機時間
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "ocr_request_duration_seconds",
+    "優先度クラスごとの推論枠の待機から生成完了までの時間（秒）",
+    ["priority"]
+))
+PRIORITY_QUEUE_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "ocr_priority_queue_wait_seconds",
+    "優先度クラスごとの推論枠の待機時間（秒）",
+    ["priority"]
+))
+
+# 期限切れで中断したリクエスト数（stage: queue（待機中）, generate（生成中））
+DEADLINE_EXCEEDED = REGISTRY.register(Counter(
+    "ocr_deadline_exceeded_total",
+    "期限を過ぎて中断したリクエスト数",
+    ["priority", "stage"]
+))
+
+# 生成を打ち切ったリクエスト数と、劣化した生成を中断するまでに生成されたトークン数
+# reason: repetition, low_entropy, stalled, max_tokens（max_tokensは上限到達のため中断しない）
+TRUNCATED_REQUESTS = REGISTRY.register(Counter(
+    "ocr_truncated_requests_total",
+    "生成を打ち切ったリクエスト数",
+    ["reason"]
+))
+ABORTED_TOKENS = REGISTRY.register(Counter(
+    "ocr_aborted_tokens_total",
+    "劣化した生成を中断するまでに生成されたトークン数",
+    ["reason"]
+))
+
+# エラー数（type: http_<ステータスコード> または例外クラス名）
+ERRORS = REGISTRY.register(Counter(
+    "ocr_errors_total",
+    "種類別のエラー数",
+    ["type"]
+))
+
+# 推論中・推論枠待ちのリクエスト数
+IN_FLIGHT_REQUESTS = REGISTRY.register(Gauge(
+    "ocr_in_flight_requests",
+    "エンジンで推論中のリクエスト数"
+))
+QUEUED_REQUESTS = REGISTRY.register(Gauge(
+    "ocr_queued_requests",
+    "推論枠の空き待ちをしているリクエスト数"
+))
+
+# ローテーション中のエンジンレプリカ数
+HEALTHY_REPLICAS = REGISTRY.register(Gauge(
+    "ocr_healthy_replicas",
+    "ローテーション中（推論可能）のエンジンレプリカ数"
+))
+
+# 起動フェーズごとの所要時間
+# phase: import, engine_init, warmup, total（プロセス起動から準備完了まで）
+STARTUP_SECONDS = REGISTRY.register(Gauge(
+    "ocr_startup_seconds",
+    "起動フェーズごとの所要時間（秒）",
+    ["phase"]
+))
+
+# ジョブキュー内・実行中のジョブ数
+QUEUED_JOBS = REGISTRY.register(Gauge(
+    "ocr_queued_jobs",
+    "ジョブキューで待機中のジョブ数"
+))
+RUNNING_JOBS = REGISTRY.register(Gauge(
+    "ocr_running_jobs",
+    "実行中のジョブ数"
+))
+
+# 画像特徴量キャッシュの参照数（result: hit, miss）と使用サイズ
+FEATURE_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "ocr_feature_cache_lookups_total",
+    "画像特徴量キャッシュの参照数",
+    ["result"]
+))
+FEATURE_CACHE_BYTES = REGISTRY.register(Gauge(
+    "ocr_feature_cache_bytes",
+    "画像特徴量キャッシュの使用サイズの概算（バイト）"
+))
+
+# デコード・前処理用に予約されたメモリ
+MEMORY_RESERVED_BYTES = REGISTRY.register(Gauge(
+    "ocr_memory_reserved_bytes",
+    "デコード・前処理用に予約されたメモリの概算（バイト）"
+))
+
+
+def record_error(error: BaseException):
+    """
+    エラーを種類別に記録
+
+    Args:
+        error: 発生した例外（HTTPExceptionの場合はステータスコード別に集計）
+    """
+    status_code = getattr(error, "status_code", None)
+    ERRORS.inc(type=f"http_{status_code}" if status_code is not None else type(error).__name__)
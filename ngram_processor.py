@@ -0,0 +1,90 @@
+"""
+n-gram繰り返し抑制モジュール
+直近のウィンドウ内で繰り返されたn-gramの続きのトークンを禁止するLogitsProcessor（NumPyでベクトル化）
+"""
+
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+
+
+class NGramBanLogitsProcessor:
+    """
+    DeepSeek-OCRの NoRepeatNGramLogitsProcessor と同じ規則でトークンを禁止するLogitsProcessor
+
+    直前の (ngram_size - 1) トークンが、直近 window_size トークン内の位置と一致する場合、
+    その位置の次のトークンを禁止する（whitelist_token_idsは除く）。
+
+    1トークンあたりの処理はウィンドウ内のトークンのみを対象に、最後のトークンが一致する
+    候補位置を絞り込んでから比較するため、出力長（最大8192トークン）に比例しない。
+    状態を持たないため、1つのインスタンスを全リクエストで共有できる。
+    """
+
+    def __init__(
+        self,
+        ngram_size: int,
+        window_size: int = 100,
+        whitelist_token_ids: Optional[Iterable[int]] = None
+    ):
+        self.ngram_size = ngram_size
+        self.window_size = window_size
+        self.whitelist_token_ids = np.array(sorted(whitelist_token_ids or ()), dtype=np.int64)
+
+    def banned_tokens(self, input_ids: Sequence[int]) -> List[int]:
+        """
+        次に生成してはいけないトークンを返す
+
+        Args:
+            input_ids: これまでに生成したトークンID
+
+        Returns:
+            List[int]: 禁止するトークンID
+        """
+        length = len(input_ids)
+        if length < self.ngram_size:
+            return []
+
+        # ウィンドウ内のトークンのみを配列にする
+        start = max(0, length - self.window_size)
+        tokens = np.asarray(input_ids[start:], dtype=np.int64)
+        prefix_length = self.ngram_size - 1
+        prefix = tokens[-prefix_length:]
+
+        # n-gramの開始位置 i（0 <= i < len(tokens) - ngram_size + 1）のうち、
+        # 接頭辞の最後のトークンが一致する位置のみを候補にする
+        num_positions = len(tokens) - self.ngram_size + 1
+        if num_positions <= 0:
+            return []
+        candidates = np.flatnonzero(tokens[prefix_length - 1:prefix_length - 1 + num_positions] == prefix[-1])
+        if len(candidates) == 0:
+            return []
+
+        # 候補位置の接頭辞全体を比較
+        offsets = np.arange(prefix_length)
+        matched = candidates[(tokens[candidates[:, None] + offsets] == prefix).all(axis=1)]
+        if len(matched) == 0:
+            return []
+
+        banned = np.unique(tokens[matched + prefix_length])
+        if len(self.whitelist_token_ids):
+            banned = banned[~np.isin(banned, self.whitelist_token_ids)]
+        return banned.tolist()
+
+    def __call__(self, input_ids: Sequence[int], scores):
+        """
+        vLLMのLogitsProcessorとして呼び出される（禁止トークンのスコアを -inf にする）
+
+        vLLMが渡すスコアはリクエストごとのlogitsの行で、戻り値は同じ行に書き戻されるため、
+        語彙サイズ分のコピーを作らずにその場で書き換える。
+
+        Args:
+            input_ids: これまでに生成したトークンID
+            scores: 次のトークンのスコア（torch.Tensor、ベンチマークではnumpy配列）
+
+        Returns:
+            禁止トークンを -inf にしたスコア
+        """
+        banned = self.banned_tokens(input_ids)
+        if banned:
+            scores[banned] = -float("inf")
+        return scores
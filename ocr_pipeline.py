@@ -0,0 +1,733 @@
+"""
+OCR処理モジュール
+ファイルの読み込み・前処理・推論と、レスポンス用の結果の作成・結果キャッシュの参照と保存を行う
+"""
+
+import asyncio
+import functools
+import time
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+from PIL import Image
+
+from image_loader import load_image_from_file, iter_pdf_pages, is_pdf, estimate_decoded_bytes, FileContent
+from deepseek_ocr_engine import ocr_engine, preprocess_image_features, DEFAULT_PRIORITY, PAGE_CONCURRENCY
+from worker_pool import worker_pool
+from result_cache import result_cache, make_cache_key
+from feature_cache import feature_cache, feature_key, content_digest
+from job_queue import JobProgress
+from inference_backend import crop_grid
+from generation_monitor import token_budget
+from page_screen import (
+    BLANK_SCREEN, CropMode, screen_page, screen_settings, is_blank, content_density, resolve_crop_mode
+)
+from roi import crop_roi
+from uploads import memory_budget
+from metrics import STAGE_SECONDS, IMAGE_TILES, BLANK_PAGES_SKIPPED
+
+# 推論の出力（モデルの生出力、生成トークン数と打ち切りの理由（打ち切っていない場合はNone））
+Output = Tuple[str, int, Optional[str]]
+
+
+def require_engine():
+    """
+    エンジンが初期化されていない場合は503を返す
+    """
+    if not ocr_engine.is_initialized():
+        raise HTTPException(
+            status_code=503,
+            detail="OCRエンジンが初期化されていません。しばらく待ってから再度お試しください。"
+        )
+
+
+def result_cache_key(
+    file_content: FileContent,
+    crop_mode: CropMode,
+    prompt: str,
+    page_range: Optional[Tuple[int, Optional[int]]] = None,
+    priority: str = DEFAULT_PRIORITY,
+    rois: Optional[List[dict]] = None
+) -> str:
+    """
+    結果キャッシュのキーを生成（ROIモード以外のキーは従来どおり）
+    """
+    roi_params = {"rois": [[roi["page"], roi["box"], roi["id"]] for roi in rois]} if rois else {}
+    return make_cache_key(
+        file_content,
+        prompt=prompt,
+        crop_mode=crop_mode,
+        pages=list(page_range) if page_range else None,
+        sampling=ocr_engine.sampling_settings(priority),
+        screen=screen_settings(),
+        **roi_params
+    )
+
+
+def _cacheable(result: dict) -> dict:
+    """
+    レスポンスからキャッシュに保存する項目を取り出す（ファイル名と処理時間は除く）
+    """
+    cached = {key: value for key, value in result.items() if key not in ("filename", "timings")}
+    for parts in ("pages", "rois"):
+        if parts in cached:
+            cached[parts] = [
+                {key: value for key, value in part.items() if key != "timings"}
+                for part in cached[parts]
+            ]
+    return cached
+
+
+def cached_result(
+    cache_key: str,
+    filename: str,
+    use_cache: bool = True,
+    progress: Optional[JobProgress] = None
+) -> Optional[dict]:
+    """
+    結果キャッシュにある結果をレスポンス用に返す（ない場合、use_cacheがFalseの場合はNone）
+
+    progressを指定した場合は、キャッシュの結果のページ数で処理済みにする。
+    """
+    if not use_cache:
+        return None
+    cached = result_cache.get(cache_key)
+    if cached is None:
+        return None
+    if progress is not None:
+        progress.complete(len(cached.get("pages") or ()) or 1)
+    return {**cached, "filename": filename, "cached": True}
+
+
+def store_result(cache_key: str, result: dict, use_cache: bool = True) -> dict:
+    """
+    結果を結果キャッシュに保存し（use_cacheがFalseの場合は保存しない）、レスポンス用の結果を返す
+    """
+    if use_cache:
+        result_cache.put(cache_key, _cacheable(result))
+    return {**result, "cached": False}
+
+
+def _extract_text(raw_output: str, timings: Optional[Dict[str, float]] = None) -> str:
+    """
+    モデルの生出力からテキストを抽出し、抽出時間を記録する
+    """
+    started = time.perf_counter()
+    extracted_text = ocr_engine.extract_text(raw_output)
+    elapsed = time.perf_counter() - started
+    STAGE_SECONDS.observe(elapsed, stage="extract_text")
+    if timings is not None:
+        timings["extract_text_ms"] = round(elapsed * 1000, 2)
+    return extracted_text
+
+
+def _screen_result(crop_mode: bool, screen: Optional[dict]) -> dict:
+    """
+    ページ（領域）の結果に追加する、使用したクロップモードと白紙の判定結果
+    """
+    return {"crop_mode": crop_mode, "skipped_blank": is_blank(screen), "content_density": content_density(screen)}
+
+
+def _output_result(output: Output, timings: Dict[str, float]) -> dict:
+    """
+    推論の出力から、抽出したテキストと生成の結果の項目を作成する
+    """
+    raw_output, num_tokens, truncated = output
+    return {
+        "extracted_text": _extract_text(raw_output, timings),
+        "raw_output": raw_output,
+        "num_tokens": num_tokens,
+        "truncated": truncated
+    }
+
+
+def build_result(
+    filename: str,
+    output: Output,
+    image_size: Tuple[int, int],
+    crop_mode: bool,
+    screen: Optional[dict],
+    timings: Dict[str, float]
+) -> dict:
+    """
+    1画像（PDFは1ページ目）の推論の出力からレスポンス用の結果を作成する
+
+    crop_modeには画像に使用したクロップモードを指定する。
+    """
+    return {
+        "success": True,
+        **_output_result(output, timings),
+        "filename": filename,
+        "image_size": list(image_size),
+        **_screen_result(crop_mode, screen),
+        "timings": timings
+    }
+
+
+def _combine_results(filename: str, crop_mode: CropMode, key: str, parts: List[dict]) -> dict:
+    """
+    ページ（領域）ごとの結果をまとめたレスポンス用の結果を作成する（partsはkeyの項目に格納する）
+    """
+    return {
+        "success": True,
+        "extracted_text": "\n\n".join(part["extracted_text"] for part in parts),
+        "raw_output": "\n\n".join(part["raw_output"] for part in parts),
+        "num_tokens": sum(part["num_tokens"] for part in parts),
+        "truncated": next((part["truncated"] for part in parts if part["truncated"]), None),
+        "skipped_blank": all(part["skipped_blank"] for part in parts),
+        "filename": filename,
+        "crop_mode": crop_mode,
+        key: parts
+    }
+
+
+def _load_crop_mode(crop_mode: CropMode, prompt: str) -> Optional[bool]:
+    """
+    画像の読み込み時に縮小の基準とするクロップモード（画像を使わないプロンプトでは縮小しない）
+
+    auto の場合は判定前のため、解像度の大きいクロップモードの基準で読み込む。
+    """
+    return resolve_crop_mode(crop_mode, None) if '<image>' in prompt else None
+
+
+def _screen_enabled(prompt: str) -> bool:
+    """
+    白紙の判定を行うか（判定が有効で、プロンプトに画像が含まれる場合のみ）
+    """
+    return BLANK_SCREEN and '<image>' in prompt
+
+
+async def _preprocess(
+    image: Image.Image,
+    crop_mode: bool,
+    prompt: str,
+    timings: Dict[str, float]
+):
+    """
+    プロンプトに画像が含まれる場合のみ、ワーカープールで画像を前処理する
+    """
+    if '<image>' in prompt:
+        if crop_mode:
+            columns, rows = crop_grid(*image.size)
+            if columns * rows > 1:
+                IMAGE_TILES.inc(columns * rows)
+        return await worker_pool.run(
+            "preprocess", preprocess_image_features, image, crop_mode,
+            timings=timings
+        )
+    return None
+
+
+async def _screen_and_preprocess(
+    image: Image.Image,
+    crop_mode: CropMode,
+    prompt: str,
+    timings: Dict[str, float],
+    screen: Optional[dict]
+) -> Tuple[object, bool]:
+    """
+    白紙の判定結果から使用するクロップモードを選び、白紙でなければ前処理する
+
+    Returns:
+        Tuple[object, bool]: 画像特徴量（白紙の場合はNone）と使用するクロップモード
+    """
+    used_crop_mode = resolve_crop_mode(crop_mode, screen)
+    if is_blank(screen):
+        return None, used_crop_mode
+    return await _preprocess(image, used_crop_mode, prompt, timings), used_crop_mode
+
+
+async def _next_page(
+    pages: Iterator[Tuple[int, Optional[Image.Image]]],
+    timings: Dict[str, float]
+) -> Optional[Tuple[int, Optional[Image.Image]]]:
+    """
+    PDFの次のページを変換し、変換時間を記録する（最後のページの後はNone）
+
+    ページ変換はブロッキング処理のため、推論中のページを止めないようスレッドで実行する。
+    キャッシュにあり変換を省略したページ（画像がNone）の時間は記録しない。
+    """
+    started = time.perf_counter()
+    page = await asyncio.to_thread(next, pages, None)
+    if page is not None and page[1] is not None:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage="decode")
+        timings["decode_ms"] = round(elapsed * 1000, 2)
+    return page
+
+
+async def load_and_preprocess(
+    file_content: FileContent,
+    filename: str,
+    crop_mode: CropMode,
+    prompt: str,
+    timings: Dict[str, float],
+    use_cache: bool = True
+):
+    """
+    アップロードされたファイルをワーカープールで読み込み、前処理する
+
+    同じ画像（PDFは1ページ目）・クロップモードの画像特徴量がキャッシュにあれば、
+    プロンプトが異なっても読み込みと前処理を省略して再利用する。
+    デコードと前処理の間は、必要なメモリの概算をメモリバジェットから予約する。
+    読み込み時に白紙と判定した画像は前処理を省略し、画像特徴量をNoneとして返す。
+
+    Returns:
+        Tuple[object, Tuple[int, int], Optional[dict]]: 画像特徴量、縮小前の元の画像サイズ（幅, 高さ）と
+            白紙の判定結果（判定していない場合はNone）
+    """
+    cache_key = None
+    if use_cache and '<image>' in prompt:
+        cache_key = feature_key(content_digest(file_content), crop_mode, 1 if is_pdf(filename) else None)
+        cached = feature_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    load_crop_mode = _load_crop_mode(crop_mode, prompt)
+    if worker_pool.pool_type == 'process' and not isinstance(file_content, bytes):
+        # プロセスプールには参照（memoryview）を渡せないためコピーする
+        file_content = bytes(file_content)
+
+    with memory_budget.reserve(estimate_decoded_bytes(file_content, filename, load_crop_mode)):
+        # 画像を読み込み（RGB形式）
+        image = await worker_pool.run(
+            "decode", load_image_from_file, file_content, filename, load_crop_mode, _screen_enabled(prompt),
+            timings=timings
+        )
+
+        # 画像の前処理（白紙の画像は省略）
+        image_size = image.info.get('original_size', image.size)
+        screen = image.info.get('screen')
+        image_features, _ = await _screen_and_preprocess(image, crop_mode, prompt, timings, screen)
+
+    if cache_key is not None:
+        feature_cache.put(cache_key, image_features, image_size, screen)
+    return image_features, image_size, screen
+
+
+async def _generate(
+    image_features,
+    prompt: str,
+    timings: Dict[str, float],
+    request_id: Optional[str] = None,
+    progress: Optional[JobProgress] = None,
+    priority: str = DEFAULT_PRIORITY,
+    deadline: Optional[float] = None,
+    max_tokens: Optional[int] = None
+) -> Output:
+    """
+    OCR推論を実行し、推論時間を記録する（progress指定時は生成トークン数を記録）
+
+    Returns:
+        Tuple[str, int, Optional[str]]: モデルの生出力、生成トークン数と打ち切りの理由（打ち切っていない場合はNone）
+    """
+    started = time.perf_counter()
+    raw_output = ""
+    num_tokens = 0
+    truncated = None
+    async for chunk in ocr_engine.generate_stream(
+        image_features=image_features,
+        prompt=prompt,
+        request_id=request_id,
+        priority=priority,
+        deadline=deadline,
+        max_tokens=max_tokens
+    ):
+        raw_output = chunk["text"]
+        num_tokens = chunk["num_tokens"]
+        truncated = chunk["truncated"]
+        if progress is not None:
+            progress.update_tokens(chunk["request_id"], chunk["num_tokens"])
+    elapsed = time.perf_counter() - started
+    STAGE_SECONDS.observe(elapsed, stage="generate")
+    timings["generate_ms"] = round(elapsed * 1000, 2)
+    if progress is not None:
+        progress.page_done()
+    return raw_output, num_tokens, truncated
+
+
+async def skip_blank(progress: Optional[JobProgress] = None) -> Output:
+    """
+    白紙と判定したページの生成を省略し、空の出力を返す（_generate と同じ形式）
+    """
+    BLANK_PAGES_SKIPPED.inc()
+    if progress is not None:
+        progress.page_done()
+    return "", 0, None
+
+
+def _generate_or_skip(
+    image_features,
+    prompt: str,
+    timings: Dict[str, float],
+    image_size: Tuple[int, int],
+    crop_mode: bool,
+    screen: Optional[dict],
+    request_id: Optional[str] = None,
+    progress: Optional[JobProgress] = None,
+    priority: str = DEFAULT_PRIORITY,
+    deadline: Optional[float] = None
+) -> Awaitable[Output]:
+    """
+    白紙と判定した画像は生成を省略し、それ以外は画像サイズと内容の密度に応じたトークン数の上限で推論する
+    """
+    if is_blank(screen):
+        return skip_blank(progress)
+    return _generate(
+        image_features, prompt, timings, request_id=request_id, progress=progress, priority=priority,
+        deadline=deadline, max_tokens=token_budget(image_size, crop_mode, content_density(screen))
+    )
+
+
+def _cached_page_lookup(
+    digest: str,
+    crop_mode: CropMode,
+    cached_pages: Dict[int, Tuple[object, Tuple[int, int], Optional[dict]]]
+) -> Callable[[int], bool]:
+    """
+    iter_pdf_pages の skip_page に渡す関数を返す
+
+    画像特徴量キャッシュにあるページは cached_pages に記録し、変換を省略させる。
+    """
+    def skip_page(page_number: int) -> bool:
+        cached = feature_cache.get(feature_key(digest, crop_mode, page_number))
+        if cached is not None:
+            cached_pages[page_number] = cached
+        return cached is not None
+    return skip_page
+
+
+async def _ocr_pdf_pages(
+    file_content: FileContent,
+    filename: str,
+    crop_mode: CropMode,
+    prompt: str,
+    first_page: int,
+    last_page: Optional[int],
+    progress: Optional[JobProgress] = None,
+    priority: str = DEFAULT_PRIORITY,
+    deadline: Optional[float] = None,
+    use_cache: bool = True
+) -> List[dict]:
+    """
+    PDFの各ページを順に変換し、変換できたページから推論を開始する
+
+    ページの推論はエンジン内で並行して実行され、結果はページ順に返す。
+    推論中のページが PAGE_CONCURRENCY に達した場合は、空きができるまで次のページの変換を待つ
+    （ページ数の多いPDFでもエンジンの待ち行列を溢れさせない）。
+    画像特徴量がキャッシュにあるページは変換と前処理を省略する。
+    progressに推論済みのページ（429で再投入される前の実行で完了したページ）がある場合は、
+    変換から推論までを省略してその結果を使う。
+    白紙と判定したページは前処理と推論を省略し、空の結果を返す。
+    各ページの変換と前処理の間は、必要なメモリの概算をメモリバジェットから予約する。
+    """
+    # キャッシュにあったページの画像特徴量、元の画像サイズと白紙の判定結果（ページ変換のスレッドで記録）
+    cached_pages: Dict[int, Tuple[object, Tuple[int, int], Optional[dict]]] = {}
+    digest = content_digest(file_content) if use_cache and '<image>' in prompt else None
+    cache_lookup = _cached_page_lookup(digest, crop_mode, cached_pages) if digest is not None else None
+    finished_pages = progress.finished_pages if progress is not None else {}
+
+    def skip_page(page_number: int) -> bool:
+        return page_number in finished_pages or (cache_lookup is not None and cache_lookup(page_number))
+
+    load_crop_mode = _load_crop_mode(crop_mode, prompt)
+    page_bytes = estimate_decoded_bytes(file_content, filename, load_crop_mode)
+    pages = iter_pdf_pages(
+        file_content, filename, first_page, last_page, load_crop_mode, skip_page, _screen_enabled(prompt)
+    )
+    entries: List[Tuple[int, Tuple[int, int], dict, Dict[str, float]]] = []
+    tasks: List[asyncio.Future] = []
+    base_request_id = ocr_engine.new_request_id()
+    # ページの推論枠（推論が終わったページの枠で次のページを変換する）
+    slots = asyncio.Semaphore(PAGE_CONCURRENCY)
+
+    def page_done(entry: Tuple[int, Tuple[int, int], dict, Dict[str, float]], task: asyncio.Task):
+        # 推論枠を解放し、推論できたページはprogressに記録する（再投入時に再利用）
+        slots.release()
+        if progress is not None and not task.cancelled() and task.exception() is None:
+            progress.finish_page(entry[0], (entry, task.result()))
+
+    try:
+        while True:
+            await slots.acquire()
+            task = None
+            try:
+                timings: Dict[str, float] = {}
+                with memory_budget.reserve(page_bytes):
+                    page = await _next_page(pages, timings)
+                    if page is None:
+                        break
+                    page_number, image = page
+                    if page_number in finished_pages:
+                        entry, output = finished_pages[page_number]
+                        entries.append(entry)
+                        tasks.append(asyncio.get_running_loop().create_future())
+                        tasks[-1].set_result(output)
+                        continue
+                    if image is None:
+                        image_features, image_size, screen = cached_pages.pop(page_number)
+                        page_crop_mode = resolve_crop_mode(crop_mode, screen)
+                    else:
+                        screen = image.info.get('screen')
+                        image_features, page_crop_mode = await _screen_and_preprocess(
+                            image, crop_mode, prompt, timings, screen
+                        )
+                        image_size = image.info.get('original_size', image.size)
+                        del image
+                        if digest is not None:
+                            feature_cache.put(
+                                feature_key(digest, crop_mode, page_number), image_features, image_size, screen
+                            )
+                entries.append((page_number, image_size, _screen_result(page_crop_mode, screen), timings))
+                task = asyncio.create_task(_generate_or_skip(
+                    image_features, prompt, timings, image_size, page_crop_mode, screen,
+                    request_id=f"{base_request_id}-page{page_number}",
+                    progress=progress,
+                    priority=priority,
+                    deadline=deadline
+                ))
+            finally:
+                if task is None:
+                    slots.release()
+            task.add_done_callback(functools.partial(page_done, entries[-1]))
+            tasks.append(task)
+
+        if progress is not None:
+            progress.pages_total = len(tasks)
+        outputs = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    finally:
+        pages.close()
+
+    return [
+        {
+            "page": page_number,
+            **_output_result(output, timings),
+            "image_size": list(image_size),
+            **page_screen,
+            "timings": timings
+        }
+        for (page_number, image_size, page_screen, timings), output in zip(entries, outputs)
+    ]
+
+
+async def _ocr_rois(
+    file_content: FileContent,
+    filename: str,
+    crop_mode: CropMode,
+    prompt: str,
+    rois: List[dict],
+    priority: str = DEFAULT_PRIORITY,
+    deadline: Optional[float] = None
+) -> List[dict]:
+    """
+    画像（PDFは指定ページ）から各領域を切り出し、領域ごとの推論を並行して実行する
+
+    ページは縮小せずに1回だけ読み込み、切り出した領域を個別に前処理するため、
+    小さな領域はタイル分割されずに処理される。結果は指定順に返す。
+    白紙の判定とクロップモードの自動選択は切り出した領域ごとに行う。
+    各ページの読み込みと切り出しの間は、必要なメモリの概算をメモリバジェットから予約する。
+    """
+    pdf = is_pdf(filename)
+    if worker_pool.pool_type == 'process' and not isinstance(file_content, bytes):
+        # プロセスプールには参照（memoryview）を渡せないためコピーする
+        file_content = bytes(file_content)
+    page_bytes = estimate_decoded_bytes(file_content, filename)
+    entries: List[Tuple[int, List[int], Tuple[int, int], dict, Dict[str, float]]] = []
+    tasks: List[asyncio.Task] = []
+    base_request_id = ocr_engine.new_request_id()
+
+    try:
+        for page_number in sorted({roi["page"] for roi in rois}):
+            page_timings: Dict[str, float] = {}
+            with memory_budget.reserve(page_bytes):
+                if pdf:
+                    # 切り出しの解像度を保つため、ページは縮小せずに描画する
+                    pages = iter_pdf_pages(file_content, filename, page_number, page_number)
+                    try:
+                        _, image = await _next_page(pages, page_timings)
+                    finally:
+                        pages.close()
+                else:
+                    image = await worker_pool.run(
+                        "decode", load_image_from_file, file_content, filename,
+                        timings=page_timings
+                    )
+                image_size = image.info.get('original_size', image.size)
+
+                for index, roi in enumerate(rois):
+                    if roi["page"] != page_number:
+                        continue
+                    crop, box = crop_roi(image, roi["box"])
+                    timings = dict(page_timings)
+                    screen = None
+                    if _screen_enabled(prompt):
+                        screen = await worker_pool.run("screen", screen_page, crop, timings=timings)
+                    image_features, roi_crop_mode = await _screen_and_preprocess(
+                        crop, crop_mode, prompt, timings, screen
+                    )
+                    del crop
+                    entries.append((index, box, image_size, _screen_result(roi_crop_mode, screen), timings))
+                    tasks.append(asyncio.create_task(_generate_or_skip(
+                        image_features, prompt, timings, (box[2] - box[0], box[3] - box[1]), roi_crop_mode, screen,
+                        request_id=f"{base_request_id}-roi{index}",
+                        priority=priority,
+                        deadline=deadline
+                    )))
+                del image
+
+        outputs = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    results = []
+    for (index, box, image_size, roi_screen, timings), output in zip(entries, outputs):
+        results.append({
+            "index": index,
+            "id": rois[index]["id"],
+            "page": rois[index]["page"],
+            "box": box,
+            "image_size": list(image_size),
+            **_output_result(output, timings),
+            **roi_screen,
+            "timings": timings
+        })
+    return sorted(results, key=lambda result: result["index"])
+
+
+async def ocr_file(
+    file_content: FileContent,
+    filename: str,
+    crop_mode: CropMode,
+    prompt: str,
+    page_range: Optional[Tuple[int, Optional[int]]] = None,
+    progress: Optional[JobProgress] = None,
+    use_cache: bool = True,
+    priority: str = DEFAULT_PRIORITY,
+    deadline: Optional[float] = None,
+    rois: Optional[List[dict]] = None
+) -> dict:
+    """
+    1ファイルをOCRしてレスポンス用の結果を返す（結果キャッシュを利用）
+
+    page_rangeを指定した場合はPDFの複数ページモードで処理する。
+    roisを指定した場合は指定した領域のみを領域ごとに処理する（ROIモード）。
+    progressを指定した場合は生成トークン数と処理済みページ数を記録する。
+    use_cacheがFalseの場合は結果キャッシュ・画像特徴量キャッシュを参照・保存しない（ウォームアップ用）。
+    priorityとdeadlineはエンジンの推論枠の割り当てと期限切れの中断に使われる。
+    """
+    # 同一ファイル・同一設定の結果がキャッシュにあれば再利用
+    cache_key = result_cache_key(file_content, crop_mode, prompt, page_range, priority, rois)
+    cached = cached_result(cache_key, filename, use_cache, progress)
+    if cached is not None:
+        return cached
+
+    # エンジンの初期化チェック
+    require_engine()
+
+    # ROIモード
+    if rois:
+        regions = await _ocr_rois(file_content, filename, crop_mode, prompt, rois, priority, deadline)
+        result = _combine_results(filename, crop_mode, "rois", regions)
+    # 複数ページモード（PDFのみ）
+    elif page_range is not None:
+        pages = await _ocr_pdf_pages(
+            file_content, filename, crop_mode, prompt, page_range[0], page_range[1],
+            progress, priority, deadline, use_cache
+        )
+        result = _combine_results(filename, crop_mode, "pages", pages)
+    else:
+        # 画像の読み込みと前処理
+        timings: Dict[str, float] = {}
+        image_features, image_size, screen = await load_and_preprocess(
+            file_content, filename, crop_mode, prompt, timings, use_cache
+        )
+        used_crop_mode = resolve_crop_mode(crop_mode, screen)
+
+        # OCR推論実行（白紙の画像は省略）
+        if progress is not None:
+            progress.pages_total = 1
+        output = await _generate_or_skip(
+            image_features, prompt, timings, image_size, used_crop_mode, screen,
+            progress=progress, priority=priority, deadline=deadline
+        )
+        result = build_result(filename, output, image_size, used_crop_mode, screen, timings)
+
+    return store_result(cache_key, result, use_cache)
+
+
+async def ocr_prompts(
+    file_content: FileContent,
+    filename: str,
+    crop_mode: CropMode,
+    prompts: List[Tuple[Optional[str], str]],
+    priority: str = DEFAULT_PRIORITY,
+    deadline: Optional[float] = None,
+    use_cache: bool = True
+) -> List[dict]:
+    """
+    1ファイル（PDFは1ページ目）を複数のプロンプトでOCRし、プロンプトごとの結果を返す
+
+    画像の読み込みと前処理は1回だけ行い、結果キャッシュにないプロンプトの推論を
+    エンジンへ同時に投入して並行に実行する。結果はプロンプトごとに単一プロンプトの
+    /ocr と同じキーで結果キャッシュに保存・参照される（use_cacheがFalseの場合は参照・保存しない）。
+    白紙と判定した画像では、画像を使うプロンプトの推論のみ省略する。
+    """
+    cache_keys = [result_cache_key(file_content, crop_mode, prompt, priority=priority) for _, prompt in prompts]
+    results = [cached_result(cache_key, filename, use_cache) for cache_key in cache_keys]
+
+    pending = [index for index, result in enumerate(results) if result is None]
+    if pending:
+        require_engine()
+
+        # 画像を使うプロンプトがあればそのプロンプトで読み込む（前処理は画像を使うプロンプトがある場合のみ）
+        load_prompt = next(
+            (prompts[index][1] for index in pending if '<image>' in prompts[index][1]),
+            prompts[pending[0]][1]
+        )
+        load_timings: Dict[str, float] = {}
+        image_features, image_size, screen = await load_and_preprocess(
+            file_content, filename, crop_mode, load_prompt, load_timings, use_cache
+        )
+        used_crop_mode = resolve_crop_mode(crop_mode, screen)
+
+        base_request_id = ocr_engine.new_request_id()
+        prompt_timings = [dict(load_timings) for _ in pending]
+        prompt_screens = [screen if '<image>' in prompts[index][1] else None for index in pending]
+        tasks = [
+            asyncio.create_task(_generate_or_skip(
+                image_features if '<image>' in prompts[index][1] else None,
+                prompts[index][1],
+                timings,
+                image_size,
+                used_crop_mode,
+                prompt_screen,
+                request_id=f"{base_request_id}-prompt{index}",
+                priority=priority,
+                deadline=deadline
+            ))
+            for index, timings, prompt_screen in zip(pending, prompt_timings, prompt_screens)
+        ]
+        try:
+            outputs = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        for index, timings, prompt_screen, output in zip(pending, prompt_timings, prompt_screens, outputs):
+            results[index] = store_result(
+                cache_keys[index],
+                build_result(filename, output, image_size, used_crop_mode, prompt_screen, timings),
+                use_cache
+            )
+
+    return [
+        {"profile": profile, "prompt": prompt, **{key: value for key, value in result.items() if key != "filename"}}
+        for (profile, prompt), result in zip(prompts, results)
+    ]
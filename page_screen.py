@@ -0,0 +1,188 @@
+"""
+ページの事前判定モジュール
+縮小した画像からインクの割合・濃淡のばらつき・エッジの密度を求め、白紙ページの判定と内容の密度の推定を行う
+"""
+
+import functools
+import math
+import os
+from typing import Optional, Union
+
+import numpy as np
+from fastapi import HTTPException
+from PIL import Image
+
+# 白紙ページの判定を有効にするか（無効の場合は内容の密度も推定しない）
+BLANK_SCREEN = os.environ.get('OCR_BLANK_SCREEN', '1') == '1'
+
+# 判定に使う縮小画像の長辺（ピクセル）
+SCREEN_SIZE = int(os.environ.get('OCR_SCREEN_SIZE', '512'))
+
+# インクの割合（周囲の背景と明るさが大きく異なる画素を含むブロックの割合）がこれ以下の場合は白紙の候補
+BLANK_INK_RATIO = float(os.environ.get('OCR_BLANK_INK_RATIO', '0.002'))
+
+# 背景を除いた濃淡の標準偏差（0〜255）がこれ以下の場合は白紙の候補
+BLANK_STD = float(os.environ.get('OCR_BLANK_STD', '8'))
+
+# エッジの密度（隣接ブロック間で明るさが大きく変わる割合）がこれ以下の場合は白紙の候補
+BLANK_EDGE_RATIO = float(os.environ.get('OCR_BLANK_EDGE_RATIO', '0.002'))
+
+# クロップモードを自動選択する場合、内容の密度がこれ以上のページでクロップモードを使う
+AUTO_CROP_DENSITY = float(os.environ.get('OCR_AUTO_CROP_DENSITY', '0.05'))
+
+# 背景との明るさの差がこれを超える画素をインクとみなす
+INK_DELTA = 48
+
+# 隣接ブロック間の明るさの差がこれを超える場合をエッジとみなす
+EDGE_DELTA = 16
+
+# 背景の明るさを求める区画の大きさ（縮小画像のピクセル）
+BACKGROUND_BLOCK = 32
+
+# crop_mode に指定できる自動選択の値
+CROP_MODE_AUTO = 'auto'
+
+CropMode = Union[bool, str]
+
+_TRUE_VALUES = ('true', '1', 'yes', 'on')
+_FALSE_VALUES = ('false', '0', 'no', 'off')
+
+
+def parse_crop_mode(value: str) -> CropMode:
+    """
+    crop_mode パラメータを変換（true / false、または内容の密度から選択する auto）
+
+    Raises:
+        HTTPException: 不正な値の場合（400）
+    """
+    normalized = value.strip().lower()
+    if normalized in _TRUE_VALUES:
+        return True
+    if normalized in _FALSE_VALUES:
+        return False
+    if normalized == CROP_MODE_AUTO:
+        return CROP_MODE_AUTO
+    raise HTTPException(
+        status_code=400,
+        detail=f"不正なクロップモードです: {value} (true / false / auto)"
+    )
+
+
+def screen_settings() -> dict:
+    """
+    結果に影響する判定の設定を返す（キャッシュキー用）
+    """
+    return {
+        "blank_screen": BLANK_SCREEN,
+        "screen_size": SCREEN_SIZE,
+        "blank_ink_ratio": BLANK_INK_RATIO,
+        "blank_std": BLANK_STD,
+        "blank_edge_ratio": BLANK_EDGE_RATIO,
+        "auto_crop_density": AUTO_CROP_DENSITY
+    }
+
+
+def _block_reduce(array: np.ndarray, size_y: int, size_x: int, ufunc: np.ufunc) -> np.ndarray:
+    """
+    配列を size_y x size_x のブロックに分けて ufunc（np.minimum / np.maximum）で集計（端の余りは切り捨てる）
+
+    ブロック内の位置ごとに間引いた配列を順に集計する（ブロックが小さい場合に軸ごとの集計より速い）。
+    """
+    height, width = array.shape[0] // size_y, array.shape[1] // size_x
+    array = array[:height * size_y, :width * size_x]
+    rows = functools.reduce(ufunc, (array[offset::size_y] for offset in range(size_y)))
+    return functools.reduce(ufunc, (rows[:, offset::size_x] for offset in range(size_x)))
+
+
+def _local_background(means: np.ndarray) -> np.ndarray:
+    """
+    縮小画像を BACKGROUND_BLOCK 四方の区画に分け、区画ごとの明るさの中央値を背景とする
+    （照明のむらや紙の色の変化を背景として除く）
+    """
+    size_y = min(BACKGROUND_BLOCK, means.shape[0])
+    size_x = min(BACKGROUND_BLOCK, means.shape[1])
+    height, width = means.shape[0] // size_y, means.shape[1] // size_x
+    blocks = means[:height * size_y, :width * size_x].reshape(height, size_y, width, size_x)
+    medians = np.median(blocks.transpose(0, 2, 1, 3).reshape(height, width, -1), axis=2)
+    background = np.repeat(np.repeat(medians, size_y, axis=0), size_x, axis=1)
+    pad = ((0, means.shape[0] - background.shape[0]), (0, means.shape[1] - background.shape[1]))
+    return np.pad(background, pad, mode='edge')
+
+
+def screen_page(image: Image.Image) -> dict:
+    """
+    画像を縮小して白紙かどうかを判定し、内容の密度を推定する
+
+    グレースケールの画像をブロックに分け、ブロック内の最小・最大の明るさと周囲の背景との差から
+    細い線も残したインクの有無を、ブロック平均と背景との差から濃淡のばらつきとエッジを求める。
+    3つの指標がすべて閾値以下の場合のみ白紙とする（いずれかが内容を示すページは処理する）。
+
+    Args:
+        image: 読み込んだ画像
+
+    Returns:
+        dict: 判定結果
+            - blank: 白紙と判定したか
+            - density: 内容の密度の推定値（インクを含むブロックの割合、0〜1）
+            - ink_ratio / std / edge_ratio: 各指標の値
+    """
+    gray_image = image.convert('L')
+    factor = math.ceil(max(gray_image.size) / SCREEN_SIZE)
+    if factor >= 4:
+        # 大きい画像は先に1/2に縮小して集計を軽くする（1画素幅の線も背景との差は半分程度残る）
+        gray_image = gray_image.reduce(2)
+        factor //= 2
+    factor = max(1, min(factor, *gray_image.size))
+    width, height = gray_image.size[0] // factor, gray_image.size[1] // factor
+
+    gray = np.asarray(gray_image)
+    means = np.asarray(
+        gray_image.crop((0, 0, width * factor, height * factor)).reduce(factor), dtype=np.float32
+    )
+    darkest = _block_reduce(gray, factor, factor, np.minimum).astype(np.float32)
+    brightest = _block_reduce(gray, factor, factor, np.maximum).astype(np.float32)
+    background = _local_background(means)
+
+    ink = (background - darkest > INK_DELTA) | (brightest - background > INK_DELTA)
+    ink_ratio = float(ink.mean())
+    std = float((means - background).std())
+    edges = int((np.abs(np.diff(means, axis=0)) > EDGE_DELTA).sum())
+    edges += int((np.abs(np.diff(means, axis=1)) > EDGE_DELTA).sum())
+    edge_ratio = edges / means.size
+
+    blank = ink_ratio <= BLANK_INK_RATIO and std <= BLANK_STD and edge_ratio <= BLANK_EDGE_RATIO
+    return {
+        "blank": blank,
+        "density": round(ink_ratio, 4),
+        "ink_ratio": round(ink_ratio, 4),
+        "std": round(std, 2),
+        "edge_ratio": round(edge_ratio, 4)
+    }
+
+
+def is_blank(screen: Optional[dict]) -> bool:
+    """
+    判定結果が白紙かどうか（判定していない場合はFalse）
+    """
+    return screen is not None and screen["blank"]
+
+
+def content_density(screen: Optional[dict]) -> Optional[float]:
+    """
+    判定結果の内容の密度（判定していない場合はNone）
+    """
+    return screen["density"] if screen is not None else None
+
+
+def resolve_crop_mode(crop_mode: CropMode, screen: Optional[dict]) -> bool:
+    """
+    指定されたクロップモードを、ページに使うクロップモードに変換
+
+    auto の場合は内容の密度が AUTO_CROP_DENSITY 以上のページ（文字の多いページ）でクロップモードを使う。
+    判定していない場合はクロップモードを使う。
+    """
+    if crop_mode != CROP_MODE_AUTO:
+        return bool(crop_mode)
+    if screen is None:
+        return True
+    return screen["density"] >= AUTO_CROP_DENSITY
@@ -0,0 +1,205 @@
+"""
+OCR結果キャッシュモジュール
+アップロード内容とOCR設定のハッシュをキーに、OCR結果をメモリ（LRU）とディスクに保持
+"""
+
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple, Union
+
+# メモリキャッシュの最大エントリ数
+CACHE_MAX_ENTRIES = int(os.environ.get('OCR_CACHE_MAX_ENTRIES', '1024'))
+
+# メモリキャッシュの最大サイズ（バイト）
+CACHE_MAX_BYTES = int(os.environ.get('OCR_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+
+# キャッシュの有効期限（秒、0の場合は無期限）
+CACHE_TTL = float(os.environ.get('OCR_CACHE_TTL', '86400'))
+
+# ディスクキャッシュのディレクトリ（空の場合はディスクキャッシュ無効）
+CACHE_DIR = os.environ.get('OCR_CACHE_DIR', '')
+
+
+def make_cache_key(file_content: Union[bytes, memoryview], **params) -> str:
+    """
+    ファイル内容とOCR設定からキャッシュキーを生成
+
+    Args:
+        file_content: ファイルのバイナリコンテンツ
+        **params: 結果に影響する設定（プロンプト、クロップモード、サンプリング設定など）
+
+    Returns:
+        str: キャッシュキー（SHA-256の16進文字列）
+    """
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(file_content).digest())
+    digest.update(json.dumps(params, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    OCR結果キャッシュクラス
+
+    メモリ上のLRUキャッシュ（エントリ数・サイズ・有効期限で削除）と、
+    再起動後も残る任意のディスクキャッシュの2段構成。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        max_bytes: int = CACHE_MAX_BYTES,
+        ttl: float = CACHE_TTL,
+        cache_dir: str = CACHE_DIR
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.cache_dir = cache_dir or None
+        # キー -> (作成時刻, サイズ, 結果)
+        self._entries: "OrderedDict[str, Tuple[float, int, dict]]" = OrderedDict()
+        self._bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        キャッシュから結果を取得
+
+        Args:
+            key: キャッシュキー
+
+        Returns:
+            Optional[dict]: キャッシュされた結果（存在しない、または期限切れの場合はNone）
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            created_at, _, value = entry
+            if not self._is_expired(created_at):
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return value
+            self._remove(key)
+
+        if self.cache_dir:
+            loaded = self._load_from_disk(key)
+            if loaded is not None:
+                created_at, value = loaded
+                self._store_in_memory(key, value, created_at)
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: dict):
+        """
+        結果をキャッシュに保存
+
+        Args:
+            key: キャッシュキー
+            value: OCR結果（JSONシリアライズ可能な辞書）
+        """
+        created_at = time.time()
+        self._store_in_memory(key, value, created_at)
+        if self.cache_dir:
+            self._save_to_disk(key, value, created_at)
+
+    def clear(self):
+        """
+        メモリキャッシュを空にする（ディスクキャッシュは残す）
+        """
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        """
+        キャッシュの統計情報を返す
+
+        Returns:
+            dict: ヒット数、ミス数、エントリ数、使用サイズなど
+        """
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "disk_enabled": self.cache_dir is not None
+        }
+
+    def _is_expired(self, created_at: float) -> bool:
+        return self.ttl > 0 and time.time() - created_at > self.ttl
+
+    def _store_in_memory(self, key: str, value: dict, created_at: float):
+        size = len(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (created_at, size, value)
+        self._bytes += size
+
+        # 古いエントリから削除
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _load_from_disk(self, key: str) -> Optional[Tuple[float, dict]]:
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"ディスクキャッシュの読み込みに失敗しました: {path}: {e}")
+            return None
+
+        created_at = data["created_at"]
+        if self._is_expired(created_at):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            return None
+        return created_at, data["value"]
+
+    def _save_to_disk(self, key: str, value: dict, created_at: float):
+        path = self._disk_path(key)
+        temp_path = f"{path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({"created_at": created_at, "value": value}, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"ディスクキャッシュの書き込みに失敗しました: {path}: {e}")
+
+
+# グローバルキャッシュインスタンス
+result_cache = ResultCache()
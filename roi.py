@@ -0,0 +1,145 @@
+"""
+関心領域（ROI）モジュール
+`/ocr` の rois パラメータの解析と、画像からの領域の切り出しを行う
+"""
+
+import json
+import os
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+from PIL import Image
+
+# 1リクエストで指定できる領域数の上限
+MAX_ROIS = int(os.environ.get('OCR_MAX_ROIS', '32'))
+
+
+def _parse_box(value) -> Optional[List[int]]:
+    """
+    [x1, y1, x2, y2] を整数のピクセル座標として読み取る（不正な場合はNone）
+    """
+    if not isinstance(value, list) or len(value) != 4:
+        return None
+    if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value):
+        return None
+    x1, y1, x2, y2 = (int(round(v)) for v in value)
+    if x1 < 0 or y1 < 0 or x2 <= x1 or y2 <= y1:
+        return None
+    return [x1, y1, x2, y2]
+
+
+def parse_rois(rois: str, pdf: bool) -> List[dict]:
+    """
+    rois パラメータ（JSON）を領域のリストに変換
+
+    各要素は [x1, y1, x2, y2]、または {"box": [x1, y1, x2, y2], "page": 2, "id": "total"}
+    （page はPDFのみ、省略時は1ページ目。id は任意の識別子）。
+    座標は元の画像（PDFは300 DPIで描画したページ）のピクセル座標。
+
+    Args:
+        rois: JSON文字列
+        pdf: PDFファイルかどうか
+
+    Returns:
+        List[dict]: 指定順の領域（box, page, id）
+
+    Raises:
+        HTTPException: 形式が不正、または上限を超えた場合（400）
+    """
+    try:
+        items = json.loads(rois)
+    except ValueError:
+        items = None
+    if isinstance(items, list) and items and not isinstance(items[0], (list, dict)):
+        # 領域1つだけの [x1, y1, x2, y2]
+        items = [items]
+    if not isinstance(items, list) or not items:
+        raise HTTPException(
+            status_code=400,
+            detail="roisは領域 [x1, y1, x2, y2] または {\"box\": [...], \"page\": n} のJSON配列で指定してください"
+        )
+    if len(items) > MAX_ROIS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"roisに指定できる領域は{MAX_ROIS}個までです（指定: {len(items)}個）"
+        )
+
+    parsed = []
+    for index, item in enumerate(items):
+        spec = item if isinstance(item, dict) else {"box": item}
+        box = _parse_box(spec.get("box"))
+        page = spec.get("page", 1)
+        if box is None:
+            raise HTTPException(
+                status_code=400,
+                detail=f"rois[{index}]の座標が不正です（[x1, y1, x2, y2]、0 <= x1 < x2, 0 <= y1 < y2）"
+            )
+        if not isinstance(page, int) or isinstance(page, bool) or page < 1 or (page != 1 and not pdf):
+            raise HTTPException(
+                status_code=400,
+                detail=f"rois[{index}]のページ番号が不正です（pageはPDFのみ、1始まり）"
+            )
+        parsed.append({"box": box, "page": page, "id": spec.get("id")})
+    return parsed
+
+
+def crop_roi(image: Image.Image, box: List[int]) -> Tuple[Image.Image, List[int]]:
+    """
+    画像から領域を切り出す
+
+    画像が縮小されている場合は、元の画像サイズに対する座標を縮小後の座標に変換する。
+    画像からはみ出した部分は画像の範囲に切り詰める。
+
+    Args:
+        image: 画像（img.info['original_size'] に元の画像サイズ）
+        box: 元の画像のピクセル座標 [x1, y1, x2, y2]
+
+    Returns:
+        Tuple[PIL.Image.Image, List[int]]: 切り出した画像と、切り詰めた後の領域
+
+    Raises:
+        HTTPException: 領域が画像の範囲外の場合（400）
+    """
+    original_width, original_height = image.info.get('original_size', image.size)
+    x1, y1, x2, y2 = box
+    if x1 >= original_width or y1 >= original_height:
+        raise HTTPException(
+            status_code=400,
+            detail=f"領域 {box} が画像の範囲外です（画像サイズ: {original_width}x{original_height}）"
+        )
+    x2, y2 = min(x2, original_width), min(y2, original_height)
+    scale_x = image.size[0] / original_width
+    scale_y = image.size[1] / original_height
+    left, top = int(x1 * scale_x), int(y1 * scale_y)
+    crop = image.crop((
+        left,
+        top,
+        max(left + 1, round(x2 * scale_x)),
+        max(top + 1, round(y2 * scale_y))
+    ))
+    return crop, [x1, y1, x2, y2]
+
+
+def offset_regions(regions: List[dict], box: List[int]) -> List[dict]:
+    """
+    切り出した領域内のグラウンディング結果のピクセル座標を、元の画像の座標に変換
+
+    Args:
+        regions: parse_grounding() の結果（切り出した画像のサイズで変換済み）
+        box: 切り出した領域 [x1, y1, x2, y2]
+
+    Returns:
+        List[dict]: boxes を元の画像の座標にした領域
+    """
+    x, y = box[0], box[1]
+    return [
+        {
+            **region,
+            "boxes": [
+                [bx1 + x, by1 + y, bx2 + x, by2 + y]
+                for bx1, by1, bx2, by2 in region["boxes"]
+            ]
+        }
+        for region in regions
+    ]
+
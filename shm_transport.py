@@ -0,0 +1,152 @@
+"""
+共有メモリ転送モジュール
+前処理済みの画像特徴量（テンソル・配列を含む入れ子の構造）を、pickleせずに共有メモリ経由でプロセス間で受け渡す
+"""
+
+import json
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+# メッセージ1行の最大サイズ（制御メッセージのみで、テンソルは共有メモリで渡す）
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+
+
+def encode_message(message: dict) -> bytes:
+    """
+    制御メッセージを1行のJSONに変換
+    """
+    return json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+def decode_message(line: bytes) -> dict:
+    """
+    1行のJSONを制御メッセージに変換
+    """
+    return json.loads(line.decode('utf-8'))
+
+
+def _is_torch_tensor(value) -> bool:
+    return type(value).__module__.startswith('torch') and hasattr(value, 'element_size')
+
+
+def _encode(value, arrays: List[Tuple[memoryview, dict]]):
+    """
+    特徴量をJSONに変換できる構造にし、テンソル・配列はバイト列として arrays に追加する
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, list):
+        return [_encode(item, arrays) for item in value]
+    if isinstance(value, tuple):
+        return {"__tuple__": [_encode(item, arrays) for item in value]}
+    if isinstance(value, dict):
+        if not all(isinstance(key, str) for key in value):
+            raise TypeError("共有メモリで転送できる辞書のキーは文字列のみです")
+        return {"__dict__": {key: _encode(item, arrays) for key, item in value.items()}}
+    if _is_torch_tensor(value):
+        tensor = value.detach().cpu().contiguous()
+        meta = {"kind": "torch", "dtype": str(tensor.dtype).replace('torch.', ''), "shape": list(tensor.shape)}
+        data = tensor.reshape(-1).view(__import__('torch').uint8).numpy()
+    elif isinstance(value, np.ndarray):
+        data = np.ascontiguousarray(value)
+        meta = {"kind": "numpy", "dtype": data.dtype.str, "shape": list(data.shape)}
+    else:
+        raise TypeError(f"共有メモリで転送できない型です: {type(value).__name__}")
+    arrays.append((memoryview(data).cast('B'), meta))
+    return {"__array__": len(arrays) - 1}
+
+
+def encode_features(features) -> Tuple[Any, Optional[SharedMemory]]:
+    """
+    画像特徴量のテンソル・配列を1つの共有メモリにまとめて書き込む
+
+    作成した共有メモリは、受信側が decode_features() で読み込んだ後に送信側で release() を呼んで解放する。
+
+    Args:
+        features: 前処理済みの画像特徴量
+
+    Returns:
+        Tuple[Any, Optional[SharedMemory]]: JSONに変換できる構造（テンソル・配列は共有メモリ内の位置）と
+            共有メモリ（テンソル・配列がない場合はNone）
+    """
+    arrays: List[Tuple[memoryview, dict]] = []
+    tree = _encode(features, arrays)
+    if not arrays:
+        return {"tree": tree, "arrays": []}, None
+
+    total = sum(data.nbytes for data, _ in arrays)
+    shm = SharedMemory(create=True, size=max(1, total))
+    offset = 0
+    metas = []
+    for data, meta in arrays:
+        shm.buf[offset:offset + data.nbytes] = data
+        metas.append({**meta, "offset": offset, "nbytes": data.nbytes})
+        offset += data.nbytes
+    return {"tree": tree, "arrays": metas, "shm": shm.name}, shm
+
+
+def release(shm: Optional[SharedMemory]):
+    """
+    encode_features() で作成した共有メモリを解放（Noneの場合は何もしない）
+    """
+    if shm is None:
+        return
+    shm.close()
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _decode(value, arrays: list):
+    if isinstance(value, list):
+        return [_decode(item, arrays) for item in value]
+    if isinstance(value, dict):
+        if "__tuple__" in value:
+            return tuple(_decode(item, arrays) for item in value["__tuple__"])
+        if "__dict__" in value:
+            return {key: _decode(item, arrays) for key, item in value["__dict__"].items()}
+        if "__array__" in value:
+            return arrays[value["__array__"]]
+    return value
+
+
+def _load_array(buffer: memoryview, meta: dict):
+    """
+    共有メモリからテンソル・配列をコピーして復元（共有メモリを解放しても使えるようにする）
+    """
+    data = bytearray(buffer[meta["offset"]:meta["offset"] + meta["nbytes"]])
+    if meta["kind"] == "numpy":
+        return np.frombuffer(data, dtype=np.dtype(meta["dtype"])).reshape(meta["shape"])
+
+    import torch
+    dtype = getattr(torch, meta["dtype"])
+    if not data:
+        return torch.empty(meta["shape"], dtype=dtype)
+    return torch.frombuffer(data, dtype=torch.uint8).view(dtype).reshape(meta["shape"])
+
+
+def decode_features(encoded: dict):
+    """
+    encode_features() で転送された画像特徴量を復元
+
+    Args:
+        encoded: encode_features() が返した構造
+
+    Returns:
+        画像特徴量（テンソル・配列は共有メモリからコピーしたもの）
+    """
+    if not encoded["arrays"]:
+        return _decode(encoded["tree"], [])
+
+    shm = SharedMemory(name=encoded["shm"])
+    # 接続しただけの共有メモリも終了時に削除されないよう追跡対象から外す（解放は送信側が行う）
+    resource_tracker.unregister(shm._name, "shared_memory")
+    try:
+        arrays = [_load_array(shm.buf, meta) for meta in encoded["arrays"]]
+    finally:
+        shm.close()
+    return _decode(encoded["tree"], arrays)
@@ -0,0 +1,17 @@
+"""
+テスト共通設定
+リポジトリ直下のモジュールを読み込めるようにし、推論はGPUなしのフェイクバックエンドで行う
+"""
+
+import os
+import sys
+
+# モジュールは読み込み時に環境変数を参照するため、読み込む前に設定する
+os.environ.setdefault('OCR_BACKEND', 'fake')
+# APIのテストではウォームアップを省略し、ジョブはメモリに保存する
+os.environ.setdefault('OCR_WARMUP_INPUTS', '')
+os.environ.setdefault('OCR_JOB_STORE', 'memory')
+os.environ.setdefault('OCR_FAKE_LATENCY', '0.01')
+os.environ.setdefault('OCR_FAKE_TOKENS_PER_SECOND', '20000')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
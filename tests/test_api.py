@@ -0,0 +1,173 @@
+"""
+APIエンドポイント（フェイクバックエンド）のテスト
+"""
+
+import io
+import json
+import time
+import zipfile
+
+import pymupdf
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import api_router
+import ocr_pipeline
+
+
+def make_image() -> bytes:
+    # ノイズ画像（白紙と判定されず、呼び出しごとに内容が異なるため結果キャッシュにヒットしない）
+    buffer = io.BytesIO()
+    Image.effect_noise((400, 300), 60).convert('RGB').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def parse_sse(text: str) -> list:
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append({"event": lines["event"], **json.loads(lines["data"])})
+    return events
+
+
+def make_zip(members: dict) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, content in members.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+def make_pdf(pages: int) -> bytes:
+    document = pymupdf.open()
+    for number in range(1, pages + 1):
+        page = document.new_page(width=200, height=300)
+        page.insert_text((20, 40), f"Page {number}")
+    content = document.tobytes()
+    document.close()
+    return content
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(api_router.app) as client:
+        for _ in range(200):
+            if client.get("/health/ready").status_code == 200:
+                break
+            time.sleep(0.05)
+        yield client
+
+
+@pytest.mark.parametrize("first_page", [0, -1])
+def test_first_page_below_one_is_rejected(client, first_page):
+    response = client.post(
+        "/ocr", files={"file": ("doc.pdf", make_pdf(2))}, data={"first_page": str(first_page)}
+    )
+    assert response.status_code == 400
+
+
+def test_stream_ndjson_events_end_with_done(client):
+    response = client.post(
+        "/ocr/stream", files={"file": ("page.png", make_image())},
+        data={"stream_format": "ndjson", "output_format": "regions"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    events = [json.loads(line) for line in response.text.splitlines()]
+    kinds = [event["event"] for event in events]
+    assert kinds[0] == "delta" and kinds[-1] == "done" and kinds.count("done") == 1
+    assert "line" in kinds and "region" in kinds
+
+    # 差分をつなげると最終結果の生出力になり、領域は done の regions と同じ順に返る
+    done = events[-1]
+    deltas = [event for event in events if event["event"] == "delta"]
+    assert "".join(event["delta"] for event in deltas) == done["raw_output"]
+    assert deltas[-1]["num_tokens"] == done["num_tokens"] and done["cached"] is False
+    regions = [{k: v for k, v in event.items() if k != "event"} for event in events if event["event"] == "region"]
+    assert regions == done["regions"]
+
+
+def test_stream_sse_and_cache_hit(client):
+    image = make_image()
+    response = client.post("/ocr/stream", files={"file": ("page.png", image)})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(response.text)
+    assert events[0]["event"] == "delta" and events[-1]["event"] == "done"
+    assert events[-1]["extracted_text"]
+
+    # 同じ入力はキャッシュから最終結果のみを返す
+    cached = parse_sse(client.post("/ocr/stream", files={"file": ("again.png", image)}).text)
+    assert [event["event"] for event in cached] == ["done"]
+    assert cached[0]["cached"] is True and cached[0]["filename"] == "again.png"
+    assert cached[0]["raw_output"] == events[-1]["raw_output"]
+
+
+def test_stream_rejects_unknown_format(client):
+    response = client.post(
+        "/ocr/stream", files={"file": ("page.png", make_image())}, data={"stream_format": "xml"}
+    )
+    assert response.status_code == 400
+
+
+def test_result_cache_hit_skips_generation(client, monkeypatch):
+    generate = ocr_pipeline._generate
+    calls = []
+
+    def counting_generate(*args, **kwargs):
+        calls.append(1)
+        return generate(*args, **kwargs)
+
+    monkeypatch.setattr(ocr_pipeline, '_generate', counting_generate)
+    image = make_image()
+
+    first = client.post("/ocr", files={"file": ("page.png", image)}).json()
+    again = client.post("/ocr", files={"file": ("copy.png", image)}).json()
+    assert first["cached"] is False and again["cached"] is True and len(calls) == 1
+    assert again["raw_output"] == first["raw_output"] and again["filename"] == "copy.png"
+
+    # 結果に影響する設定（クロップモード）が異なる場合はキャッシュを使わない
+    other = client.post("/ocr", files={"file": ("page.png", image)}, data={"crop_mode": "false"}).json()
+    assert other["cached"] is False and len(calls) == 2
+
+
+def test_batch_results_keep_input_order_and_isolate_failures(client):
+    archive = make_zip({
+        "scans/inner.png": make_image(),
+        "notes.txt": b"not an image",
+        "__MACOSX/scans/._inner.png": b"metadata",
+        ".hidden.png": b"hidden"
+    })
+    response = client.post("/ocr/batch", files=[
+        ("files", ("first.png", make_image())),
+        ("files", ("archive.zip", archive)),
+        ("files", ("last.png", make_image()))
+    ])
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["total"], body["succeeded"], body["failed"]) == (4, 3, 1)
+
+    # ZIP内のファイルはZIPの位置に展開され、結果は入力順に返る（メタデータ・隠しファイルは除外）
+    results = body["results"]
+    assert [result["index"] for result in results] == [0, 1, 2, 3]
+    assert [result["filename"] for result in results] == ["first.png", "scans/inner.png", "notes.txt", "last.png"]
+    assert results[2]["success"] is False and results[2]["status_code"] == 400
+    assert all(result["success"] and result["extracted_text"] for result in results if result["index"] != 2)
+
+
+def test_batch_stream_returns_each_result_then_summary(client):
+    response = client.post(
+        "/ocr/batch", files=[("files", (f"page{index}.png", make_image())) for index in range(3)],
+        data={"stream": "true"}
+    )
+    assert response.status_code == 200
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [event["event"] for event in events] == ["result"] * 3 + ["done"]
+    assert sorted(event["index"] for event in events[:3]) == [0, 1, 2]
+    assert (events[-1]["total"], events[-1]["succeeded"], events[-1]["failed"]) == (3, 3, 0)
+
+
+def test_batch_without_files_to_process_is_rejected(client):
+    response = client.post("/ocr/batch", files=[("files", ("empty.zip", make_zip({"folder/.keep": b""})))])
+    assert response.status_code == 400
@@ -0,0 +1,96 @@
+"""
+エンジンプールのレプリカの振り分けと障害時の切り替えのテスト
+"""
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from deepseek_ocr_engine import DeepSeekOCREngine, EnginePool
+from inference_backend import FakeBackend
+
+PROMPT = '<image>\nFree OCR.'
+
+
+def make_pool(replicas: int = 2, routing: str = 'queue_depth') -> EnginePool:
+    return EnginePool(
+        replicas=[
+            DeepSeekOCREngine(backend=FakeBackend(output_text="text " * 20, latency=0.2, tokens_per_second=10000))
+            for _ in range(replicas)
+        ],
+        routing=routing,
+        health_check_interval=0
+    )
+
+
+@pytest.mark.parametrize("routing", ["queue_depth", "tokens"])
+def test_requests_go_to_the_least_loaded_replica(routing):
+    async def main():
+        pool = make_pool(3, routing)
+        await pool.initialize()
+        tasks = []
+        for _ in range(3):
+            tasks.append(asyncio.create_task(pool.generate(prompt=PROMPT)))
+            await asyncio.sleep(0.01)
+        # 1件ずつ推論中の各レプリカに振り分けられる
+        in_flight = [replica.in_flight_count() for replica in pool.replicas]
+        await asyncio.gather(*tasks)
+        pool.shutdown()
+        return in_flight
+
+    assert asyncio.run(main()) == [1, 1, 1]
+
+
+def test_unhealthy_replica_is_removed_and_request_is_retried():
+    async def main():
+        pool = make_pool(2)
+        await pool.initialize()
+        pool.replicas[0].backend.healthy = False
+        # 負荷が同じ場合は番号の小さいレプリカが選ばれ、失敗後に別のレプリカでやり直す
+        output = await pool.generate(prompt=PROMPT)
+        healthy_after_failure = pool.healthy_count()
+
+        pool.replicas[0].backend.healthy = True
+        await pool.check_health()
+        healthy_after_recovery = pool.healthy_count()
+        pool.shutdown()
+        return output, healthy_after_failure, healthy_after_recovery
+
+    output, healthy_after_failure, healthy_after_recovery = asyncio.run(main())
+    assert output.startswith("text")
+    assert healthy_after_failure == 1
+    assert healthy_after_recovery == 2
+
+
+def test_no_healthy_replica_returns_503():
+    async def main():
+        pool = make_pool(2)
+        await pool.initialize()
+        for replica in pool.replicas:
+            replica.backend.healthy = False
+        try:
+            with pytest.raises(HTTPException) as error:
+                await pool.generate(prompt=PROMPT)
+        finally:
+            pool.shutdown()
+        return error.value.status_code, pool.healthy_count()
+
+    assert asyncio.run(main()) == (503, 0)
+
+
+def test_stats_report_each_replica():
+    async def main():
+        pool = make_pool(2)
+        await pool.initialize()
+        task = asyncio.create_task(pool.generate(prompt=PROMPT))
+        await asyncio.sleep(0.01)
+        stats = pool.stats()
+        await task
+        pool.shutdown()
+        return stats
+
+    stats = asyncio.run(main())
+    assert [replica["replica"] for replica in stats] == [0, 1]
+    assert sum(replica["in_flight_requests"] for replica in stats) == 1
+    assert all(replica["healthy"] for replica in stats)
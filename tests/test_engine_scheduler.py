@@ -0,0 +1,125 @@
+"""
+推論枠の割り当て（優先度クラス・期限・待ち行列の上限）と推論時間の記録のテスト
+"""
+
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import deepseek_ocr_engine
+from deepseek_ocr_engine import DeepSeekOCREngine
+from inference_backend import FakeBackend
+
+
+def make_engine(max_in_flight: int = 1, max_queued: int = 10) -> DeepSeekOCREngine:
+    backend = FakeBackend(output_text="text " * 10, latency=0.05, tokens_per_second=10000)
+    return DeepSeekOCREngine(backend=backend, max_in_flight=max_in_flight, max_queued=max_queued)
+
+
+async def run_in_order(engine: DeepSeekOCREngine, requests: list) -> list:
+    """
+    推論枠を1件が使用している間に requests（名前, 優先度, 期限）を順に投入し、完了順の名前を返す
+    """
+    order = []
+
+    async def run(name, priority='normal', deadline=None):
+        await engine.generate(prompt='<image>\nFree OCR.', priority=priority, deadline=deadline)
+        order.append(name)
+
+    tasks = [asyncio.create_task(run('holder'))]
+    await asyncio.sleep(0.01)
+    for name, priority, deadline in requests:
+        tasks.append(asyncio.create_task(run(name, priority, deadline)))
+        await asyncio.sleep(0.001)
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_slots_are_assigned_by_priority_class():
+    async def main():
+        engine = make_engine()
+        await engine.initialize()
+        return await run_in_order(engine, [
+            ('bulk', 'bulk', None),
+            ('normal', 'normal', None),
+            ('interactive', 'interactive', None)
+        ])
+
+    assert asyncio.run(main()) == ['holder', 'interactive', 'normal', 'bulk']
+
+
+def test_earlier_deadline_goes_first_within_a_class():
+    async def main():
+        engine = make_engine()
+        await engine.initialize()
+        now = time.monotonic()
+        return await run_in_order(engine, [
+            ('no_deadline', 'normal', None),
+            ('late', 'normal', now + 30),
+            ('early', 'normal', now + 10)
+        ])
+
+    assert asyncio.run(main()) == ['holder', 'early', 'late', 'no_deadline']
+
+
+def test_deadline_expires_while_waiting_for_a_slot():
+    async def main():
+        engine = make_engine()
+        engine.backend.latency = 0.5
+        await engine.initialize()
+        holder = asyncio.create_task(engine.generate(prompt='<image>\nFree OCR.'))
+        await asyncio.sleep(0.01)
+        try:
+            with pytest.raises(HTTPException) as error:
+                await engine.generate(prompt='<image>\nFree OCR.', deadline=time.monotonic() + 0.05)
+            assert engine.queued_count() == 0
+        finally:
+            await holder
+        return error.value.status_code
+
+    assert asyncio.run(main()) == 504
+
+
+def test_full_queue_is_rejected():
+    async def main():
+        engine = make_engine(max_queued=1)
+        engine.backend.latency = 0.2
+        await engine.initialize()
+        tasks = [asyncio.create_task(engine.generate(prompt='<image>\nFree OCR.')) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        try:
+            with pytest.raises(HTTPException) as error:
+                await engine.generate(prompt='<image>\nFree OCR.')
+        finally:
+            await asyncio.gather(*tasks)
+        # 待機者がいなくなった後は枠がすべて解放されている
+        assert engine.in_flight_count() == 0 and engine._active == 0
+        return error.value.status_code
+
+    assert asyncio.run(main()) == 429
+
+
+def test_first_token_is_observed_once(monkeypatch):
+    # トークンを含まない出力が続いても、最初のトークンまでの時間は1リクエストにつき1回だけ記録する
+    class SlowStartBackend(FakeBackend):
+        async def generate(self, prompt, image_features, request_id, max_tokens):
+            for _ in range(3):
+                yield {"text": "", "num_tokens": 0, "finished": False}
+            async for output in super().generate(prompt, image_features, request_id, max_tokens):
+                yield output
+
+    observed = []
+    monkeypatch.setattr(
+        deepseek_ocr_engine.STAGE_SECONDS, 'observe', lambda value, stage: observed.append(stage)
+    )
+    engine = DeepSeekOCREngine(backend=SlowStartBackend(output_text="text " * 10, latency=0, tokens_per_second=100))
+
+    async def main():
+        await engine.initialize()
+        await engine.generate(prompt='<image>\nFree OCR.')
+        engine.shutdown()
+
+    asyncio.run(main())
+    assert observed.count("first_token") == 1
@@ -0,0 +1,68 @@
+"""
+エンジンサーバーと共有メモリによる画像特徴量の転送のテスト
+"""
+
+import asyncio
+
+import numpy as np
+
+from deepseek_ocr_engine import DeepSeekOCREngine, EnginePool, RemoteEngine
+from engine_server import EngineServer
+from inference_backend import FakeBackend
+from shm_transport import decode_features, decode_message, encode_features, encode_message, release
+
+
+def test_features_round_trip_through_shared_memory():
+    features = {
+        "images": [(np.arange(12, dtype=np.float32).reshape(3, 4), np.zeros((2, 2), dtype=np.uint8))],
+        "crop_grid": (2, 3),
+        "crop_mode": True
+    }
+    encoded, shm = encode_features(features)
+    try:
+        # 構造はJSONで送れる
+        decoded = decode_features(decode_message(encode_message({"features": encoded}))["features"])
+    finally:
+        release(shm)
+    assert decoded["crop_grid"] == (2, 3) and decoded["crop_mode"] is True
+    np.testing.assert_array_equal(decoded["images"][0][0], features["images"][0][0])
+    assert decoded["images"][0][1].dtype == np.uint8
+
+
+def test_features_without_arrays_do_not_use_shared_memory():
+    encoded, shm = encode_features({"image_size": (640, 480)})
+    assert shm is None
+    assert decode_features(encoded) == {"image_size": (640, 480)}
+
+
+def test_remote_engine_generates_through_engine_server(tmp_path):
+    socket_path = str(tmp_path / "engine.sock")
+    output_text = "<|ref|>text<|/ref|><|det|>[[0, 0, 999, 999]]<|/det|>\nhello " * 5
+
+    async def main():
+        backend = FakeBackend(output_text=output_text, latency=0.01, tokens_per_second=10000)
+        server = EngineServer(
+            socket_path, EnginePool(replicas=[DeepSeekOCREngine(backend=backend)], health_check_interval=0)
+        )
+        await server.start()
+        clients = [RemoteEngine(socket_path, status_interval=0) for _ in range(3)]
+        try:
+            for client in clients:
+                await client.initialize()
+            # ウォームアップは最初に要求したワーカーのみが実行する
+            claims = [await client.claim_warm_up() for client in clients]
+            features = {"pixels": np.ones((4, 4), dtype=np.float32)}
+            outputs = await asyncio.gather(
+                *(client.generate(features, '<image>\nFree OCR.') for client in clients)
+            )
+            status = await clients[0].refresh_status()
+        finally:
+            for client in clients:
+                client.shutdown()
+            await server.shutdown()
+        return claims, outputs, status
+
+    claims, outputs, status = asyncio.run(main())
+    assert claims == [True, False, False]
+    assert outputs == [output_text] * 3
+    assert status["initialized"] and status["in_flight_requests"] == 0
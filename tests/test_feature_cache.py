@@ -0,0 +1,49 @@
+"""
+画像特徴量キャッシュのキーと容量の上限のテスト
+"""
+
+import numpy as np
+
+from feature_cache import FeatureCache, content_digest, feature_key
+
+
+def test_key_depends_on_content_page_and_crop_mode():
+    digest = content_digest(b"page")
+    assert digest == content_digest(memoryview(b"page"))
+    assert digest != content_digest(b"other")
+
+    keys = {
+        feature_key(digest, True),
+        feature_key(digest, False),
+        feature_key(digest, True, 2),
+        feature_key(content_digest(b"other"), True)
+    }
+    assert len(keys) == 4
+    # 画像ファイルとPDFの1ページ目以外は区別する
+    assert feature_key(digest, True, None) != feature_key(digest, True, 3)
+
+
+def test_cached_features_are_shared_until_evicted():
+    features = np.zeros(1000, dtype=np.uint8)
+    cache = FeatureCache(max_entries=10, max_bytes=2500)
+    digest = content_digest(b"image")
+    for page in (1, 2, 3):
+        cache.put(feature_key(digest, True, page), features, (640, 480))
+
+    # 合計サイズの上限を超えたため、最も古いページが削除される
+    assert cache.get(feature_key(digest, True, 1)) is None
+    cached = cache.get(feature_key(digest, True, 2))
+    assert cached[0] is features and cached[1] == (640, 480)
+    assert cache.get(feature_key(digest, False, 2)) is None
+
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["bytes"] == 2000 and stats["evictions"] == 1
+    assert stats["hits"] == 1 and stats["misses"] == 2
+
+
+def test_missing_or_oversized_features_are_not_cached():
+    cache = FeatureCache(max_entries=10, max_bytes=100)
+    cache.put("none", None, (640, 480))
+    cache.put("large", np.zeros(1000, dtype=np.uint8), (640, 480))
+    assert cache.get("none") is None and cache.get("large") is None
+    assert cache.stats()["entries"] == 0
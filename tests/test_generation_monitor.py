@@ -0,0 +1,81 @@
+"""
+劣化した生成の検出（GenerationMonitor）と生成トークン数の上限のテスト
+"""
+
+import random
+import string
+import zlib
+
+import generation_monitor
+from generation_monitor import (
+    GenerationMonitor, token_budget, CHECK_INTERVAL_TOKENS, DEGENERATION_MIN_TOKENS, DEGENERATION_WINDOW,
+    REPETITION_RATIO, STALL_TOKENS, TRUNCATED_LOW_ENTROPY, TRUNCATED_REPETITION, TRUNCATED_STALLED
+)
+
+
+def random_text(length: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    return "".join(rng.choice(string.ascii_letters + string.digits + " \n") for _ in range(length))
+
+
+def test_normal_text_is_not_truncated():
+    monitor = GenerationMonitor(enabled=True)
+    text = random_text(DEGENERATION_WINDOW * 4)
+    for num_tokens in range(DEGENERATION_MIN_TOKENS, 2048, CHECK_INTERVAL_TOKENS):
+        assert monitor.feed(text[:num_tokens * 2], num_tokens) is None
+
+
+def test_short_output_is_not_checked():
+    monitor = GenerationMonitor(enabled=True)
+    assert monitor.feed("a" * DEGENERATION_WINDOW * 2, DEGENERATION_MIN_TOKENS - 1) is None
+
+
+def test_repeated_pattern_is_detected():
+    monitor = GenerationMonitor(enabled=True)
+    text = random_text(200) + "<td>Total 1,000</td>" * (DEGENERATION_WINDOW // 5)
+    assert monitor.feed(text, DEGENERATION_MIN_TOKENS) == TRUNCATED_REPETITION
+
+
+def test_sparse_table_is_not_repetition():
+    # 番号の列以外が空のセルの表は、タグを含めると圧縮率が REPETITION_RATIO を下回るが繰り返しではない
+    monitor = GenerationMonitor(enabled=True)
+    text = "<table>" + "".join(f"<tr><td>{row}</td>" + "<td></td>" * 6 + "</tr>" for row in range(1, 100))
+    encoded = text[-DEGENERATION_WINDOW:].encode('utf-8')
+    assert len(zlib.compress(encoded)) / len(encoded) < REPETITION_RATIO
+    for num_tokens in range(DEGENERATION_MIN_TOKENS, 2048, CHECK_INTERVAL_TOKENS):
+        assert monitor.feed(text[:num_tokens * 4], num_tokens) is None
+
+
+def test_low_entropy_is_detected():
+    monitor = GenerationMonitor(enabled=True)
+    assert monitor.feed("-" * DEGENERATION_WINDOW, DEGENERATION_MIN_TOKENS) == TRUNCATED_LOW_ENTROPY
+
+
+def test_stall_is_detected_after_stall_tokens():
+    monitor = GenerationMonitor(enabled=True)
+    text = random_text(100)
+    assert monitor.feed(text, DEGENERATION_MIN_TOKENS) is None
+    # 空白のみが増えている間は進行していない
+    assert monitor.feed(text + "\n" * 50, DEGENERATION_MIN_TOKENS + STALL_TOKENS - 1) is None
+    assert monitor.feed(text + "\n" * 100, DEGENERATION_MIN_TOKENS + STALL_TOKENS + 64) == TRUNCATED_STALLED
+
+
+def test_disabled_monitor_never_truncates():
+    monitor = GenerationMonitor(enabled=False)
+    assert monitor.feed("-" * DEGENERATION_WINDOW, DEGENERATION_MIN_TOKENS) is None
+
+
+def test_token_budget(monkeypatch):
+    assert token_budget((1000, 1000), True) is None
+
+    monkeypatch.setattr(generation_monitor, 'TOKEN_BUDGET_BASE', 100)
+    monkeypatch.setattr(generation_monitor, 'TOKEN_BUDGET_PER_TILE', 10)
+    # 全体画像のみ / 全体画像 + タイル
+    assert token_budget((640, 640), False) == 110
+    assert token_budget((640, 640 * 3), True) > 110
+
+    monkeypatch.setattr(generation_monitor, 'TOKEN_BUDGET_PER_TILE', 0)
+    monkeypatch.setattr(generation_monitor, 'TOKEN_BUDGET_PER_DENSITY', 1000)
+    # 密度による上限のみ（基本値 + 密度1.0あたりの値）
+    assert token_budget((640, 640), False, 0.5) == 600
+    assert token_budget((640, 640), False) is None
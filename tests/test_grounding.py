@@ -0,0 +1,52 @@
+"""
+グラウンディング出力パーサーのテスト
+"""
+
+from grounding import GroundingParser, parse_grounding, scale_box
+
+OUTPUT = (
+    "<|ref|>title<|/ref|><|det|>[[100, 50, 899, 120]]<|/det|>\n# 請求書\n\n"
+    "<|ref|>text<|/ref|><|det|>[[100, 200, 500, 260], [520, 200, 899, 260]]<|/det|>\n合計 1,000円\n\n"
+    "<|ref|>table<|/ref|><|det|>[[0, 300, 999, 999]]<|/det|>\n<table><tr><td>1</td></tr></table>\n"
+    "<|ref|>caption<|/ref|>\n注記"
+)
+
+
+def test_scale_box():
+    assert scale_box([0, 0, 999, 999], (2000, 1000)) == [0, 0, 2000, 1000]
+    assert scale_box([100, 200, 500, 600], (999, 1998)) == [100, 400, 500, 1200]
+
+
+def test_parse_grounding_regions():
+    regions = parse_grounding(OUTPUT, (999, 999))
+    assert [region["type"] for region in regions] == ["title", "text", "table", "text"]
+    assert regions[0]["text"] == "# 請求書"
+    assert regions[1]["normalized_boxes"] == [[100, 200, 500, 260], [520, 200, 899, 260]]
+    assert regions[1]["boxes"] == [[100, 200, 500, 260], [520, 200, 899, 260]]
+    # 座標のない領域
+    assert regions[3]["label"] == "caption" and regions[3]["normalized_boxes"] == []
+
+
+def test_parse_grounding_without_image_size():
+    regions = parse_grounding(OUTPUT)
+    assert all(region["boxes"] is None for region in regions)
+
+
+def test_parse_grounding_without_tags():
+    assert parse_grounding("plain text only") == []
+
+
+def test_incremental_parser_matches_whole_output():
+    expected = parse_grounding(OUTPUT, (1000, 2000))
+    for chunk_size in (1, 3, 7, 50):
+        parser = GroundingParser((1000, 2000))
+        regions = []
+        for start in range(0, len(OUTPUT), chunk_size):
+            regions.extend(parser.feed(OUTPUT[start:start + chunk_size]))
+        regions.extend(parser.flush())
+        assert regions == expected
+
+
+def test_invalid_boxes_are_ignored():
+    regions = parse_grounding("<|ref|>text<|/ref|><|det|>[[1, 2, 3]]<|/det|>abc", (100, 100))
+    assert regions[0]["normalized_boxes"] == [] and regions[0]["text"] == "abc"
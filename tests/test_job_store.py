@@ -0,0 +1,201 @@
+"""
+ジョブストアと、ジョブキューの取得（claim）・復旧・再投入のテスト
+"""
+
+import asyncio
+import collections
+import os
+import sqlite3
+import subprocess
+
+import pytest
+
+import job_queue
+from job_queue import (
+    JobQueue, MemoryJobStore, SQLiteJobStore, recover_jobs,
+    STATUS_QUEUED, STATUS_RUNNING, STATUS_SUCCEEDED
+)
+
+
+def make_job(job_id: str, status: str = STATUS_QUEUED, owner=None, created_at: float = 0.0) -> dict:
+    return {
+        "job_id": job_id,
+        "status": status,
+        "priority": 0,
+        "filename": "page.png",
+        "params": {},
+        "created_at": created_at,
+        "started_at": None,
+        "finished_at": None,
+        "progress": None,
+        "result": None,
+        "error": None,
+        "status_code": None,
+        "owner": owner
+    }
+
+
+def dead_pid() -> int:
+    process = subprocess.Popen(['true'])
+    process.wait()
+    return process.pid
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def store(request, tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.sqlite3")) if request.param == "sqlite" else MemoryJobStore()
+    yield store
+    store.close()
+
+
+def test_store_keeps_jobs_and_input_files(store):
+    store.create(make_job("a"), b"file")
+    job = store.get("a")
+    assert job["status"] == STATUS_QUEUED and store.load_file("a") == b"file"
+
+    job.update(status=STATUS_SUCCEEDED, result={"extracted_text": "ok"})
+    store.update(job)
+    store.delete_file("a")
+    assert store.get("a")["result"] == {"extracted_text": "ok"}
+    assert store.load_file("a") is None
+    assert store.get("missing") is None
+
+
+def test_claim_is_granted_once(store):
+    store.create(make_job("a"), b"file")
+    claimed = store.claim("a", 123)
+    assert claimed["status"] == STATUS_RUNNING and claimed["owner"] == 123
+    assert store.claim("a", 456) is None
+    assert store.claim("missing", 123) is None
+
+
+def test_recovery_requeues_only_jobs_of_dead_owners(store):
+    sleeper = subprocess.Popen(['sleep', '30'])
+    try:
+        store.create(make_job("dead", STATUS_RUNNING, dead_pid(), 1), b"file")
+        store.create(make_job("alive", STATUS_RUNNING, sleeper.pid, 2), b"file")
+        # 復旧するプロセス自身はまだジョブを実行していない
+        store.create(make_job("self", STATUS_RUNNING, os.getpid(), 3), b"file")
+        store.create(make_job("queued", STATUS_QUEUED, None, 4), b"file")
+
+        assert recover_jobs(store) == 2
+        assert [job["job_id"] for job in store.list_queued()] == ["dead", "self", "queued"]
+        assert store.get("alive")["status"] == STATUS_RUNNING
+        assert store.get("dead")["owner"] is None
+    finally:
+        sleeper.kill()
+        sleeper.wait()
+
+
+def test_sqlite_store_adds_owner_column_to_old_database(tmp_path):
+    path = str(tmp_path / "old.sqlite3")
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE jobs (job_id TEXT PRIMARY KEY, status TEXT NOT NULL, priority INTEGER NOT NULL, "
+            "filename TEXT NOT NULL, params TEXT NOT NULL, created_at REAL NOT NULL, started_at REAL, "
+            "finished_at REAL, progress TEXT, result TEXT, error TEXT, status_code INTEGER, file_content BLOB)"
+        )
+        conn.execute(
+            "INSERT INTO jobs (job_id, status, priority, filename, params, created_at) VALUES (?, ?, 0, ?, '{}', 0)",
+            ("old", STATUS_RUNNING, "page.png")
+        )
+    conn.close()
+
+    store = SQLiteJobStore(path)
+    try:
+        assert store.get("old")["owner"] is None
+        assert recover_jobs(store) == 1
+        assert store.claim("old", 1)["owner"] == 1
+    finally:
+        store.close()
+
+
+def test_queue_reruns_unfinished_jobs_on_start(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    seed = SQLiteJobStore(path)
+    seed.create(make_job("interrupted", STATUS_RUNNING), b"file")
+    runs = []
+
+    async def handler(job, file_content, progress):
+        runs.append((job["job_id"], file_content))
+        return {"extracted_text": ""}
+
+    async def main():
+        queue = JobQueue(SQLiteJobStore(path), workers=1)
+        await queue.start(handler)
+        for _ in range(100):
+            if seed.get("interrupted")["status"] == STATUS_SUCCEEDED:
+                break
+            await asyncio.sleep(0.01)
+        await queue.stop()
+
+    asyncio.run(main())
+    assert seed.get("interrupted")["status"] == STATUS_SUCCEEDED
+    seed.close()
+    assert runs == [("interrupted", b"file")]
+
+
+def test_queues_sharing_a_store_run_each_job_once(tmp_path, monkeypatch):
+    path = str(tmp_path / "jobs.sqlite3")
+    seed = SQLiteJobStore(path)
+    for index in range(20):
+        status = STATUS_RUNNING if index % 2 else STATUS_QUEUED
+        seed.create(make_job(f"job-{index}", status, 999999, index), b"file")
+    monkeypatch.setattr(job_queue, "_process_alive", lambda pid: False)
+    # 親プロセスで1回だけ復旧してから、各ワーカーはキュー待ちのジョブを投入する
+    assert recover_jobs(seed) == 10
+
+    runs = collections.Counter()
+
+    async def handler(job, file_content, progress):
+        runs[job["job_id"]] += 1
+        await asyncio.sleep(0.01)
+        return {"extracted_text": ""}
+
+    async def main():
+        queues = [JobQueue(SQLiteJobStore(path), workers=4) for _ in range(2)]
+        for queue in queues:
+            await queue.start(handler, recover=False)
+        for _ in range(200):
+            if all(seed.get(f"job-{index}")["status"] == STATUS_SUCCEEDED for index in range(20)):
+                break
+            await asyncio.sleep(0.01)
+        for queue in queues:
+            await queue.stop()
+
+    asyncio.run(main())
+    seed.close()
+    assert len(runs) == 20 and max(runs.values()) == 1
+
+
+def test_requeued_job_after_busy_engine_is_retried(monkeypatch):
+    from fastapi import HTTPException
+
+    monkeypatch.setattr(job_queue, "JOB_RETRY_DELAY", 0.01)
+    attempts = []
+
+    async def handler(job, file_content, progress):
+        attempts.append(progress)
+        if len(attempts) == 1:
+            progress.finish_page(1, "page 1")
+            raise HTTPException(status_code=429, detail="busy")
+        return {"extracted_text": "ok"}
+
+    async def main():
+        queue = JobQueue(MemoryJobStore(), workers=1)
+        await queue.start(handler)
+        job = await queue.submit(b"file", "page.png", {})
+        for _ in range(100):
+            stored = await queue.get(job["job_id"])
+            if stored["status"] == STATUS_SUCCEEDED:
+                break
+            await asyncio.sleep(0.01)
+        requeue_tasks = len(queue._requeue_tasks)
+        await queue.stop()
+        return stored, requeue_tasks
+
+    stored, requeue_tasks = asyncio.run(main())
+    assert stored["status"] == STATUS_SUCCEEDED and stored["result"] == {"extracted_text": "ok"}
+    assert len(attempts) == 2 and requeue_tasks == 0
+    # 再投入後の実行は推論済みのページを引き継ぐ
+    assert attempts[1] is attempts[0] and attempts[1].finished_pages == {1: "page 1"}
@@ -0,0 +1,45 @@
+"""
+ベクトル化したn-gram繰り返し抑制と、DeepSeek-OCRの NoRepeatNGramLogitsProcessor（比較用の実装）の一致を確認するテスト
+"""
+
+import numpy as np
+import pytest
+
+from benchmark import _reference_ngram_ban, _synthetic_output
+from inference_backend import NGRAM_SIZE, NGRAM_WHITELIST_TOKEN_IDS, NGRAM_WINDOW_SIZE
+from ngram_processor import NGramBanLogitsProcessor
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_banned_tokens_match_reference(seed):
+    tokens = _synthetic_output(2048, seed)
+    processor = NGramBanLogitsProcessor(
+        ngram_size=NGRAM_SIZE,
+        window_size=NGRAM_WINDOW_SIZE,
+        whitelist_token_ids=NGRAM_WHITELIST_TOKEN_IDS
+    )
+    scores = np.zeros(max(NGRAM_WHITELIST_TOKEN_IDS) + 1, dtype=np.float32)
+    banned_steps = 0
+    for length in range(len(tokens)):
+        _, expected = _reference_ngram_ban(
+            tokens[:length], scores, NGRAM_SIZE, NGRAM_WINDOW_SIZE, NGRAM_WHITELIST_TOKEN_IDS
+        )
+        assert set(processor.banned_tokens(tokens[:length])) == expected
+        banned_steps += bool(expected)
+    # 合成出力には繰り返しが含まれ、禁止トークンが発生する
+    assert banned_steps > 0
+
+
+def test_whitelisted_tokens_are_not_banned():
+    processor = NGramBanLogitsProcessor(ngram_size=3, window_size=100, whitelist_token_ids=[7])
+    assert processor.banned_tokens([1, 2, 7, 1, 2]) == []
+    assert processor.banned_tokens([1, 2, 8, 1, 2]) == [8]
+
+
+def test_call_sets_banned_scores_in_place():
+    processor = NGramBanLogitsProcessor(ngram_size=3, window_size=100)
+    scores = np.zeros(10, dtype=np.float32)
+    result = processor([1, 2, 5, 1, 2], scores)
+    assert result is scores
+    assert scores[5] == -np.inf
+    assert np.count_nonzero(np.isinf(scores)) == 1
@@ -0,0 +1,72 @@
+"""
+OCR処理（PDFのページごとの推論）のテスト
+"""
+
+import asyncio
+
+import pymupdf
+
+import ocr_pipeline
+from deepseek_ocr_engine import DeepSeekOCREngine
+from inference_backend import FakeBackend
+from job_queue import JobProgress
+
+PROMPT = '<image>\nFree OCR.'
+
+
+def make_engine(max_in_flight: int = 60, max_queued: int = 100) -> DeepSeekOCREngine:
+    return DeepSeekOCREngine(
+        backend=FakeBackend(output_text="text " * 10, latency=0.05, tokens_per_second=10000),
+        max_in_flight=max_in_flight,
+        max_queued=max_queued
+    )
+
+
+def make_pdf(pages: int) -> bytes:
+    document = pymupdf.open()
+    for number in range(1, pages + 1):
+        page = document.new_page(width=200, height=300)
+        page.insert_text((20, 40), f"Page {number}")
+    content = document.tobytes()
+    document.close()
+    return content
+
+
+def test_pdf_pages_are_limited_to_the_page_concurrency(monkeypatch):
+    # 推論枠2件・待ち行列なしのエンジンでも、同時に投入するページを枠の数までに抑えれば全ページを処理できる
+    engine = make_engine(max_in_flight=2, max_queued=0)
+    monkeypatch.setattr(ocr_pipeline, 'ocr_engine', engine)
+    monkeypatch.setattr(ocr_pipeline, 'PAGE_CONCURRENCY', 2)
+
+    async def main():
+        await engine.initialize()
+        pages = await ocr_pipeline._ocr_pdf_pages(
+            make_pdf(6), "doc.pdf", False, PROMPT, 1, None, use_cache=False
+        )
+        engine.shutdown()
+        return pages
+
+    pages = asyncio.run(main())
+    assert [page["page"] for page in pages] == [1, 2, 3, 4, 5, 6]
+    assert all(page["num_tokens"] > 0 for page in pages)
+
+
+def test_finished_pages_are_not_generated_again(monkeypatch):
+    # 再投入されたジョブは、前回の実行で推論済みのページを推論しない（生成が失敗するエンジンでも完了する）
+    content = make_pdf(3)
+    progress = JobProgress()
+
+    async def run(healthy: bool):
+        engine = make_engine()
+        monkeypatch.setattr(ocr_pipeline, 'ocr_engine', engine)
+        await engine.initialize()
+        engine.backend.healthy = healthy
+        pages = await ocr_pipeline._ocr_pdf_pages(
+            content, "doc.pdf", False, PROMPT, 1, None, progress, use_cache=False
+        )
+        engine.shutdown()
+        return pages
+
+    first = asyncio.run(run(healthy=True))
+    assert asyncio.run(run(healthy=False)) == first
+    assert sorted(progress.finished_pages) == [1, 2, 3] and progress.pages_done == 3
@@ -0,0 +1,66 @@
+"""
+白紙ページの判定と内容の密度によるクロップモードの選択のテスト
+"""
+
+import pytest
+from fastapi import HTTPException
+from PIL import Image, ImageDraw
+
+from page_screen import (
+    AUTO_CROP_DENSITY, CROP_MODE_AUTO, is_blank, parse_crop_mode, resolve_crop_mode, screen_page
+)
+
+
+def text_page(lines: int, size=(1240, 1754)) -> Image.Image:
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    for line in range(lines):
+        draw.text((80, 80 + line * 24), "Lorem ipsum dolor sit amet 1234567890 " * 3, fill='black')
+    return image
+
+
+def test_white_page_is_blank():
+    screen = screen_page(Image.new('RGB', (1240, 1754), 'white'))
+    assert screen["blank"] and is_blank(screen)
+
+
+def test_uneven_background_is_blank():
+    # 照明のむら（緩やかな明るさの変化）だけのスキャンは白紙
+    image = Image.linear_gradient('L').resize((1240, 1754)).point(lambda value: 200 + value // 8)
+    assert screen_page(image)["blank"]
+
+
+def test_single_line_is_not_blank():
+    image = Image.new('RGB', (2480, 3508), 'white')
+    ImageDraw.Draw(image).line((200, 1700, 2200, 1700), fill='black', width=1)
+    assert not screen_page(image)["blank"]
+
+
+def test_density_grows_with_content():
+    sparse = screen_page(text_page(2))
+    dense = screen_page(text_page(60))
+    assert not sparse["blank"] and not dense["blank"]
+    assert sparse["density"] < dense["density"]
+    assert resolve_crop_mode(CROP_MODE_AUTO, sparse) is (sparse["density"] >= AUTO_CROP_DENSITY)
+    assert resolve_crop_mode(CROP_MODE_AUTO, dense) is True
+
+
+def test_resolve_crop_mode():
+    assert resolve_crop_mode(False, {"density": 1.0}) is False
+    assert resolve_crop_mode(True, None) is True
+    assert resolve_crop_mode(CROP_MODE_AUTO, None) is True
+    assert resolve_crop_mode(CROP_MODE_AUTO, {"density": 0.0}) is False
+    assert not is_blank(None)
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("true", True), ("1", True), ("On", True), ("false", False), ("0", False), (" no ", False), ("AUTO", CROP_MODE_AUTO)
+])
+def test_parse_crop_mode(value, expected):
+    assert parse_crop_mode(value) == expected
+
+
+def test_parse_invalid_crop_mode():
+    with pytest.raises(HTTPException) as error:
+        parse_crop_mode("maybe")
+    assert error.value.status_code == 400
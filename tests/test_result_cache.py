@@ -0,0 +1,65 @@
+"""
+OCR結果キャッシュ（メモリのLRUとディスク）とキャッシュキーのテスト
+"""
+
+import json
+import os
+
+from result_cache import ResultCache, make_cache_key
+
+
+def test_cache_key_depends_on_content_and_settings():
+    key = make_cache_key(b"image", prompt="<image>\nFree OCR.", crop_mode=True)
+    assert key == make_cache_key(b"image", crop_mode=True, prompt="<image>\nFree OCR.")
+    assert key != make_cache_key(b"image", prompt="<image>\nFree OCR.", crop_mode=False)
+    assert key != make_cache_key(b"other", prompt="<image>\nFree OCR.", crop_mode=True)
+    assert key != make_cache_key(b"image", prompt="<image>\nDescribe.", crop_mode=True)
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = ResultCache(max_entries=2, max_bytes=1024 * 1024, ttl=0, cache_dir='')
+    cache.put("a", {"extracted_text": "a"})
+    cache.put("b", {"extracted_text": "b"})
+    assert cache.get("a") == {"extracted_text": "a"}
+    cache.put("c", {"extracted_text": "c"})
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["evictions"] == 1
+    assert stats["memory_hits"] == 3 and stats["misses"] == 1
+
+
+def test_memory_cache_is_bounded_by_bytes():
+    value = {"extracted_text": "x" * 100}
+    size = len(json.dumps(value).encode('utf-8'))
+    cache = ResultCache(max_entries=10, max_bytes=size * 2, ttl=0, cache_dir='')
+    for key in ("a", "b", "c"):
+        cache.put(key, value)
+    assert cache.stats()["entries"] == 2 and cache.stats()["bytes"] == size * 2
+
+    # 上限より大きい結果は保存しない
+    cache.put("large", {"extracted_text": "x" * size * 2})
+    assert cache.get("large") is None
+
+
+def test_expired_results_are_not_returned(monkeypatch):
+    cache = ResultCache(max_entries=10, max_bytes=1024 * 1024, ttl=60, cache_dir='')
+    cache.put("a", {"extracted_text": "a"})
+    now = cache._entries["a"][0]
+    monkeypatch.setattr("result_cache.time.time", lambda: now + 61)
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_disk_cache_survives_restart(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    key = make_cache_key(b"image", prompt="<image>\nFree OCR.")
+    ResultCache(cache_dir=cache_dir).put(key, {"extracted_text": "保存された結果"})
+    assert os.path.exists(os.path.join(cache_dir, key[:2], f"{key}.json"))
+
+    restarted = ResultCache(cache_dir=cache_dir)
+    assert restarted.get(key) == {"extracted_text": "保存された結果"}
+    assert restarted.stats()["disk_hits"] == 1
+    # ディスクから読んだ結果はメモリに載る
+    assert restarted.get(key) is not None and restarted.stats()["memory_hits"] == 1
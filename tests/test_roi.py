@@ -0,0 +1,54 @@
+"""
+関心領域（rois パラメータ）の解析と切り出しのテスト
+"""
+
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+from roi import MAX_ROIS, crop_roi, offset_regions, parse_rois
+
+
+def test_parse_single_box():
+    assert parse_rois("[10, 20, 110, 220.4]", pdf=False) == [{"box": [10, 20, 110, 220], "page": 1, "id": None}]
+
+
+def test_parse_boxes_with_pages_and_ids():
+    rois = parse_rois('[[0, 0, 10, 10], {"box": [5, 5, 50, 50], "page": 2, "id": "total"}]', pdf=True)
+    assert rois == [
+        {"box": [0, 0, 10, 10], "page": 1, "id": None},
+        {"box": [5, 5, 50, 50], "page": 2, "id": "total"}
+    ]
+
+
+@pytest.mark.parametrize("rois, pdf", [
+    ("not json", False),
+    ("[]", False),
+    ("[[10, 10, 5, 20]]", False),
+    ("[[-1, 0, 10, 10]]", False),
+    ("[[0, 0, true, 10]]", False),
+    ('[{"box": [0, 0, 10, 10], "page": 2}]', False),
+    ('[{"box": [0, 0, 10, 10], "page": 0}]', True),
+    (str([[0, 0, 10, 10]] * (MAX_ROIS + 1)), False)
+])
+def test_invalid_rois_are_rejected(rois, pdf):
+    with pytest.raises(HTTPException) as error:
+        parse_rois(rois, pdf)
+    assert error.value.status_code == 400
+
+
+def test_crop_roi_on_downscaled_image():
+    image = Image.new('RGB', (500, 250))
+    image.info['original_size'] = (1000, 500)
+    crop, box = crop_roi(image, [100, 100, 2000, 300])
+    # はみ出した部分は元の画像サイズに切り詰め、縮小後の座標で切り出す
+    assert box == [100, 100, 1000, 300]
+    assert crop.size == (450, 100)
+
+    with pytest.raises(HTTPException):
+        crop_roi(image, [1000, 0, 1100, 10])
+
+
+def test_offset_regions():
+    regions = [{"type": "text", "boxes": [[1, 2, 3, 4]]}]
+    assert offset_regions(regions, [100, 200, 300, 400])[0]["boxes"] == [[101, 202, 103, 204]]
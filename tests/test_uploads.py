@@ -0,0 +1,71 @@
+"""
+リクエストボディのサイズ制限と、アップロード内容の参照のテスト
+"""
+
+import tempfile
+
+import pytest
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+
+from uploads import UploadLimitMiddleware, open_upload
+
+MAX_BYTES = 1000
+
+
+def make_client():
+    app = FastAPI()
+    app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_BYTES)
+    received = []
+
+    @app.post("/upload")
+    async def upload(request: Request):
+        body = await request.body()
+        received.append(len(body))
+        return {"size": len(body)}
+
+    return TestClient(app), received
+
+
+def test_content_length_over_limit_is_rejected_before_reading():
+    client, received = make_client()
+    response = client.post("/upload", content=b"x" * (MAX_BYTES + 1))
+    assert response.status_code == 413
+    assert "上限" in response.json()["detail"]
+    assert received == []
+
+
+def test_streamed_body_over_limit_is_rejected():
+    client, received = make_client()
+
+    def chunks():
+        for _ in range(4):
+            yield b"x" * 400
+
+    # チャンク転送ではContent-Lengthがないため、受信した量で判定する
+    response = client.post("/upload", content=chunks())
+    assert response.status_code == 413
+    assert received == []
+
+
+def test_body_within_limit_is_accepted():
+    client, received = make_client()
+    response = client.post("/upload", content=b"x" * MAX_BYTES)
+    assert response.status_code == 200 and response.json() == {"size": MAX_BYTES}
+
+
+def test_open_upload_reads_memory_and_disk_files_without_copy():
+    for max_size in (1024 * 1024, 10):
+        with tempfile.SpooledTemporaryFile(max_size=max_size) as spooled:
+            spooled.write(b"uploaded image bytes")
+            with open_upload(spooled) as view:
+                assert isinstance(view, memoryview)
+                assert bytes(view) == b"uploaded image bytes"
+
+
+def test_open_upload_rejects_empty_file():
+    with tempfile.SpooledTemporaryFile() as spooled:
+        with pytest.raises(HTTPException) as error:
+            with open_upload(spooled):
+                pass
+    assert error.value.status_code == 400
@@ -0,0 +1,194 @@
+"""
+アップロード処理モジュール
+リクエストボディのサイズ制限、アップロード内容のコピーなしでの参照、リクエストごとのメモリ使用量の管理
+"""
+
+import io
+import json
+import mmap
+import os
+import threading
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator
+
+from fastapi import HTTPException
+
+from metrics import record_error
+
+# リクエストボディの最大サイズ（バイト、0の場合は無制限）
+MAX_UPLOAD_BYTES = int(os.environ.get('OCR_MAX_UPLOAD_BYTES', str(100 * 1024 * 1024)))
+
+# デコード・前処理で同時に使用できるメモリの上限（バイト、0の場合は無制限）
+MEMORY_BUDGET_BYTES = int(os.environ.get('OCR_MEMORY_BUDGET_BYTES', '0'))
+
+
+class UploadTooLarge(HTTPException):
+    """
+    リクエストボディが上限を超えた場合のエラー（413）
+
+    FastAPIのボディ解析はHTTPException以外の例外を400に変換するため、HTTPExceptionを継承する。
+    """
+
+    def __init__(self, max_bytes: int):
+        super().__init__(
+            status_code=413,
+            detail=f"アップロードサイズが上限（{max_bytes}バイト）を超えています"
+        )
+
+
+class UploadLimitMiddleware:
+    """
+    リクエストボディのサイズを制限するASGIミドルウェア
+
+    Content-Lengthが上限を超える場合はボディを読む前に413を返し、
+    チャンク転送などでサイズが分からない場合は受信した量が上限を超えた時点で中断する。
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.max_bytes <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    content_length = int(value)
+                except ValueError:
+                    break
+                if content_length > self.max_bytes:
+                    await self._reject(send)
+                    return
+                break
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise UploadTooLarge(self.max_bytes)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    async def _reject(self, send):
+        error = UploadTooLarge(self.max_bytes)
+        record_error(error)
+        body = json.dumps({"detail": error.detail}, ensure_ascii=False).encode('utf-8')
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close")
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+@contextmanager
+def open_upload(file_obj: BinaryIO) -> Iterator[memoryview]:
+    """
+    アップロードファイル（SpooledTemporaryFile）の内容をコピーせずに参照する
+
+    BytesIOの場合はバッファを、それ以外はディスクに書き出したファイルのmmapを返す。
+    withブロックを抜けると参照は無効になる。
+
+    Args:
+        file_obj: アップロードファイルのファイルオブジェクト（UploadFile.file）
+
+    Yields:
+        memoryview: ファイル内容
+
+    Raises:
+        HTTPException: ファイルが空の場合（400）
+    """
+    file_obj.seek(0, os.SEEK_END)
+    size = file_obj.tell()
+    file_obj.seek(0)
+    if size == 0:
+        raise HTTPException(
+            status_code=400,
+            detail="アップロードされたファイルが空です"
+        )
+
+    if isinstance(file_obj, io.BytesIO):
+        view = file_obj.getbuffer()
+        try:
+            yield view
+        finally:
+            view.release()
+        return
+
+    # メモリ上にあるSpooledTemporaryFileは一時ファイルに書き出してからmmapする
+    rollover = getattr(file_obj, 'rollover', None)
+    if rollover is not None:
+        rollover()
+    mapped = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        view = memoryview(mapped)
+        try:
+            yield view
+        finally:
+            view.release()
+    finally:
+        mapped.close()
+
+
+class MemoryBudget:
+    """
+    リクエストごとのメモリ使用量（デコード・前処理のピークの概算）を予約制で管理
+
+    予約の合計が上限を超える場合は503を返し、コンテナがOOMで停止する前に負荷を制限する。
+    上限より大きい1件の予約は、他に予約がない場合のみ許可する。
+    """
+
+    def __init__(self, max_bytes: int = MEMORY_BUDGET_BYTES):
+        self.max_bytes = max_bytes
+        self._reserved = 0
+        self._lock = threading.Lock()
+
+    def reserved_bytes(self) -> int:
+        return self._reserved
+
+    @contextmanager
+    def reserve(self, nbytes: int) -> Iterator[None]:
+        """
+        withブロックの間、指定したバイト数を予約する
+
+        Args:
+            nbytes: 予約するバイト数
+
+        Raises:
+            HTTPException: 予約の合計が上限を超える場合（503）
+        """
+        with self._lock:
+            if self.max_bytes > 0 and self._reserved > 0 and self._reserved + nbytes > self.max_bytes:
+                raise HTTPException(
+                    status_code=503,
+                    detail="サーバーのメモリが不足しています。しばらく待ってから再度お試しください。",
+                    headers={"Retry-After": "1"}
+                )
+            self._reserved += nbytes
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._reserved -= nbytes
+
+    def stats(self) -> dict:
+        return {
+            "memory_reserved_bytes": self._reserved,
+            "memory_budget_bytes": self.max_bytes
+        }
+
+
+# グローバルメモリバジェットインスタンス
+memory_budget = MemoryBudget()
@@ -0,0 +1,126 @@
+"""
+ワーカープールモジュール
+画像のデコードや前処理などCPU負荷の高い処理をイベントループ外で実行
+"""
+
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import HTTPException
+
+from metrics import STAGE_SECONDS, WORKER_POOL_WAIT_SECONDS
+
+# プールの種類（thread: スレッドプール, process: プロセスプール）
+POOL_TYPE = os.environ.get('OCR_PREPROCESS_POOL', 'thread')
+
+# ワーカー数
+POOL_WORKERS = int(os.environ.get('OCR_PREPROCESS_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+
+def _timed_call(func: Callable, args: tuple):
+    """
+    ワーカー内で関数を実行し、開始・終了時刻とともに結果を返す
+
+    HTTPExceptionはpickleできないため、プロセス間ではステータスと詳細のみを返す。
+    """
+    started = time.time()
+    try:
+        result = func(*args)
+    except HTTPException as e:
+        return None, (e.status_code, e.detail), started, time.time()
+    return result, None, started, time.time()
+
+
+class WorkerPool:
+    """
+    CPU処理用のワーカープール
+
+    各処理の待ち時間（プールの空き待ち）と実行時間をステージごとに記録する。
+    """
+
+    def __init__(self, pool_type: str = POOL_TYPE, max_workers: int = POOL_WORKERS):
+        if pool_type not in ('thread', 'process'):
+            raise ValueError(f"不正なプール種別です: {pool_type} (thread または process)")
+        self.pool_type = pool_type
+        self.max_workers = max_workers
+        self.executor: Optional[Executor] = None
+
+    def start(self):
+        """
+        ワーカープールを起動
+        """
+        if self.executor is not None:
+            return
+        if self.pool_type == 'process':
+            # CUDA初期化済みのプロセスをforkしないようspawnで起動
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        else:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix='ocr-worker'
+            )
+        print(f"ワーカープールを起動しました: 種別={self.pool_type}, ワーカー数={self.max_workers}")
+
+    def shutdown(self):
+        """
+        ワーカープールを停止
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+            print("ワーカープールを停止しました")
+
+    async def run(
+        self,
+        stage: str,
+        func: Callable,
+        *args,
+        timings: Optional[Dict[str, float]] = None
+    ) -> Any:
+        """
+        関数をワーカープールで実行
+
+        プロセスプールの場合、funcと引数はpickle可能である必要がある。
+
+        Args:
+            stage: 処理ステージ名（タイミング記録のキー）
+            func: 実行する関数
+            *args: 関数の引数
+            timings: ステージごとの処理時間（ミリ秒）を記録する辞書
+                （`{stage}_ms` に実行時間、`{stage}_wait_ms` に空き待ち時間）
+
+        Returns:
+            Any: 関数の戻り値
+        """
+        if self.executor is None:
+            self.start()
+
+        submitted = time.time()
+        loop = asyncio.get_running_loop()
+        result, http_error, started, finished = await loop.run_in_executor(
+            self.executor, _timed_call, func, args
+        )
+
+        wait_seconds = max(0.0, started - submitted)
+        run_seconds = finished - started
+        WORKER_POOL_WAIT_SECONDS.observe(wait_seconds, stage=stage)
+        STAGE_SECONDS.observe(run_seconds, stage=stage)
+        if timings is not None:
+            timings[f"{stage}_wait_ms"] = round(wait_seconds * 1000, 2)
+            timings[f"{stage}_ms"] = round(run_seconds * 1000, 2)
+
+        if http_error is not None:
+            status_code, detail = http_error
+            raise HTTPException(status_code=status_code, detail=detail)
+        return result
+
+
+# グローバルワーカープールインスタンス
+worker_pool = WorkerPool()